@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+from celery.schedules import crontab
 import os
 from dotenv import load_dotenv
 
@@ -127,6 +128,12 @@ DATABASES = {
         'PASSWORD': os.getenv("SUPABASE_DB_PASSWORD"),
         'HOST': os.getenv("SUPABASE_DB_HOST"),
         'PORT': os.getenv("SUPABASE_DB_PORT", 5432),
+        # Seconds to keep a connection open between requests/tasks instead of
+        # reconnecting (and redoing the TLS handshake), checked before reuse.
+        # Leave at 0 for the ASGI web process: each request runs its sync code in
+        # its own thread, so persistent connections would pile up there.
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -222,6 +229,14 @@ LOGGING = {
     },
 }
 
+# Cache (Redis, shared by every web and Celery worker)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+    }
+}
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
@@ -229,4 +244,21 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    # Rebuild profile embeddings from scratch to correct drift in the incremental sums
+    'recompute-user-embeddings': {
+        'task': 'cooking.tasks.recompute_user_embeddings',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # Recompute every user's recommendations in one batch, after the profile recompute
+    'materialize-recommendations': {
+        'task': 'cooking.tasks.materialize_all_recommendations',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    # Publish a fresh memory-mapped snapshot of the in-process vector index
+    'snapshot-vector-index': {
+        'task': 'cooking.tasks.snapshot_vector_index',
+        'schedule': crontab(minute=15),
+    },
+}
 
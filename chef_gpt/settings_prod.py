@@ -49,6 +49,12 @@ DATABASES = {
         'PASSWORD': os.getenv('SUPABASE_DB_PASSWORD'),
         'HOST': os.getenv('SUPABASE_DB_HOST'),
         'PORT': os.getenv('SUPABASE_DB_PORT', '5432'),
+        # Seconds to keep a connection open between requests/tasks instead of
+        # reconnecting (and redoing the TLS handshake), checked before reuse.
+        # Leave at 0 for the ASGI web process: each request runs its sync code in
+        # its own thread, so persistent connections would pile up there.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
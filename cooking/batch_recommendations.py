@@ -0,0 +1,181 @@
+import os
+import time
+import logging
+import resource
+import numpy as np
+from django.utils import timezone
+from .models import SavedRecipe, UserEmbedding
+from . import vector_index
+
+logger = logging.getLogger(__name__)
+
+# Users scored together in one matrix multiply, and recipes per multiply; the
+# score block is USER_BLOCK x RECIPE_BLOCK float32 (64 MB at the defaults)
+USER_BLOCK = int(os.getenv('RECOMMENDATION_BATCH_USERS', 1024))
+RECIPE_BLOCK = int(os.getenv('RECOMMENDATION_BATCH_RECIPES', 16384))
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def recipe_blocks(state, block_rows=RECIPE_BLOCK):
+    """
+    Yield (ids, normalized vectors, live mask) blocks of a vector index state.
+
+    Snapshot rows are read from the memory map a block at a time, so the
+    recipe matrix is never copied whole.
+    """
+    for start in range(0, len(state.snapshot_ids), block_rows):
+        end = start + block_rows
+        yield (state.snapshot_ids[start:end], np.asarray(state.snapshot_vectors[start:end]),
+               state.snapshot_live[start:end])
+    for start in range(0, len(state.delta_ids), block_rows):
+        end = start + block_rows
+        ids = state.delta_ids[start:end]
+        yield ids, state.delta_vectors[start:end], np.ones(len(ids), dtype=bool)
+
+
+def top_k_blocked(user_vectors, excluded, blocks, k):
+    """
+    Top-k cosine similarity for many users against blocks of recipes.
+
+    Each recipe block is one matrix multiply for every user; excluded and
+    deleted recipes are masked to -inf before the block's top k is merged
+    into the running top k.
+
+    Args:
+        user_vectors (ndarray): (users, dimensions) profile embeddings
+        excluded (list): Per user, the recipe ids to leave out (e.g. their saved recipes)
+        blocks (iterable): (ids, normalized vectors, live mask) recipe blocks
+        k (int): Recommendations per user
+
+    Returns:
+        tuple: (ids, scores), each (users, k) and best first; missing entries
+            have id -1 and score -inf
+    """
+    users = _normalize(np.asarray(user_vectors, dtype=np.float32))
+    best_scores = np.full((len(users), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(users), k), -1, dtype=np.int64)
+
+    # (user row, recipe id) pairs to mask, flattened once for the whole user block
+    excluded_rows = np.repeat(np.arange(len(users)), [len(ids) for ids in excluded])
+    excluded_ids = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in excluded]) \
+        if excluded_rows.size else np.empty(0, dtype=np.int64)
+
+    for ids, vectors, live in blocks:
+        if not len(ids):
+            continue
+        scores = users @ vectors.T
+        if not live.all():
+            scores[:, ~live] = -np.inf
+        if excluded_ids.size:
+            order = np.argsort(ids)
+            positions = np.minimum(np.searchsorted(ids, excluded_ids, sorter=order), len(ids) - 1)
+            hit = ids[order[positions]] == excluded_ids
+            scores[excluded_rows[hit], order[positions[hit]]] = -np.inf
+
+        # The block's own top k, then merged with the running top k
+        block_k = min(k, len(ids))
+        top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+        candidate_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        candidate_ids = np.concatenate([best_ids, ids[top]], axis=1)
+        keep = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+        best_ids = np.take_along_axis(candidate_ids, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def materialize_recommendations(k, user_block=USER_BLOCK, recipe_block=RECIPE_BLOCK):
+    """
+    Recompute every user's recommendations in one pass over the recipe vectors.
+
+    Profiles are read USER_BLOCK at a time and scored against the in-process
+    vector index's recipe blocks, excluding each user's saved recipes. Each
+    block's results are written with one bulk update. Users whose
+    recommendations were refreshed by the per-user task while the job ran are
+    left alone.
+
+    Args:
+        k (int): Recommendations per user
+
+    Returns:
+        dict: users updated and skipped, recipes scanned, seconds,
+            users_per_second and peak_memory_mb
+    """
+    started_at = timezone.now()
+    start_time = time.perf_counter()
+    state = vector_index.index.refresh()
+    dimensions = state.dimensions
+    updated = skipped = 0
+    if not len(state):
+        logger.info("No recipe vectors to recommend from")
+
+    profiles = UserEmbedding.objects.order_by('id')
+    last_id = 0
+    while len(state):
+        rows = list(profiles.filter(id__gt=last_id).values_list('id', 'user_id', 'embedding')[:user_block])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        # Profiles not computed yet, or from another embedding backend
+        profiles_read = len(rows)
+        rows = [row for row in rows if row[2] and len(row[2]) == dimensions]
+        skipped += profiles_read - len(rows)
+        if not rows:
+            continue
+
+        saved = {}
+        for user_id, embedding_id in SavedRecipe.objects.filter(
+            user_id__in=[row[1] for row in rows], embedding_id__isnull=False
+        ).values_list('user_id', 'embedding_id'):
+            saved.setdefault(user_id, []).append(embedding_id)
+
+        ids, scores = top_k_blocked(
+            np.array([row[2] for row in rows], dtype=np.float32),
+            [saved.get(row[1], []) for row in rows],
+            recipe_blocks(state, recipe_block),
+            k
+        )
+
+        # Leave profiles the per-user task has refreshed since the job started
+        fresher = set(UserEmbedding.objects.filter(
+            id__in=[row[0] for row in rows], last_updated__gt=started_at
+        ).values_list('id', flat=True))
+        now = timezone.now()
+        profiles_to_update = []
+        for row, user_ids, user_scores in zip(rows, ids, scores):
+            if row[0] in fresher:
+                continue
+            found = np.isfinite(user_scores)
+            profiles_to_update.append(UserEmbedding(id=row[0], last_updated=now, recommendations=[
+                {'recipe_id': int(recipe_id), 'similarity_score': float(score)}
+                for recipe_id, score in zip(user_ids[found], user_scores[found])
+            ]))
+        UserEmbedding.objects.bulk_update(profiles_to_update, ['recommendations', 'last_updated'])
+        updated += len(profiles_to_update)
+        skipped += len(rows) - len(profiles_to_update)
+
+    seconds = time.perf_counter() - start_time
+    stats = {
+        'users': updated,
+        'skipped': skipped,
+        'recipes': len(state),
+        'seconds': seconds,
+        'users_per_second': updated / seconds if seconds else 0.0,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+    logger.info(
+        f"Materialized recommendations for {updated} users over {stats['recipes']} recipes in {seconds:.1f}s "
+        f"({stats['users_per_second']:.0f} users/s, peak memory {stats['peak_memory_mb']:.0f} MB)"
+    )
+    return stats
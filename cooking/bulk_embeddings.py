@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from psycopg2.extras import execute_values
+from . import embeddings as embeddings_module
+from .db_connection import get_db_connection
+from .embeddings import recipe_text, recipe_content_hash, cached_embeddings, _remember_embedding, _increment_stat
+from .token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# One embed_documents request carries at most this many tokens and inputs
+# (OpenAI accepts up to 300k tokens and 2048 inputs per request)
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', 100_000))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv('EMBEDDING_BATCH_MAX_INPUTS', 1000))
+# Requests in flight at once
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+# Account limits the batches are paced to; requests that still hit a 429 are
+# retried with backoff by the OpenAI client
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', 3000))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', 1_000_000))
+
+class RateLimiter:
+    """
+    Thread-safe token bucket pacing requests and tokens per minute.
+
+    Both buckets start full and refill continuously, so a burst up to the
+    per-minute limits goes out at once and the rest at the sustained rate.
+    """
+
+    def __init__(self, requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.available = dict(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        for name, capacity in self.capacity.items():
+            self.available[name] = min(capacity, self.available[name] + elapsed * capacity / 60)
+
+    def acquire(self, tokens):
+        """Block until one request of `tokens` tokens fits within the limits."""
+        # A batch larger than a whole minute's allowance waits for a full bucket
+        wanted = {'requests': 1, 'tokens': min(tokens, self.capacity['tokens'])}
+        while True:
+            with self._lock:
+                self._refill(self._clock())
+                wait = max(
+                    (wanted[name] - self.available[name]) * 60 / self.capacity[name]
+                    for name in wanted
+                )
+                if wait <= 0:
+                    for name in wanted:
+                        self.available[name] -= wanted[name]
+                    return
+                self.waited_seconds += wait
+            self._sleep(wait)
+
+def batch_by_tokens(items, token_counts, max_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+                    max_inputs=EMBEDDING_BATCH_MAX_INPUTS):
+    """
+    Group items, in order, into batches under a token and an input budget.
+
+    An item larger than max_tokens on its own gets a batch to itself.
+
+    Returns:
+        list: (items, total tokens) per batch
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for item, tokens in zip(items, token_counts):
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_inputs):
+            batches.append((batch, batch_tokens))
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        batches.append((batch, batch_tokens))
+    return batches
+
+def store_recipe_embeddings(recipes):
+    """
+    Store many embedded recipes with one multi-row insert.
+
+    Recipes whose content_hash is already stored are not inserted again.
+
+    Args:
+        recipes (list): Recipe dicts with embedding and content_hash, one per content_hash
+
+    Returns:
+        dict: content_hash -> recipe_embeddings id
+    """
+    if not recipes:
+        return {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO public.recipe_embeddings
+                (title, cuisine, difficulty, ingredients, instructions, tips, embedding, content_hash)
+                VALUES %s
+                ON CONFLICT (content_hash) WHERE content_hash IS NOT NULL DO NOTHING
+            """, [
+                (recipe['title'], recipe['cuisine'], recipe['difficulty'], recipe['ingredients'],
+                 recipe['instructions'], recipe['tips'], recipe['embedding'], recipe['content_hash'])
+                for recipe in recipes
+            ], template="(%s, %s, %s, %s, %s, %s, %s::vector, %s)", page_size=len(recipes))
+            # Both the rows just inserted and those that were already there
+            cur.execute("""
+                SELECT content_hash, id FROM public.recipe_embeddings
+                WHERE content_hash = ANY(%s)
+            """, ([recipe['content_hash'] for recipe in recipes],))
+            return dict(cur.fetchall())
+
+def _embed_batch(batch, tokens, limiter):
+    limiter.acquire(tokens)
+    vectors = embeddings_module.embeddings.embed_documents([recipe_text(recipe) for recipe in batch])
+    for recipe, vector in zip(batch, vectors):
+        recipe['embedding'] = vector
+        _remember_embedding(recipe['content_hash'], vector)
+    return store_recipe_embeddings(batch)
+
+def bulk_embed_recipes(recipes, max_tokens=EMBEDDING_BATCH_MAX_TOKENS, max_inputs=EMBEDDING_BATCH_MAX_INPUTS,
+                       concurrency=EMBEDDING_CONCURRENCY, limiter=None):
+    """
+    Embed and store many recipes, batching the API calls and the inserts.
+
+    Recipes are content-addressed as in generate_recipe_embedding: those
+    embedded before reuse their vector, and identical recipes are embedded
+    once. The rest go out as embed_documents batches sized by token count,
+    several at a time under the rate limiter, and each batch is written back
+    with one insert as soon as it returns.
+
+    Args:
+        recipes (list): Recipe dicts, as for generate_recipe_embedding
+        max_tokens (int): Token budget per API request
+        max_inputs (int): Recipes per API request
+        concurrency (int): Requests in flight at once
+        limiter (RateLimiter): Shared pacing, e.g. across calls; a fresh one by default
+
+    Returns:
+        dict: Embedding ids per input recipe (None where its batch failed),
+            plus counts of recipes embedded and reused, batches, tokens and seconds
+    """
+    start_time = time.perf_counter()
+    limiter = limiter or RateLimiter()
+
+    unique = {}
+    hashes = []
+    for recipe in recipes:
+        content_hash = recipe_content_hash(recipe_text(recipe))
+        hashes.append(content_hash)
+        unique.setdefault(content_hash, dict(recipe, content_hash=content_hash))
+
+    found = cached_embeddings(list(unique))
+    reused, pending = [], []
+    for content_hash, recipe in unique.items():
+        if content_hash in found:
+            recipe['embedding'] = found[content_hash]
+            reused.append(recipe)
+        else:
+            pending.append(recipe)
+    _increment_stat('misses', len(pending))
+
+    token_counts = [count_tokens(recipe_text(recipe), embeddings_module.embeddings.model) for recipe in pending]
+    batches = batch_by_tokens(pending, token_counts, max_tokens, max_inputs)
+
+    # Vectors that were cached locally may not have a row yet
+    ids = store_recipe_embeddings(reused)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = {executor.submit(_embed_batch, batch, tokens, limiter): batch for batch, tokens in batches}
+        for future in as_completed(futures):
+            try:
+                ids.update(future.result())
+            except Exception as e:
+                failed += len(futures[future])
+                logger.error(f"Embedding batch of {len(futures[future])} recipes failed: {str(e)}")
+
+    return {
+        'ids': [ids.get(content_hash) for content_hash in hashes],
+        'embedded': len(pending) - failed,
+        'reused': len(reused),
+        'failed': failed,
+        'batches': len(batches),
+        'tokens': sum(token_counts),
+        'seconds': time.perf_counter() - start_time,
+    }
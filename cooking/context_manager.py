@@ -1,132 +1,296 @@
 from typing import List, Dict
+from collections import deque
+from functools import lru_cache
 import re
+from django.db import transaction
 from .models import ChatSession, Message
+from . import intent_classifier, token_budget
+from .token_budget import DEFAULT_MODEL, TOKENS_PER_MESSAGE, count_message_tokens, history_budget
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def classify_message_type(content: str) -> str:
-    """
-    Classify the type of message based on its content.
-    """
-    content_lower = content.lower()
-    
-    # Check for recipe creation patterns
-    if any(phrase in content_lower for phrase in [
+# Trigger phrases per message type, in priority order: the first type with a
+# phrase anywhere in the message wins
+MESSAGE_TYPE_PHRASES = [
+    ("recipe_creation", [
         "recipe for", "how to make", "how do i make", "can you give me a recipe",
         "i want to make", "create a recipe", "write a recipe"
-    ]):
-        logger.info(f"Message classified as recipe_creation: {content[:50]}...")
-        return "recipe_creation"
-    
-    # Check for recipe modification patterns
-    if any(phrase in content_lower for phrase in [
+    ]),
+    ("recipe_modification", [
         "modify", "change", "adjust", "instead of", "substitute", "add", "remove", "omit",
         "make it", "can we", "could we", "spicier", "sweeter", "sour", "less", "more",
         "gluten-free", "vegan", "vegetarian", "healthy", "lighter", "dairy-free"
-    ]):
-        logger.info(f"Message classified as recipe_modification: {content[:50]}...")
-        return "recipe_modification"
-    
-    # Check for cooking question patterns
-    if any(phrase in content_lower for phrase in [
+    ]),
+    ("cooking_question", [
         "how do i", "what temperature", "how long", "when should i",
         "is it done", "what does it mean", "how can i tell", "what if"
-    ]):
-        logger.info(f"Message classified as cooking_question: {content[:50]}...")
-        return "cooking_question"
-    
-    logger.info(f"Message classified as general_question: {content[:50]}...")
+    ]),
+]
+
+def classify_by_keywords(content: str) -> str:
+    """
+    Classify a message with the keyword rules alone.
+    """
+    content_lower = content.lower()
+
+    # Plain substring checks: CPython's `in` beats a compiled alternation here
+    # (see ClassifierBenchmarkTest)
+    for message_type, phrases in MESSAGE_TYPE_PHRASES:
+        for phrase in phrases:
+            if phrase in content_lower:
+                return message_type
+
     return "general_question"
 
+@lru_cache(maxsize=1024)
+def classify_message_type(content: str) -> str:
+    """
+    Classify the type of message based on its content.
+
+    Uses the trained intent model when there is one and it is confident,
+    otherwise the keyword rules. Results are memoized, so the view, the
+    response cache and the context builder all share one classification of
+    the same message.
+    """
+    message_type = intent_classifier.predict_message_types([content])[0]
+    source = "intent model"
+    if message_type is None:
+        message_type = classify_by_keywords(content)
+        source = "keyword rules"
+
+    logger.info(f"Message classified as {message_type} by {source}: {content[:50]}...")
+    return message_type
+
+# How many of the latest modifications and Q&A pairs the summary keeps
+SUMMARY_MAX_MODIFICATIONS = 3
+SUMMARY_MAX_QA = 3
+
 def create_conversation_summary(chat_session: ChatSession) -> str:
     """
-    Create a summary of the conversation, focusing on the recipe and important modifications.
+    Fold the messages added since the last summary into the chat's summary.
+
+    The structured state in `chat_session.summary_state` (current recipe, the
+    latest modifications and Q&A pairs) is updated from the new messages only,
+    in one pass, and `recipe_summary` is re-rendered from it.
     """
     logger.info(f"Creating summary for chat session {chat_session.id}")
-    
-    # Get all unsummarized messages
-    messages = Message.objects.filter(
-        chat=chat_session,
-        is_summarized=False
-    ).order_by('created_at')
-    
-    logger.info(f"Found {messages.count()} unsummarized messages")
-    
-    if not messages.exists():
-        logger.info("No messages to summarize, returning existing summary")
-        return chat_session.recipe_summary or ""
-
-    # Initialize summary sections
-    recipe_content = ""
-    modifications = []
-    important_qa = []
-    
+
+    with transaction.atomic():
+        # Get all unsummarized messages
+        messages = list(Message.objects.filter(
+            chat=chat_session,
+            is_summarized=False
+        ).only('role', 'content', 'message_type', 'is_recipe').order_by('created_at', 'id'))
+
+        logger.info(f"Found {len(messages)} unsummarized messages")
+
+        if not messages:
+            logger.info("No messages to summarize, returning existing summary")
+            return chat_session.recipe_summary or ""
+
+        state = _fold_messages(chat_session.summary_state or {}, messages)
+
+        # Mark messages as summarized
+        Message.objects.filter(pk__in=[msg.pk for msg in messages]).update(is_summarized=True)
+
+        # Update chat session
+        summary = _render_summary(state)
+        chat_session.summary_state = state
+        chat_session.recipe_summary = summary
+        chat_session.last_summary_at = chat_session.message_count
+        chat_session.save(update_fields=['summary_state', 'recipe_summary', 'last_summary_at'])
+
+    logger.info(f"Created summary from {len(messages)} new messages")
+    return summary
+
+def _fold_messages(state: Dict, messages) -> Dict:
+    """
+    Apply new messages (oldest first) to a summary state and return the new state.
+
+    A cooking question is answered by the message right after it, so pairs are
+    matched while walking the list; a question that is the last message so far
+    is kept as pending until its answer arrives with the next batch.
+    """
+    recipe = state.get('recipe', '')
+    modifications = deque(state.get('modifications', []), maxlen=SUMMARY_MAX_MODIFICATIONS)
+    qa_pairs = deque(state.get('qa', []), maxlen=SUMMARY_MAX_QA)
+    pending_question = state.get('pending_question')
+
     for msg in messages:
-        if msg.role == 'assistant' and '<h2 data-recipe="title">' in msg.content:
-            logger.info("Found recipe content in message")
-            recipe_content = msg.content
+        if pending_question is not None and msg.role == 'assistant':
+            qa_pairs.append(f"Q: {pending_question}\nA: {msg.content}")
+        pending_question = None
+
+        if msg.is_recipe:
+            recipe = msg.content
         elif msg.message_type == 'recipe_modification' and msg.role == 'assistant':
-            logger.info("Found recipe modification")
             modifications.append(msg.content)
         elif msg.message_type == 'cooking_question':
-            logger.info("Found cooking Q&A")
-            question = msg.content
-            answer = Message.objects.filter(
-                chat=chat_session,
-                created_at__gt=msg.created_at
-            ).first()
-            if answer and answer.role == 'assistant':
-                important_qa.append(f"Q: {question}\nA: {answer.content}")
-    
-    # Build the summary
+            pending_question = msg.content
+
+    return {
+        'recipe': recipe,
+        'modifications': list(modifications),
+        'qa': list(qa_pairs),
+        'pending_question': pending_question,
+    }
+
+def _render_summary(state: Dict) -> str:
     summary_parts = []
-    
-    if recipe_content:
-        summary_parts.append("CURRENT RECIPE:\n" + recipe_content)
-    
-    if modifications:
-        summary_parts.append("MODIFICATIONS:\n" + "\n".join(modifications[-3:]))  # Keep last 3 modifications
-    
-    if important_qa:
-        summary_parts.append("IMPORTANT Q&A:\n" + "\n".join(important_qa[-3:]))  # Keep last 3 Q&As
-    
-    # Mark messages as summarized
-    messages.update(is_summarized=True)
-    
-    # Update chat session
-    summary = "\n\n".join(summary_parts)
-    chat_session.recipe_summary = summary
-    chat_session.last_summary_at = chat_session.message_count
-    chat_session.save()
-    
-    logger.info(f"Created summary with {len(summary_parts)} sections")
-    return summary
 
-def get_relevant_context(chat_session: ChatSession, current_message: str) -> List[Dict[str, str]]:
+    if state['recipe']:
+        summary_parts.append("CURRENT RECIPE:\n" + state['recipe'])
+
+    if state['modifications']:
+        summary_parts.append("MODIFICATIONS:\n" + "\n".join(state['modifications']))
+
+    if state['qa']:
+        summary_parts.append("IMPORTANT Q&A:\n" + "\n".join(state['qa']))
+
+    return "\n\n".join(summary_parts)
+
+# Cap on the recent-message window; its token budget comes from token_budget.history_budget
+MAX_CONTEXT_MESSAGES = 6
+
+def _latest_recipe_query(chat_session: ChatSession):
+    return Message.objects.filter(
+        chat=chat_session,
+        is_recipe=True
+    ).order_by('-created_at', '-id')
+
+# The latest recipe plus the newest messages whose running token total fits the
+# history budget, in one round trip. The budget depends on the recipe's size, so
+# it is worked out in the database from the recipe's stored token count (rows
+# saved before counts were stored use the same estimate as token_budget.count_tokens).
+# Written as raw SQL because compiling the equivalent window/subquery ORM
+# expression costs more per call than the round trip it saves.
+CONTEXT_SQL = """
+    SELECT id, role, content, created_at, is_recipe, running_tokens, recency_rank, history_budget
+    FROM (
+        SELECT m.id, m.role, m.content, m.created_at, m.is_recipe,
+               SUM(COALESCE(m.token_count, LENGTH(m.content) / 3 + 1) + %(tokens_per_message)s)
+                   OVER newest_first AS running_tokens,
+               ROW_NUMBER() OVER newest_first AS recency_rank,
+               COALESCE(recipe.history_budget, %(budget_without_recipe)s) AS history_budget,
+               CASE WHEN m.id = recipe.id THEN 1 ELSE 0 END AS is_latest_recipe
+        FROM cooking_message m
+        LEFT JOIN (
+            -- Served by the (chat, is_recipe, created_at) index
+            SELECT id,
+                   CASE WHEN %(available_with_recipe)s - tokens < %(max_history_tokens)s
+                        THEN %(available_with_recipe)s - tokens
+                        ELSE %(max_history_tokens)s END AS history_budget
+            FROM (
+                SELECT id, COALESCE(token_count, LENGTH(content) / 3 + 1) AS tokens
+                FROM cooking_message
+                WHERE chat_id = %(chat_id)s AND is_recipe
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            ) latest
+        ) recipe ON 1 = 1
+        WHERE m.chat_id = %(chat_id)s
+        WINDOW newest_first AS (ORDER BY m.created_at DESC, m.id DESC)
+    ) ranked
+    WHERE is_latest_recipe = 1
+    OR (recency_rank <= %(max_messages)s AND running_tokens <= history_budget)
+    ORDER BY created_at, id
+"""
+
+def _context_query(chat_session: ChatSession, current_message: str, message_type: str, model: str,
+                   reserved_tokens: int):
+    """
+    Build the single query that fetches the latest recipe and the history window.
+
+    Only the rows that make it into the context are returned, so bodies of
+    messages that do not fit are never sent to us.
+    """
+    # Tokens left for history once the system messages are in, before the recipe's own tokens
+    available = (token_budget.context_window(model) - token_budget.COMPLETION_TOKEN_RESERVE
+                 - token_budget.TOKENS_PER_REPLY - reserved_tokens)
+    with_recipe = available - _context_tokens(_system_context(current_message, '', message_type), model)
+    without_recipe = available - _context_tokens(_system_context(current_message, None, message_type), model)
+
+    return Message.objects.raw(CONTEXT_SQL, {
+        'chat_id': chat_session.id,
+        'tokens_per_message': TOKENS_PER_MESSAGE,
+        'available_with_recipe': with_recipe,
+        'budget_without_recipe': min(without_recipe, token_budget.MAX_HISTORY_TOKENS),
+        'max_history_tokens': token_budget.MAX_HISTORY_TOKENS,
+        'max_messages': MAX_CONTEXT_MESSAGES,
+    })
+
+def has_recipe_context(chat_session: ChatSession) -> bool:
+    """
+    Check whether the chat already has a recipe the next reply would build on.
+    """
+    return _latest_recipe_query(chat_session).exists()
+
+def get_relevant_context(chat_session: ChatSession, current_message: str, model: str = DEFAULT_MODEL,
+                         reserved_tokens: int = 0) -> List[Dict[str, str]]:
     """
     Get the relevant context for the current message.
+
+    Recent messages fill whatever is left of the model's token budget after the
+    context's own system messages and `reserved_tokens` (prompt parts the caller
+    adds, e.g. its system prompt and the current message).
     """
     logger.info(f"Getting context for chat session {chat_session.id}")
-    
-    context = []
+
     message_type = classify_message_type(current_message)
-    
-    # First, find the most recent recipe message
-    recipe_message = Message.objects.filter(
-        chat=chat_session,
-        content__contains='<h2 data-recipe="title">',
-        role='assistant'
-    ).order_by('-created_at').first()
+    rows = list(_context_query(chat_session, current_message, message_type, model, reserved_tokens))
 
-    # If we have a recipe, add it first
+    return _assemble_context(current_message, message_type, rows, model, reserved_tokens)
+
+async def aget_relevant_context(chat_session: ChatSession, current_message: str, model: str = DEFAULT_MODEL,
+                                reserved_tokens: int = 0) -> List[Dict[str, str]]:
+    """
+    Async version of get_relevant_context for the ASGI chat path.
+    """
+    logger.info(f"Getting context for chat session {chat_session.id}")
+
+    message_type = classify_message_type(current_message)
+    rows = [msg async for msg in _context_query(chat_session, current_message, message_type, model, reserved_tokens)]
+
+    return _assemble_context(current_message, message_type, rows, model, reserved_tokens)
+
+def _context_tokens(context: List[Dict[str, str]], model: str) -> int:
+    return sum(count_message_tokens(msg["content"], model) for msg in context)
+
+def _assemble_context(current_message: str, message_type: str, rows, model: str,
+                      reserved_tokens: int) -> List[Dict[str, str]]:
+    """
+    Split the rows of _context_query into the recipe and the history window and build the context.
+    """
+    # Any older recipe still in the history window comes before the latest one
+    recipe_message = next((msg for msg in reversed(rows) if msg.is_recipe), None)
     if recipe_message:
         logger.info("Found and adding recipe to context")
+    context = _system_context(current_message, recipe_message.content if recipe_message else None, message_type)
+
+    # The database budget counts the recipe apart from its wrapper text; recount
+    # the assembled system messages and drop any history that no longer fits
+    budget = history_budget(model, reserved_tokens + _context_tokens(context, model))
+    history = [
+        msg for msg in rows
+        if msg.recency_rank <= MAX_CONTEXT_MESSAGES and msg.running_tokens <= min(msg.history_budget, budget)
+    ]
+
+    return _add_history(context, history, budget)
+
+def _system_context(current_message: str, recipe_content, message_type: str) -> List[Dict[str, str]]:
+    """
+    Build the system part of the context: the latest recipe and the formatting instructions.
+    """
+    context = []
+
+    # If we have a recipe, add it first
+    if recipe_content is not None:
         if message_type == "recipe_modification":
             context.append({
                 "role": "system",
-                "content": f"""Current recipe to modify:\n{recipe_message.content}
+                "content": f"""Current recipe to modify:\n{recipe_content}
 
 IMPORTANT: This is a recipe modification request. You MUST:
 1. Include the complete recipe with ALL sections and data-recipe attributes
@@ -157,12 +321,11 @@ After the recipe, you can explain the modifications made."""
         else:
             context.append({
                 "role": "system",
-                "content": f"Current recipe context:\n{recipe_message.content}\n\nWhen modifying this recipe, you MUST maintain the same HTML structure with data-recipe attributes. Always include the full recipe with all sections, even when making small changes."
+                "content": f"Current recipe context:\n{recipe_content}\n\nWhen modifying this recipe, you MUST maintain the same HTML structure with data-recipe attributes. Always include the full recipe with all sections, even when making small changes."
             })
 
     # Add the system prompt with formatting instructions only if needed
-    if "recipe" in current_message.lower() or not recipe_message:
-        logger.info("Adding recipe formatting instructions")
+    if "recipe" in current_message.lower() or recipe_content is None:
         context.append({
             "role": "system",
             "content": """You are ChefGPT, an expert cooking assistant. You help users with recipes, cooking techniques, and culinary advice. Be friendly, professional, and focus on providing accurate cooking information.
@@ -198,39 +361,28 @@ When providing or modifying recipes, ALWAYS use this EXACT format with data attr
 </ul>"""
         })
     else:
-        logger.info("Adding simplified system prompt")
         context.append({
             "role": "system",
             "content": "You are ChefGPT, an expert cooking assistant. Help with cooking techniques and answer questions about the current recipe."
         })
 
-    # Get recent relevant messages with token limit
-    recent_messages = Message.objects.filter(
-        chat=chat_session
-    ).order_by('-created_at')
-    
-    total_tokens = 0
-    selected_messages = []
-    
-    # Add messages until we hit token limit or message limit
-    for msg in recent_messages:
-        msg_tokens = len(msg.content.split())
-        if total_tokens + msg_tokens > 2000 or len(selected_messages) >= 6:  # Token limit and message limit
-            break
-        selected_messages.append(msg)
-        total_tokens += msg_tokens
-    
-    logger.info(f"Adding {len(selected_messages)} recent messages to context")
+    return context
+
+def _add_history(context: List[Dict[str, str]], history, budget: int) -> List[Dict[str, str]]:
+    """
+    Append the selected history messages (oldest first) to the context.
+    """
+    # The oldest selected message carries the running total of the whole window
+    history_tokens = history[0].running_tokens if history else 0
+    logger.info(f"Adding {len(history)} recent messages to context ({history_tokens}/{budget} history tokens)")
     
-    # Add them in chronological order
-    for msg in reversed(selected_messages):
+    for msg in history:
         context.append({
             "role": msg.role,
             "content": msg.content
         })
     
     # Log context size
-    total_tokens = sum(len(msg["content"].split()) for msg in context)
-    logger.info(f"Total context messages: {len(context)}, estimated tokens: {total_tokens}")
+    logger.info(f"Total context messages: {len(context)}")
     
-    return context 
\ No newline at end of file
+    return context
@@ -1,15 +1,234 @@
 import psycopg2
+import psycopg2.pool
 import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_db_connection():
-    """Get a database connection using environment variables."""
+logger = logging.getLogger(__name__)
+
+# Connections kept per process; each gunicorn/Celery worker has its own pool
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+# How long to wait for a free connection when all POOL_MAX_SIZE are in use
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+# Connections older than this are closed and replaced, so server-side state and
+# load balancer pinning do not live forever
+POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 30 * 60))
+# Connections idle longer than this are pinged before being handed out
+POOL_CHECK_AFTER = float(os.getenv('DB_POOL_CHECK_AFTER', 30))
+
+def _connect():
     return psycopg2.connect(
         dbname=os.getenv('SUPABASE_DB_NAME'),
         user=os.getenv('SUPABASE_DB_USER'),
         password=os.getenv('SUPABASE_DB_PASSWORD'),
         host=os.getenv('SUPABASE_DB_HOST'),
         port=os.getenv('SUPABASE_DB_PORT')
-    ) 
\ No newline at end of file
+    )
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections for the raw SQL (pgvector) queries.
+
+    Connections are opened on demand up to max_size, checked before reuse and
+    recycled after max_lifetime. After a fork the child starts with an empty
+    pool; connections inherited from the parent are never used or closed there,
+    since closing them would also end the parent's sessions.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, check_after=POOL_CHECK_AFTER):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self._condition = threading.Condition()
+        self._inherited = []
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []  # (connection, opened_at, released_at), most recently released last
+        self._opened_at = {}  # id(connection) -> opened_at, for connections handed out
+        self._connecting = 0  # Slots reserved by threads opening a new connection
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+        }
+
+    def _check_fork(self):
+        # Called with the condition held
+        if os.getpid() != self._pid:
+            self._abandon_inherited()
+
+    def _after_fork(self):
+        # Another thread may have held the lock at fork time; the child's copy would never be released
+        self._condition = threading.Condition()
+        self._abandon_inherited()
+
+    def _abandon_inherited(self):
+        # Keep references so garbage collection never closes the parent's sockets
+        self._inherited.extend(conn for conn, _, _ in self._idle)
+        self._reset()
+
+    def _close(self, conn):
+        self._stats['connections_closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, opened_at, released_at, now):
+        if conn.closed:
+            return False
+        if now - opened_at > self.max_lifetime:
+            self._stats['recycled'] += 1
+            return False
+        if now - released_at > self.check_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                self._stats['health_check_failures'] += 1
+                logger.warning(f"Discarding pooled database connection that failed its health check: {str(e)}")
+                return False
+        return True
+
+    def acquire(self):
+        """Check out a connection, reusing an idle one when possible."""
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            self._check_fork()
+            waited_from = None
+            while True:
+                while self._idle:
+                    conn, opened_at, released_at = self._idle.pop()
+                    if self._is_usable(conn, opened_at, released_at, time.monotonic()):
+                        self._stats['checkouts'] += 1
+                        self._stats['reused'] += 1
+                        self._opened_at[id(conn)] = opened_at
+                        self._record_wait(waited_from)
+                        return conn
+                    self._close(conn)
+
+                if len(self._opened_at) + self._connecting < self.max_size:
+                    # Reserve the slot before connecting outside the lock
+                    self._connecting += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(
+                        f"No database connection available within {self.timeout}s ({self.max_size} in use)"
+                    )
+                if waited_from is None:
+                    waited_from = time.monotonic()
+                    self._stats['waits'] += 1
+                self._condition.wait(remaining)
+
+        try:
+            conn = _connect()
+        except Exception:
+            with self._condition:
+                self._connecting -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._connecting -= 1
+            self._opened_at[id(conn)] = time.monotonic()
+            self._stats['connections_opened'] += 1
+            self._stats['checkouts'] += 1
+            self._record_wait(waited_from)
+        return conn
+
+    def _record_wait(self, waited_from):
+        if waited_from is not None:
+            self._stats['wait_seconds'] += time.monotonic() - waited_from
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is broken or discarded."""
+        with self._condition:
+            self._check_fork()
+            opened_at = self._opened_at.pop(id(conn), None)
+            if opened_at is None:
+                # Checked out before a fork; not ours to reuse or close
+                self._inherited.append(conn)
+                return
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                self._idle.append((conn, opened_at, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for a `with` block.
+
+        Commits when the block succeeds and rolls back when it raises, as a
+        plain psycopg2 connection used as a context manager does.
+        """
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard)
+
+    def close_all(self):
+        """Close every idle connection, e.g. at shutdown."""
+        with self._condition:
+            self._check_fork()
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+    def get_stats(self):
+        with self._condition:
+            self._check_fork()
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = len(self._opened_at) + self._connecting
+            stats['max_size'] = self.max_size
+        return stats
+
+pool = ConnectionPool()
+
+if hasattr(os, 'register_at_fork'):
+    # Prefork workers (gunicorn, Celery) start with an empty pool of their own
+    os.register_at_fork(after_in_child=lambda: pool._after_fork())
+
+def get_db_connection():
+    """
+    Get a pooled database connection, for use as a context manager.
+
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                ...
+
+    The transaction is committed (or rolled back on error) when the block
+    exits, and the connection goes back to the pool.
+    """
+    return pool.connection()
+
+def get_pool_stats():
+    """Return connection pool counters for this process."""
+    return pool.get_stats()
@@ -0,0 +1,19 @@
+from functools import wraps
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+
+def async_login_required(view_func):
+    """
+    login_required for async views.
+
+    Django's decorator reads request.user synchronously, which is not allowed
+    inside a coroutine, so this resolves the user with request.auser() instead.
+    """
+    @wraps(view_func)
+    async def _wrapper_view(request, *args, **kwargs):
+        user = await request.auser()
+        if user.is_authenticated:
+            return await view_func(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path(), settings.LOGIN_URL)
+
+    return _wrapper_view
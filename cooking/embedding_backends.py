@@ -0,0 +1,172 @@
+import os
+import re
+import zlib
+import hashlib
+import logging
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# openai (the default) or local; see get_embedding_backend
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')
+
+# recipe_embeddings.embedding is vector(1536), the size of OpenAI's embeddings;
+# other backends produce the same size so they share the storage path
+EMBEDDING_DIMENSIONS = 1536
+
+# Document frequencies fitted by `manage.py fit_local_embeddings`; without the
+# file every term is weighted equally
+LOCAL_IDF_PATH = os.getenv(
+    'LOCAL_EMBEDDING_IDF_PATH', os.path.join(os.path.dirname(__file__), 'local_embedding_idf.npy')
+)
+
+N_FEATURES = 2 ** 18
+# Output dimensions each hashed feature is projected onto
+NONZEROS_PER_FEATURE = 8
+PROJECTION_SEED = 0
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9'-]+")
+
+def _features(text, n_features=N_FEATURES):
+    """
+    Hash a text's word unigrams and bigrams into feature indices, with counts.
+
+    crc32 rather than hash() so indices are the same in every process.
+    """
+    words = _TOKEN_PATTERN.findall(text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    indices = np.fromiter(
+        (zlib.crc32(gram.encode('utf-8')) % n_features for gram in grams),
+        dtype=np.int64, count=len(grams)
+    )
+    return np.unique(indices, return_counts=True)
+
+class LocalEmbeddings(Embeddings):
+    """
+    CPU-only embeddings that need no network: hashed TF-IDF over word
+    unigrams and bigrams, reduced to EMBEDDING_DIMENSIONS by a sparse random
+    projection.
+
+    Each hashed feature adds its weight, with a random sign, to
+    NONZEROS_PER_FEATURE of the output dimensions. The projection comes from a
+    fixed seed, so every process maps the same text to the same vector, and
+    it approximately preserves the cosine similarity of the TF-IDF vectors.
+    Quality is well below OpenAI's embeddings (no synonyms, only shared
+    words), but ranking recipes by shared ingredients and techniques works.
+    """
+
+    model = 'local-hashed-tfidf'
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS, n_features=N_FEATURES, idf=None, seed=PROJECTION_SEED):
+        self.dimensions = dimensions
+        self.n_features = n_features
+        self.idf = idf
+        rng = np.random.default_rng(seed)
+        self._positions = rng.integers(dimensions, size=(n_features, NONZEROS_PER_FEATURE), dtype=np.int32)
+        self._signs = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), size=(n_features, NONZEROS_PER_FEATURE))
+
+    @property
+    def idf(self):
+        return self._idf
+
+    @idf.setter
+    def idf(self, idf):
+        # The namespace is hashed here, once, rather than on every content hash
+        self._idf = idf
+        if idf is None:
+            self._cache_namespace = f"{self.model}:{self.dimensions}"
+        else:
+            digest = hashlib.sha256(idf.tobytes()).hexdigest()[:12]
+            self._cache_namespace = f"{self.model}:{self.dimensions}:{digest}"
+
+    @property
+    def cache_namespace(self):
+        """Keeps these vectors apart from other backends' in the content-addressed cache."""
+        return self._cache_namespace
+
+    @classmethod
+    def load(cls, idf_path=LOCAL_IDF_PATH):
+        """Build the backend with fitted IDF weights from idf_path, if the file exists."""
+        idf = None
+        if idf_path and os.path.exists(idf_path):
+            idf = np.load(idf_path).astype(np.float32)
+            logger.info(f"Loaded local embedding IDF weights from {idf_path}")
+        return cls(idf=idf)
+
+    def fit_idf(self, texts):
+        """Weight features by smoothed inverse document frequency over texts."""
+        document_frequency = np.zeros(self.n_features, dtype=np.int64)
+        for text in texts:
+            indices, _ = _features(text, self.n_features)
+            document_frequency[indices] += 1
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self.idf
+
+    def embed_vector(self, text):
+        """Embed one text as a unit-length float32 array (all zeros for a text with no words)."""
+        indices, counts = _features(text, self.n_features)
+        if not len(indices):
+            return np.zeros(self.dimensions, dtype=np.float32)
+        weights = 1 + np.log(counts).astype(np.float32)  # Sublinear term frequency
+        if self.idf is not None:
+            weights *= self.idf[indices]
+        vector = np.bincount(
+            self._positions[indices].ravel(),
+            weights=(self._signs[indices] * weights[:, None]).ravel(),
+            minlength=self.dimensions
+        ).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_vectors(self, texts):
+        """Embed many texts as a (len(texts), dimensions) float32 matrix."""
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            vectors[i] = self.embed_vector(text)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.embed_vectors(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_vector(text).tolist()
+
+def embedding_namespace(backend):
+    """
+    Name of the vector space a backend embeds into; vectors from different
+    namespaces cannot be compared with each other.
+    """
+    namespace = getattr(backend, 'cache_namespace', None)
+    return namespace if isinstance(namespace, str) else f"openai:{backend.model}"
+
+_backends_lock = threading.Lock()
+_backends = {}
+
+def get_embedding_backend(name=None):
+    """
+    Get the embeddings client for a backend, built once per process.
+
+    Backends implement LangChain's Embeddings interface (embed_query and
+    embed_documents) and return EMBEDDING_DIMENSIONS-sized vectors.
+
+    Args:
+        name (str): 'openai' or 'local'; EMBEDDING_BACKEND by default
+
+    Returns:
+        Embeddings: The backend's client
+    """
+    name = name or EMBEDDING_BACKEND
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name == 'openai':
+                from langchain_openai import OpenAIEmbeddings
+                backend = OpenAIEmbeddings()  # Let it use default configuration
+            elif name == 'local':
+                backend = LocalEmbeddings.load()
+            else:
+                raise ValueError(f"Unknown embedding backend: {name}")
+            _backends[name] = backend
+    return backend
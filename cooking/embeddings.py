@@ -1,25 +1,141 @@
-from langchain_openai import OpenAIEmbeddings
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 from .db_connection import get_db_connection
+from .embedding_backends import get_embedding_backend, embedding_namespace
+from .models import EmbeddingNamespace
 
 load_dotenv()
 
-# Initialize OpenAI embeddings with minimal configuration
-embeddings = OpenAIEmbeddings()  # Let it use default configuration
+# Embeddings client for the configured backend (EMBEDDING_BACKEND), OpenAI by default
+embeddings = get_embedding_backend()
 
-def generate_recipe_embedding(recipe):
+# Recipe embeddings kept in this process, by content hash; the shared copy is
+# the recipe_embeddings row with the same content_hash
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 1024))
+
+_embedding_cache_lock = threading.Lock()
+_embedding_cache = OrderedDict()  # content_hash -> embedding, least recently used first
+_embedding_cache_stats = {
+    'local_hits': 0,
+    'shared_hits': 0,
+    'misses': 0,
+}
+
+# Namespace this process has confirmed the stored vectors belong to
+_checked_namespace = None
+
+# pgvector's binary format: int16 dimensions, int16 unused, then big-endian float4s
+VECTOR_HEADER_BYTES = 4
+
+# Candidates the HNSW index keeps while searching; higher finds more of the true
+# nearest neighbours at the cost of latency
+HNSW_EF_SEARCH = int(os.getenv('VECTOR_HNSW_EF_SEARCH', 100))
+HNSW_MAX_EF_SEARCH = 1000  # pgvector's upper limit
+# Lists scanned per query if the table has an IVFFlat index instead
+IVFFLAT_PROBES = int(os.getenv('VECTOR_IVFFLAT_PROBES', 10))
+
+def set_vector_search_params(cur, limit=0, excluded=0, ef_search=None, probes=None):
     """
-    Generate embedding for a recipe using LangChain.
-    
+    Tune approximate index scans for the rest of the current transaction.
+
+    Rows excluded in the WHERE clause are filtered out after the index scan,
+    so the candidate list is widened to leave `limit` rows once they are gone.
+
     Args:
-        recipe (dict): Recipe data including title, ingredients, instructions, etc.
-    
+        cur: Open cursor, inside a transaction
+        limit (int): Rows the query asks for
+        excluded (int): Rows the query filters out, e.g. the user's saved recipes
+        ef_search (int): hnsw.ef_search, HNSW_EF_SEARCH by default
+        probes (int): ivfflat.probes, IVFFLAT_PROBES by default
+    """
+    ef_search = min(max(ef_search or HNSW_EF_SEARCH, limit + excluded), HNSW_MAX_EF_SEARCH)
+    cur.execute(
+        "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+        (str(ef_search), str(probes or IVFFLAT_PROBES))
+    )
+
+def decode_vector(value):
+    """
+    Decode a vector fetched with `vector_send(embedding)` into a float32 array.
+
+    Text values (a plain `SELECT embedding`) are parsed too, without going
+    through JSON and Python lists.
+    """
+    if isinstance(value, str):
+        return np.fromstring(value.strip('[]'), dtype=np.float32, sep=',')
+    return np.frombuffer(value, dtype='>f4', offset=VECTOR_HEADER_BYTES).astype(np.float32)
+
+def fetch_recipe_embeddings(cur, embedding_ids):
+    """
+    Fetch many recipe embeddings in one query, in pgvector's binary format.
+
+    Args:
+        cur: Open cursor on the vector database
+        embedding_ids (list): recipe_embeddings ids to fetch
+
     Returns:
-        dict: Recipe data with embedding
+        tuple: (ids found, float32 matrix with one row per id found)
     """
-    # Combine recipe components into a single text
-    recipe_text = f"""
+    if not embedding_ids:
+        return [], np.empty((0, 0), dtype=np.float32)
+
+    cur.execute("""
+        SELECT id, vector_send(embedding)
+        FROM public.recipe_embeddings
+        WHERE id = ANY(%s) AND embedding IS NOT NULL
+    """, (list(embedding_ids),))
+    rows = cur.fetchall()
+    if not rows:
+        return [], np.empty((0, 0), dtype=np.float32)
+
+    return [row[0] for row in rows], np.stack([decode_vector(row[1]) for row in rows])
+
+def recipe_embedding_exists(cur, embedding_id):
+    """Check that a recipe_embeddings row is still there."""
+    cur.execute("SELECT 1 FROM public.recipe_embeddings WHERE id = %s", (embedding_id,))
+    return cur.fetchone() is not None
+
+def delete_unreferenced_recipe_embedding(cur, embedding_id, saved_recipe_id=None):
+    """
+    Delete a recipe embedding unless a saved recipe still links to it.
+
+    Identical recipes share one row. The reference check is part of the
+    DELETE, so a link committed after the caller looked keeps the row.
+
+    Args:
+        cur: Open cursor on the vector database
+        embedding_id (int): recipe_embeddings id
+        saved_recipe_id (int): Saved recipe being deleted, whose own link does not count
+
+    Returns:
+        tuple: (whether the row was deleted, its vector, or None if there was no row)
+    """
+    cur.execute("""
+        WITH deleted AS (
+            DELETE FROM public.recipe_embeddings
+            WHERE id = %(id)s AND NOT EXISTS (
+                SELECT 1 FROM public.cooking_savedrecipe
+                WHERE embedding_id = %(id)s AND id IS DISTINCT FROM %(saved_recipe_id)s
+            )
+            RETURNING id
+        )
+        SELECT EXISTS (SELECT 1 FROM deleted), vector_send(embedding)
+        FROM public.recipe_embeddings
+        WHERE id = %(id)s
+    """, {'id': embedding_id, 'saved_recipe_id': saved_recipe_id})
+    row = cur.fetchone()
+    if row is None:
+        return False, None
+    return row[0], decode_vector(row[1]) if row[1] is not None else None
+
+def recipe_text(recipe):
+    """Build the text a recipe is embedded from."""
+    return f"""
     Title: {recipe['title']}
     Cuisine: {recipe['cuisine']}
     Difficulty: {recipe['difficulty']}
@@ -27,21 +143,169 @@ def generate_recipe_embedding(recipe):
     Instructions: {' '.join(recipe['instructions'])}
     Tips: {', '.join(recipe['tips'])}
     """
+
+def recipe_content_hash(text):
+    """
+    Content address of a recipe's embedding text.
+
+    Whitespace is collapsed first, so re-indenting the template or trailing
+    spaces in the model's output do not change the address. Backends other
+    than OpenAI address their vectors under their cache_namespace, so a
+    vector is never reused by a backend that did not produce it.
+    """
+    key = ' '.join(text.split())
+    namespace = getattr(embeddings, 'cache_namespace', None)
+    if isinstance(namespace, str):
+        key = f"{namespace}\n{key}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def check_embedding_namespace():
+    """
+    Make sure the configured backend is the one the stored vectors came from.
+
+    Vectors from different backends (or local IDF weights) share the
+    recipe_embeddings, response_cache and profile columns but cannot be
+    compared, so a process embedding with another backend is refused until
+    `manage.py reembed_recipes` has re-embedded what is stored. The first
+    backend to embed claims an empty database. Checked once per process.
+
+    Returns:
+        str: The namespace
+
+    Raises:
+        ImproperlyConfigured: If the stored vectors come from another backend
+    """
+    global _checked_namespace
+    namespace = embedding_namespace(embeddings)
+    if namespace == _checked_namespace:
+        return namespace
+    stored, _ = EmbeddingNamespace.objects.get_or_create(id=1, defaults={'namespace': namespace})
+    if stored.namespace != namespace:
+        raise ImproperlyConfigured(
+            f"The stored vectors come from {stored.namespace}, not the configured {namespace}; "
+            f"run `manage.py reembed_recipes` to switch embedding backends"
+        )
+    _checked_namespace = namespace
+    return namespace
+
+def _increment_stat(name, count=1):
+    with _embedding_cache_lock:
+        _embedding_cache_stats[name] += count
+
+def get_embedding_cache_stats():
+    """Return recipe embedding cache hit/miss counters for this process."""
+    with _embedding_cache_lock:
+        stats = dict(_embedding_cache_stats)
+        stats['local_entries'] = len(_embedding_cache)
+    return stats
+
+def _remember_embedding(content_hash, embedding):
+    with _embedding_cache_lock:
+        _embedding_cache[content_hash] = embedding
+        _embedding_cache.move_to_end(content_hash)
+        while len(_embedding_cache) > EMBEDDING_CACHE_MAX_ENTRIES:
+            _embedding_cache.popitem(last=False)
+
+def _cached_embedding(content_hash):
+    """Look a recipe's embedding up in this process, then in recipe_embeddings; None if never embedded."""
+    with _embedding_cache_lock:
+        embedding = _embedding_cache.get(content_hash)
+        if embedding is not None:
+            _embedding_cache.move_to_end(content_hash)
+            _embedding_cache_stats['local_hits'] += 1
+            return embedding
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT vector_send(embedding)
+                FROM public.recipe_embeddings
+                WHERE content_hash = %s AND embedding IS NOT NULL
+            """, (content_hash,))
+            row = cur.fetchone()
+    if row is None:
+        return None
+
+    _increment_stat('shared_hits')
+    embedding = decode_vector(row[0]).tolist()
+    _remember_embedding(content_hash, embedding)
+    return embedding
+
+def cached_embeddings(content_hashes):
+    """
+    Look many recipes' embeddings up at once, in this process and then in one
+    recipe_embeddings query.
+
+    Returns:
+        dict: content_hash -> embedding, for the hashes embedded before
+    """
+    found = {}
+    with _embedding_cache_lock:
+        for content_hash in content_hashes:
+            embedding = _embedding_cache.get(content_hash)
+            if embedding is not None:
+                _embedding_cache.move_to_end(content_hash)
+                found[content_hash] = embedding
+        _embedding_cache_stats['local_hits'] += len(found)
+
+    missing = [content_hash for content_hash in content_hashes if content_hash not in found]
+    if missing:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT content_hash, vector_send(embedding)
+                    FROM public.recipe_embeddings
+                    WHERE content_hash = ANY(%s) AND embedding IS NOT NULL
+                """, (missing,))
+                rows = cur.fetchall()
+        for content_hash, value in rows:
+            found[content_hash] = decode_vector(value).tolist()
+            _remember_embedding(content_hash, found[content_hash])
+        _increment_stat('shared_hits', len(rows))
+    return found
+
+def generate_recipe_embedding(recipe):
+    """
+    Generate embedding for a recipe using LangChain.
+
+    Embeddings are content-addressed by a hash of the recipe's text: a recipe
+    embedded before (by any process) reuses that vector instead of calling the
+    API again.
     
-    # Generate embedding
-    embedding = embeddings.embed_query(recipe_text)
+    Args:
+        recipe (dict): Recipe data including title, ingredients, instructions, etc.
+    
+    Returns:
+        dict: Recipe data with embedding and content_hash
+    """
+    check_embedding_namespace()
+
+    # Combine recipe components into a single text
+    text = recipe_text(recipe)
+    content_hash = recipe_content_hash(text)
+    
+    embedding = _cached_embedding(content_hash)
+    if embedding is None:
+        # Generate embedding
+        _increment_stat('misses')
+        embedding = embeddings.embed_query(text)
+        _remember_embedding(content_hash, embedding)
     
     # Add embedding to recipe data
     recipe['embedding'] = embedding
+    recipe['content_hash'] = content_hash
     
     return recipe
 
 def store_recipe_embedding(recipe):
     """
     Store recipe with its embedding in Supabase using direct SQL.
+
+    A recipe whose content_hash is already stored is not inserted again; the
+    existing row is returned instead.
     
     Args:
-        recipe (dict): Recipe data with embedding
+        recipe (dict): Recipe data with embedding (and content_hash, from generate_recipe_embedding)
     
     Returns:
         dict: Stored recipe data
@@ -55,7 +319,8 @@ def store_recipe_embedding(recipe):
             'ingredients': recipe['ingredients'],
             'instructions': recipe['instructions'],
             'tips': recipe['tips'],
-            'embedding': recipe['embedding']
+            'embedding': recipe['embedding'],
+            'content_hash': recipe.get('content_hash'),
         }
         
         print("Attempting to store recipe with data:", recipe_data)
@@ -63,22 +328,29 @@ def store_recipe_embedding(recipe):
         # Connect to database and insert data
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO public.recipe_embeddings 
-                    (title, cuisine, difficulty, ingredients, instructions, tips, embedding)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id, title, cuisine, difficulty, ingredients, instructions, tips, created_at, updated_at
-                """, (
-                    recipe_data['title'],
-                    recipe_data['cuisine'],
-                    recipe_data['difficulty'],
-                    recipe_data['ingredients'],
-                    recipe_data['instructions'],
-                    recipe_data['tips'],
-                    recipe_data['embedding']
-                ))
-                
-                result = cur.fetchone()
+                # A concurrent insert of the same recipe may commit after this
+                # statement's snapshot was taken; the retry then finds its row
+                for attempt in range(2):
+                    cur.execute("""
+                        WITH inserted AS (
+                            INSERT INTO public.recipe_embeddings 
+                            (title, cuisine, difficulty, ingredients, instructions, tips, embedding, content_hash)
+                            VALUES (%(title)s, %(cuisine)s, %(difficulty)s, %(ingredients)s, %(instructions)s,
+                                    %(tips)s, %(embedding)s, %(content_hash)s)
+                            ON CONFLICT (content_hash) WHERE content_hash IS NOT NULL DO NOTHING
+                            RETURNING id, title, cuisine, difficulty, ingredients, instructions, tips, created_at, updated_at
+                        )
+                        SELECT * FROM inserted
+                        UNION ALL
+                        SELECT id, title, cuisine, difficulty, ingredients, instructions, tips, created_at, updated_at
+                        FROM public.recipe_embeddings
+                        WHERE content_hash = %(content_hash)s
+                        LIMIT 1
+                    """, recipe_data)
+                    
+                    result = cur.fetchone()
+                    if result:
+                        break
                 conn.commit()
                 
                 if result:
@@ -166,6 +438,33 @@ def delete_recipe_embedding(recipe_id):
     result = supabase.table('recipe_embeddings').delete().eq('id', recipe_id).execute()
     return bool(result.data)
 
+def _search_vector_index(cur, user_embedding, saved_recipe_ids, limit):
+    """
+    Rank recipes with the in-process index and fetch the winners' details by id.
+
+    Returns:
+        list: Rows shaped like the pgvector query's, or None to run that query instead
+    """
+    # Imported here; the index module builds on this one
+    from . import vector_index
+    if not vector_index.ENABLED:
+        return None
+    try:
+        ranked = vector_index.search(user_embedding, limit, exclude=saved_recipe_ids)
+    except Exception as e:
+        print(f"In-process vector index unavailable, querying pgvector: {str(e)}")
+        return None
+    if not ranked:
+        return []
+
+    cur.execute("""
+        SELECT id, title, cuisine, difficulty, ingredients, instructions, tips
+        FROM public.recipe_embeddings
+        WHERE id = ANY(%s)
+    """, ([recipe_id for recipe_id, _ in ranked],))
+    details = {row[0]: row for row in cur.fetchall()}
+    return [details[recipe_id] + (score,) for recipe_id, score in ranked if recipe_id in details]
+
 def get_recipe_recommendations(user_embedding, user_id, limit=5):
     """
     Find recipe recommendations for a user based on their embedding.
@@ -195,26 +494,27 @@ def get_recipe_recommendations(user_embedding, user_id, limit=5):
                 
                 # Find similar recipes using cosine similarity
                 # Exclude recipes the user has already saved
-                cur.execute("""
-                    WITH user_embedding AS (
-                        SELECT %s::vector AS embedding
-                    )
-                    SELECT 
-                        re.id,
-                        re.title,
-                        re.cuisine,
-                        re.difficulty,
-                        re.ingredients,
-                        re.instructions,
-                        re.tips,
-                        1 - (re.embedding <=> (SELECT embedding FROM user_embedding)) as similarity
-                    FROM public.recipe_embeddings re
-                    WHERE re.id != ALL(%s)
-                    ORDER BY similarity DESC
-                    LIMIT %s
-                """, (user_embedding, saved_recipe_ids, limit))
-                
-                results = cur.fetchall()
+                results = _search_vector_index(cur, user_embedding, saved_recipe_ids, limit)
+                if results is None:
+                    set_vector_search_params(cur, limit, len(saved_recipe_ids))
+                    # Ordered by the distance operator itself so the HNSW index can serve it
+                    cur.execute("""
+                        SELECT 
+                            re.id,
+                            re.title,
+                            re.cuisine,
+                            re.difficulty,
+                            re.ingredients,
+                            re.instructions,
+                            re.tips,
+                            1 - (re.embedding <=> %(embedding)s::vector) as similarity
+                        FROM public.recipe_embeddings re
+                        WHERE re.id != ALL(%(excluded)s)
+                        ORDER BY re.embedding <=> %(embedding)s::vector
+                        LIMIT %(limit)s
+                    """, {'embedding': user_embedding, 'excluded': saved_recipe_ids, 'limit': limit})
+                    
+                    results = cur.fetchall()
                 
                 # Format the results
                 recommendations = []
@@ -0,0 +1,152 @@
+import os
+import re
+import zlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Trained weights live next to the app unless INTENT_MODEL_PATH says otherwise;
+# with no model file the keyword rules in context_manager are used on their own
+MODEL_PATH = os.getenv('INTENT_MODEL_PATH', os.path.join(os.path.dirname(__file__), 'intent_model.npz'))
+
+# Predictions below this probability fall back to the keyword rules
+MIN_CONFIDENCE = float(os.getenv('INTENT_MIN_CONFIDENCE', 0.6))
+
+N_FEATURES = 2 ** 16
+LABELS = ['recipe_creation', 'recipe_modification', 'cooking_question', 'general_question']
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9'-]+")
+
+_model_lock = threading.Lock()
+_model = None
+_model_loaded = False
+
+def _feature_indices(text, n_features=N_FEATURES):
+    """
+    Hash a message's word unigrams and bigrams into feature indices.
+
+    crc32 rather than hash() so indices are the same in every process.
+    """
+    words = _TOKEN_PATTERN.findall(text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return np.unique(np.fromiter(
+        (zlib.crc32(gram.encode('utf-8')) % n_features for gram in grams),
+        dtype=np.int64, count=len(grams)
+    ))
+
+def _scores(weights, bias, rows):
+    """Linear scores for already-hashed messages, summing each message's feature rows in one reduceat."""
+    scores = np.tile(bias, (len(rows), 1))
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    if lengths.sum():
+        nonempty = lengths > 0
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        scores[nonempty] += np.add.reduceat(weights[np.concatenate(rows)], offsets[nonempty], axis=0)
+    return scores
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+class IntentModel:
+    """Multinomial logistic regression over hashed n-gram features."""
+
+    def __init__(self, weights, bias, labels):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+
+    def predict_proba(self, texts):
+        """
+        Score a batch of messages in one pass.
+
+        Args:
+            texts (list): Messages to classify
+
+        Returns:
+            numpy.ndarray: (len(texts), len(labels)) class probabilities
+        """
+        rows = [_feature_indices(text, self.weights.shape[0]) for text in texts]
+        return _softmax(_scores(self.weights, self.bias, rows))
+
+    def predict(self, texts):
+        """Return (label, probability) for each message in a batch."""
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        return [(self.labels[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    def save(self, path=MODEL_PATH):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path) as data:
+            return cls(data['weights'], data['bias'], data['labels'].tolist())
+
+def train(texts, labels, epochs=10, learning_rate=0.5, l2=1e-4, seed=0):
+    """
+    Train an intent model with mini-batch gradient descent.
+
+    Args:
+        texts (list): Training messages
+        labels (list): Message type of each message, one of LABELS
+        epochs (int): Passes over the training set
+        learning_rate (float): Step size
+        l2 (float): Weight decay
+        seed (int): Shuffling seed, for reproducible models
+
+    Returns:
+        IntentModel: The trained model
+    """
+    label_ids = np.array([LABELS.index(label) for label in labels], dtype=np.int64)
+    weights = np.zeros((N_FEATURES, len(LABELS)), dtype=np.float32)
+    bias = np.zeros(len(LABELS), dtype=np.float32)
+    rows = [_feature_indices(text) for text in texts]
+    rng = np.random.default_rng(seed)
+    batch_size = 32
+
+    for _ in range(epochs):
+        order = rng.permutation(len(rows))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            gradient = _softmax(_scores(weights, bias, [rows[i] for i in batch]))
+            gradient[np.arange(len(batch)), label_ids[batch]] -= 1
+            gradient /= len(batch)
+
+            weights *= (1 - learning_rate * l2)
+            for row, i in enumerate(batch):
+                weights[rows[i]] -= learning_rate * gradient[row]
+            bias -= learning_rate * gradient.sum(axis=0)
+
+    return IntentModel(weights, bias, LABELS)
+
+def get_model():
+    """Get the trained model, loading it once per process; None if there is no model file."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                if os.path.exists(MODEL_PATH):
+                    try:
+                        _model = IntentModel.load(MODEL_PATH)
+                        logger.info(f"Loaded intent model from {MODEL_PATH}")
+                    except Exception as e:
+                        logger.error(f"Could not load intent model, using keyword rules: {str(e)}")
+                _model_loaded = True
+    return _model
+
+def predict_message_types(texts):
+    """
+    Classify a batch of messages with the trained model.
+
+    Returns:
+        list: A message type per message, or None where there is no model or
+        the model is not confident enough and the keyword rules should decide
+    """
+    model = get_model()
+    if model is None:
+        return [None] * len(texts)
+    return [label if probability >= MIN_CONFIDENCE else None for label, probability in model.predict(texts)]
@@ -1,25 +1,26 @@
 from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema import HumanMessage, SystemMessage
-from .context_manager import classify_message_type, get_relevant_context
+from .context_manager import classify_message_type, get_relevant_context, aget_relevant_context
 import os
+import asyncio
+import threading
+import weakref
+import httpx
+import openai
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
+from . import response_cache, prompt_memo
+from .token_budget import count_message_tokens
 
 load_dotenv()
 
-def get_recipe_response(chat_session, user_message):
-    """Get a response from the LangChain model while maintaining context and formatting."""
-    chat = ChatOpenAI(
-        temperature=0.7,  # Higher temperature for creativity
-        model="gpt-3.5-turbo"
-    )
-
-    message_type = classify_message_type(user_message)
-    context_messages = get_relevant_context(chat_session, user_message)
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_TEMPERATURE = 0.7  # Higher temperature for creativity
 
-    # Base system message
-    system_message = """You are ChefGPT, an expert cooking assistant. Your responses must follow these rules:
+# Base system message
+SYSTEM_MESSAGE = """You are ChefGPT, an expert cooking assistant. Your responses must follow these rules:
 
     1. For recipe creation or modification:
        - Always format recipes in HTML with these exact sections:
@@ -58,9 +59,165 @@ def get_recipe_response(chat_session, user_message):
        - Always use specific measurements and instructions
        - Always follow modification requests exactly"""
 
+# Compiled once at import; the per-request context is passed in through the placeholder
+RECIPE_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content=SYSTEM_MESSAGE),
+    MessagesPlaceholder(variable_name="messages"),
+])
+
+# Keep-alive pool shared by every chat model client in this process
+HTTP_POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv('OPENAI_MAX_CONNECTIONS', 100)),
+    max_keepalive_connections=int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 20)),
+    keepalive_expiry=float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 60)),
+)
+
+_registry_lock = threading.Lock()
+_openai_client = None
+_chat_models = {}
+
+# Async connections belong to the event loop that opened them, so async clients are kept per loop
+_async_chat_models = weakref.WeakKeyDictionary()
+
+_stats_lock = threading.Lock()
+_stats = {
+    'clients_created': 0,
+    'clients_reused': 0,
+    'http_requests': 0,
+    'connections_opened': 0,
+}
+
+def _increment_stat(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def _trace_connection(event_name, info):
+    """httpcore trace hook; a TCP connect means the pool had no idle connection to reuse."""
+    if event_name == "connection.connect_tcp.complete":
+        _increment_stat('connections_opened')
+
+def _on_request(request):
+    _increment_stat('http_requests')
+    request.extensions["trace"] = _trace_connection
+
+async def _atrace_connection(event_name, info):
+    _trace_connection(event_name, info)
+
+async def _aon_request(request):
+    _increment_stat('http_requests')
+    request.extensions["trace"] = _atrace_connection
+
+def _get_openai_client():
+    """Get the process-wide OpenAI client, creating it and its connection pool on first use."""
+    global _openai_client
+    if _openai_client is None:
+        with _registry_lock:
+            if _openai_client is None:
+                _openai_client = openai.OpenAI(
+                    http_client=httpx.Client(
+                        limits=HTTP_POOL_LIMITS,
+                        event_hooks={'request': [_on_request]},
+                    )
+                )
+    return _openai_client
+
+def get_chat_model(model=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE):
+    """
+    Get the shared chat model for a model and temperature.
+
+    Instances are created lazily, once per process, and all of them send their
+    requests through the same pooled keep-alive HTTP client.
+    """
+    key = (model, temperature)
+    chat = _chat_models.get(key)
+    if chat is not None:
+        _increment_stat('clients_reused')
+        return chat
+
+    openai_client = _get_openai_client()
+    with _registry_lock:
+        chat = _chat_models.get(key)
+        if chat is None:
+            chat = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                client=openai_client.chat.completions,
+            )
+            _chat_models[key] = chat
+            _increment_stat('clients_created')
+            return chat
+
+    _increment_stat('clients_reused')
+    return chat
+
+def get_async_chat_model(model=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE):
+    """
+    Get the shared chat model for async callers on the running event loop.
+
+    Each event loop gets its own pooled async HTTP client; under an ASGI server
+    that is a single loop, and so a single pool, per process.
+    """
+    loop = asyncio.get_running_loop()
+    key = (model, temperature)
+    chat = _async_chat_models.get(loop, {}).get(key)
+    if chat is not None:
+        _increment_stat('clients_reused')
+        return chat
+
+    openai_client = _get_openai_client()
+    with _registry_lock:
+        loop_models = _async_chat_models.setdefault(loop, {})
+        chat = loop_models.get(key)
+        if chat is None:
+            if '_async_openai_client' not in loop_models:
+                loop_models['_async_openai_client'] = openai.AsyncOpenAI(
+                    http_client=httpx.AsyncClient(
+                        limits=HTTP_POOL_LIMITS,
+                        event_hooks={'request': [_aon_request]},
+                    )
+                )
+            chat = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                client=openai_client.chat.completions,
+                async_client=loop_models['_async_openai_client'].chat.completions,
+            )
+            loop_models[key] = chat
+            _increment_stat('clients_created')
+            return chat
+
+    _increment_stat('clients_reused')
+    return chat
+
+def get_client_stats():
+    """Return counters showing how often chat model clients and HTTP connections were reused."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['connections_reused'] = max(stats['http_requests'] - stats['connections_opened'], 0)
+    return stats
+
+def _reserved_tokens(user_message, model):
+    # The system prompt and the current message are always sent alongside the context
+    return count_message_tokens(SYSTEM_MESSAGE, model) + count_message_tokens(user_message, model)
+
+def build_recipe_messages(chat_session, user_message, model=DEFAULT_MODEL):
+    """Build the per-request messages (chat context and the user message) that follow the system prompt."""
+    context_messages = get_relevant_context(
+        chat_session, user_message, model, _reserved_tokens(user_message, model)
+    )
+    return _to_chat_messages(context_messages, user_message)
+
+async def abuild_recipe_messages(chat_session, user_message, model=DEFAULT_MODEL):
+    """Async version of build_recipe_messages."""
+    context_messages = await aget_relevant_context(
+        chat_session, user_message, model, _reserved_tokens(user_message, model)
+    )
+    return _to_chat_messages(context_messages, user_message)
+
+def _to_chat_messages(context_messages, user_message):
     # Build messages
-    messages = [SystemMessage(content=system_message)]
-    
+    messages = []
+
     # Add context messages
     for msg in context_messages:
         if msg["role"] == "system":
@@ -73,9 +230,123 @@ def get_recipe_response(chat_session, user_message):
     # Add the current message
     messages.append(HumanMessage(content=user_message))
 
-    # Create prompt
-    prompt = ChatPromptTemplate.from_messages(messages)
+    return messages
+
+def _prompt_key(chat, prompt_value):
+    return prompt_memo.prompt_key(chat.model_name, chat.temperature, prompt_value.to_messages())
+
+def get_recipe_response(chat_session, user_message):
+    """Get a response from the LangChain model while maintaining context and formatting."""
+    cached_response, cache_key = response_cache.get_cached_response(chat_session, user_message)
+    if cached_response is not None:
+        return cached_response
+
+    chat = get_chat_model()
+
+    messages = build_recipe_messages(chat_session, user_message, chat.model_name)
+    prompt_value = RECIPE_PROMPT.invoke({"messages": messages})
+
+    # Get response; identical prompts are answered once
+    response = prompt_memo.memoize(
+        _prompt_key(chat, prompt_value),
+        lambda: chat.invoke(prompt_value).content
+    )
+    response_cache.cache_response(cache_key, user_message, response)
+    return response
+
+def stream_recipe_response(chat_session, user_message):
+    """Yield the model's response to a user message token by token as it is generated."""
+    cached_response, cache_key = response_cache.get_cached_response(chat_session, user_message)
+    if cached_response is not None:
+        yield cached_response
+        return
+
+    chat = get_chat_model()
+
+    messages = build_recipe_messages(chat_session, user_message, chat.model_name)
+    prompt_value = RECIPE_PROMPT.invoke({"messages": messages})
+
+    key = _prompt_key(chat, prompt_value)
+    memoized_response = prompt_memo.lookup(key)
+    if memoized_response is not None:
+        yield memoized_response
+        return
+
+    # A duplicate of a prompt that is already streaming waits for the complete reply
+    flight, is_leader = prompt_memo.join_flight(key)
+    if not is_leader:
+        yield flight.result()
+        return
+
+    tokens = []
+    try:
+        for chunk in chat.stream(prompt_value):
+            if chunk.content:
+                tokens.append(chunk.content)
+                yield chunk.content
+    except BaseException as e:
+        prompt_memo.finish_flight(key, flight, error=e)
+        raise
+
+    response = ''.join(tokens)
+    prompt_memo.store(key, response)
+    prompt_memo.finish_flight(key, flight, response)
+    response_cache.cache_response(cache_key, user_message, response)
+
+async def aget_recipe_response(chat_session, user_message):
+    """Async version of get_recipe_response; awaits the model without holding a worker thread."""
+    cached_response, cache_key = await sync_to_async(response_cache.get_cached_response)(chat_session, user_message)
+    if cached_response is not None:
+        return cached_response
+
+    chat = get_async_chat_model()
+
+    messages = await abuild_recipe_messages(chat_session, user_message, chat.model_name)
+    prompt_value = RECIPE_PROMPT.invoke({"messages": messages})
+
+    async def generate():
+        return (await chat.ainvoke(prompt_value)).content
+
+    # Get response; identical prompts are answered once
+    response = await prompt_memo.amemoize(_prompt_key(chat, prompt_value), generate)
+    await sync_to_async(response_cache.cache_response)(cache_key, user_message, response)
+    return response
+
+async def astream_recipe_response(chat_session, user_message):
+    """Async version of stream_recipe_response."""
+    cached_response, cache_key = await sync_to_async(response_cache.get_cached_response)(chat_session, user_message)
+    if cached_response is not None:
+        yield cached_response
+        return
+
+    chat = get_async_chat_model()
+
+    messages = await abuild_recipe_messages(chat_session, user_message, chat.model_name)
+    prompt_value = RECIPE_PROMPT.invoke({"messages": messages})
+
+    key = _prompt_key(chat, prompt_value)
+    memoized_response = await sync_to_async(prompt_memo.lookup)(key)
+    if memoized_response is not None:
+        yield memoized_response
+        return
+
+    # A duplicate of a prompt that is already streaming waits for the complete reply
+    flight, is_leader = prompt_memo.join_flight(key)
+    if not is_leader:
+        yield await asyncio.wrap_future(flight)
+        return
+
+    tokens = []
+    try:
+        async for chunk in chat.astream(prompt_value):
+            if chunk.content:
+                tokens.append(chunk.content)
+                yield chunk.content
+    except BaseException as e:
+        prompt_memo.finish_flight(key, flight, error=e)
+        raise
 
-    # Get response
-    response = (prompt | chat).invoke({})
-    return response.content 
\ No newline at end of file
+    response = ''.join(tokens)
+    await sync_to_async(prompt_memo.store)(key, response)
+    prompt_memo.finish_flight(key, flight, response)
+    await sync_to_async(response_cache.cache_response)(cache_key, user_message, response)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from cooking.models import Message
+from cooking import token_budget
+
+
+class Command(BaseCommand):
+    help = "Populate Message.token_count for messages saved before token counts were stored"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of messages to count and update per query')
+        parser.add_argument('--recount', action='store_true',
+                            help='Recount every message, not only those without a count')
+
+    def handle(self, *args, **options):
+        if token_budget.get_encoding() is None:
+            raise CommandError("tiktoken encoding could not be loaded; refusing to store estimated counts")
+
+        batch_size = options['batch_size']
+        messages = Message.objects.all() if options['recount'] else Message.objects.filter(token_count__isnull=True)
+        total = messages.count()
+        self.stdout.write(f"Counting tokens for {total} messages")
+
+        updated = 0
+        batch = []
+        for message in messages.only('id', 'content').iterator(chunk_size=batch_size):
+            message.token_count = token_budget.count_tokens(message.content)
+            batch.append(message)
+            if len(batch) >= batch_size:
+                Message.objects.bulk_update(batch, ['token_count'])
+                updated += len(batch)
+                batch = []
+                self.stdout.write(f"Updated {updated}/{total}")
+
+        if batch:
+            Message.objects.bulk_update(batch, ['token_count'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled token counts for {updated} messages"))
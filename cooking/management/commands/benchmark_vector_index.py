@@ -0,0 +1,170 @@
+import io
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from cooking.db_connection import get_db_connection
+from cooking.embeddings import set_vector_search_params, HNSW_MAX_EF_SEARCH
+
+BENCHMARK_TABLE = 'recipe_embeddings_benchmark'
+
+
+def _vector_literal(vector):
+    return '[' + ','.join(f"{value:.6g}" for value in vector) + ']'
+
+
+def _normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure recall and latency of the HNSW index over a synthetic recipe_embeddings-shaped table, "
+        "for a range of hnsw.ef_search values"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000,
+                            help='Synthetic vectors to load')
+        parser.add_argument('--dimensions', type=int, default=1536,
+                            help='Vector dimensions (recipe_embeddings uses 1536)')
+        parser.add_argument('--clusters', type=int, default=1000,
+                            help='Gaussian clusters the vectors are drawn around, so neighbours are meaningful')
+        parser.add_argument('--queries', type=int, default=100,
+                            help='Query vectors to measure')
+        parser.add_argument('--k', type=int, default=5,
+                            help='Neighbours per query, as for recommendations')
+        parser.add_argument('--ef-search', default='10,20,40,80,160,320',
+                            help='Comma-separated hnsw.ef_search values to measure')
+        parser.add_argument('--m', type=int, default=16,
+                            help='HNSW graph degree')
+        parser.add_argument('--ef-construction', type=int, default=64,
+                            help='HNSW build-time candidate list size')
+        parser.add_argument('--exact-queries', type=int, default=5,
+                            help='Queries also timed as a sequential scan, for comparison')
+        parser.add_argument('--batch-size', type=int, default=10_000,
+                            help='Rows generated and copied per batch')
+        parser.add_argument('--keep', action='store_true',
+                            help=f'Keep the {BENCHMARK_TABLE} table afterwards')
+
+    def handle(self, *args, **options):
+        ef_values = [int(value) for value in options['ef_search'].split(',')]
+        if any(value < options['k'] or value > HNSW_MAX_EF_SEARCH for value in ef_values):
+            raise CommandError(f"ef_search values must be between k and {HNSW_MAX_EF_SEARCH}")
+
+        rng = np.random.default_rng(0)
+        dimensions = options['dimensions']
+        centers = rng.standard_normal((options['clusters'], dimensions), dtype=np.float32)
+        queries = self._sample(rng, centers, options['queries'])
+
+        try:
+            truth = self._load(rng, centers, queries, options)
+            self._build_index(options)
+            self._measure(queries, truth, ef_values, options)
+        finally:
+            if not options['keep']:
+                with get_db_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+
+    def _sample(self, rng, centers, count):
+        # Points scattered around randomly chosen cluster centres
+        picks = rng.integers(len(centers), size=count)
+        noise = rng.standard_normal((count, centers.shape[1]), dtype=np.float32) * 0.5
+        return centers[picks] + noise
+
+    def _load(self, rng, centers, queries, options):
+        """Copy the synthetic rows in, tracking each query's exact top k on the way."""
+        rows, k, batch_size = options['rows'], options['k'], options['batch_size']
+        unit_queries = _normalize(queries)
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), k), dtype=np.int64)
+
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+                cur.execute(
+                    f"CREATE UNLOGGED TABLE {BENCHMARK_TABLE} "
+                    f"(id bigint PRIMARY KEY, embedding vector({options['dimensions']}))"
+                )
+
+        start_time = time.perf_counter()
+        for start in range(0, rows, batch_size):
+            batch = self._sample(rng, centers, min(batch_size, rows - start))
+            ids = np.arange(start + 1, start + 1 + len(batch))
+
+            # Exact cosine distances, merged into the running top k
+            distances = 1 - unit_queries @ _normalize(batch).T
+            candidates = np.concatenate([best_distances, distances], axis=1)
+            candidate_ids = np.concatenate([best_ids, np.broadcast_to(ids, distances.shape)], axis=1)
+            keep = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(candidates, keep, axis=1)
+            best_ids = np.take_along_axis(candidate_ids, keep, axis=1)
+
+            buffer = io.StringIO(''.join(
+                f"{row_id}\t{_vector_literal(vector)}\n" for row_id, vector in zip(ids, batch)
+            ))
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.copy_expert(f"COPY {BENCHMARK_TABLE} (id, embedding) FROM STDIN", buffer)
+            self.stdout.write(f"Loaded {start + len(batch)}/{rows} rows")
+
+        self.stdout.write(f"Load: {time.perf_counter() - start_time:.1f}s")
+        return [set(row) for row in best_ids.tolist()]
+
+    def _build_index(self, options):
+        start_time = time.perf_counter()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL maintenance_work_mem = '2GB'")
+                cur.execute(
+                    f"CREATE INDEX ON {BENCHMARK_TABLE} USING hnsw (embedding vector_cosine_ops) "
+                    f"WITH (m = %s, ef_construction = %s)",
+                    (options['m'], options['ef_construction'])
+                )
+                cur.execute(f"ANALYZE {BENCHMARK_TABLE}")
+        self.stdout.write(
+            f"HNSW build (m={options['m']}, ef_construction={options['ef_construction']}): "
+            f"{time.perf_counter() - start_time:.1f}s"
+        )
+
+    def _search(self, cur, query, k):
+        # Same shape as the recommendation queries, so the planner makes the same choice
+        vector = _vector_literal(query)
+        start_time = time.perf_counter()
+        cur.execute(
+            f"SELECT id FROM {BENCHMARK_TABLE} ORDER BY embedding <=> %s::vector LIMIT %s",
+            (vector, k)
+        )
+        ids = {row[0] for row in cur.fetchall()}
+        return ids, time.perf_counter() - start_time
+
+    def _measure(self, queries, truth, ef_values, options):
+        k = options['k']
+        self.stdout.write(f"{'ef_search':>10} {'recall@' + str(k):>10} {'p50 ms':>9} {'p95 ms':>9}")
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for ef_search in ef_values:
+                    set_vector_search_params(cur, k, ef_search=ef_search)
+                    # Warm the index pages so the first ef_search value is not penalised
+                    self._search(cur, queries[0], k)
+                    recalls, latencies = [], []
+                    for query, expected in zip(queries, truth):
+                        found, seconds = self._search(cur, query, k)
+                        recalls.append(len(found & expected) / k)
+                        latencies.append(seconds * 1000)
+                    self.stdout.write(
+                        f"{ef_search:>10} {np.mean(recalls):>10.3f} "
+                        f"{np.percentile(latencies, 50):>9.2f} {np.percentile(latencies, 95):>9.2f}"
+                    )
+
+                if options['exact_queries']:
+                    cur.execute("SET LOCAL enable_indexscan = off")
+                    recalls, latencies = [], []
+                    for query, expected in list(zip(queries, truth))[:options['exact_queries']]:
+                        found, seconds = self._search(cur, query, k)
+                        recalls.append(len(found & expected) / k)
+                        latencies.append(seconds * 1000)
+                    self.stdout.write(
+                        f"{'seq scan':>10} {np.mean(recalls):>10.3f} "
+                        f"{np.percentile(latencies, 50):>9.2f} {np.percentile(latencies, 95):>9.2f}"
+                    )
@@ -0,0 +1,83 @@
+import time
+import shutil
+import tempfile
+import numpy as np
+from django.core.management.base import BaseCommand
+from cooking.vector_index import VectorIndex
+
+
+def _normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare memory, queries per second and recall of the in-process vector index "
+        "with float32, float16 and int8 snapshots, on synthetic recipe-sized vectors"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000,
+                            help='Synthetic vectors in the index')
+        parser.add_argument('--dimensions', type=int, default=1536,
+                            help='Vector dimensions (recipe_embeddings uses 1536)')
+        parser.add_argument('--clusters', type=int, default=1000,
+                            help='Gaussian clusters the vectors are drawn around, so neighbours are meaningful')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Query vectors to measure')
+        parser.add_argument('--k', type=int, default=5,
+                            help='Neighbours per query, as for recommendations')
+        parser.add_argument('--rerank', default='5,20,50',
+                            help='Comma-separated candidate counts re-ranked exactly after a quantized scan')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        rows, dimensions, k = options['rows'], options['dimensions'], options['k']
+        centers = rng.standard_normal((options['clusters'], dimensions), dtype=np.float32)
+
+        def sample(count):
+            picks = rng.integers(len(centers), size=count)
+            return centers[picks] + rng.standard_normal((count, dimensions), dtype=np.float32) * 0.5
+
+        vectors = _normalize(sample(rows)).astype(np.float32)
+        ids = np.arange(1, rows + 1, dtype=np.int64)
+        queries = sample(options['queries'])
+
+        # Exact answers to measure recall against
+        scores = _normalize(queries) @ vectors.T
+        truth = [set(ids[np.argpartition(-row, k - 1)[:k]].tolist()) for row in scores]
+        del scores
+
+        configurations = [('float32', k)] + [
+            (quantization, int(rerank))
+            for quantization in ('float16', 'int8')
+            for rerank in options['rerank'].split(',')
+        ]
+
+        self.stdout.write(f"{rows} vectors x {dimensions} dimensions, {len(queries)} queries, k={k}")
+        self.stdout.write(f"{'scan':>8} {'rerank':>7} {'scan MB':>9} {'QPS':>8} {'recall@' + str(k):>9}")
+        for quantization, rerank in configurations:
+            snapshot_dir = tempfile.mkdtemp()
+            try:
+                index = VectorIndex(snapshot_dir, refresh_seconds=float('inf'),
+                                    quantization=quantization, rerank_candidates=rerank)
+                index.publish_snapshot(ids, vectors)
+                state = index.load_snapshot()
+                scanned = state.snapshot_vectors if state.snapshot_codes is None else state.snapshot_codes
+                scan_bytes = scanned.nbytes + (state.snapshot_scales.nbytes if state.snapshot_scales is not None else 0)
+
+                index.search(queries[0], k)
+                recalls = []
+                start_time = time.perf_counter()
+                for query, expected in zip(queries, truth):
+                    found = {recipe_id for recipe_id, _ in index.search(query, k)}
+                    recalls.append(len(found & expected) / k)
+                elapsed = time.perf_counter() - start_time
+                del state, scanned, index
+            finally:
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+            self.stdout.write(
+                f"{quantization:>8} {rerank if quantization != 'float32' else '-':>7} "
+                f"{scan_bytes / 2 ** 20:>9.1f} {len(queries) / elapsed:>8.1f} {np.mean(recalls):>9.3f}"
+            )
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from cooking.models import SavedRecipe
+from cooking.bulk_embeddings import (
+    bulk_embed_recipes, RateLimiter,
+    EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_INPUTS, EMBEDDING_CONCURRENCY,
+)
+from cooking.embeddings import check_embedding_namespace
+from cooking.tasks import saved_recipe_embedding_data, request_user_embedding_refresh
+
+
+class Command(BaseCommand):
+    help = "Embed every saved recipe without an embedding, in batched API calls and inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Saved recipes read, embedded and linked per round')
+        parser.add_argument('--batch-tokens', type=int, default=EMBEDDING_BATCH_MAX_TOKENS,
+                            help='Token budget per embeddings API request')
+        parser.add_argument('--batch-inputs', type=int, default=EMBEDDING_BATCH_MAX_INPUTS,
+                            help='Recipes per embeddings API request')
+        parser.add_argument('--concurrency', type=int, default=EMBEDDING_CONCURRENCY,
+                            help='Embeddings API requests in flight at once')
+
+    def handle(self, *args, **options):
+        check_embedding_namespace()
+        chunk_size = options['chunk_size']
+        recipes = SavedRecipe.objects.filter(embedding_id__isnull=True).order_by('id')
+        total = recipes.count()
+        self.stdout.write(f"Embedding {total} saved recipes")
+
+        limiter = RateLimiter()
+        totals = {'embedded': 0, 'reused': 0, 'failed': 0, 'batches': 0, 'tokens': 0, 'seconds': 0.0}
+        user_ids = set()
+        last_id = 0
+        while True:
+            # Keyset pagination, so recipes that fail stay behind instead of being read again
+            chunk = list(recipes.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            result = bulk_embed_recipes(
+                [saved_recipe_embedding_data(recipe) for recipe in chunk],
+                max_tokens=options['batch_tokens'],
+                max_inputs=options['batch_inputs'],
+                concurrency=options['concurrency'],
+                limiter=limiter
+            )
+            linked = []
+            for recipe, embedding_id in zip(chunk, result['ids']):
+                if embedding_id is None:
+                    continue
+                # Only while still unlinked; an embed_saved_recipe task may have linked it meanwhile
+                if SavedRecipe.objects.filter(id=recipe.id, embedding_id__isnull=True).update(
+                    embedding_id=embedding_id, embedding_status=SavedRecipe.EMBEDDING_READY
+                ):
+                    linked.append(recipe)
+                    user_ids.add(recipe.user_id)
+
+            for key in totals:
+                totals[key] += result[key]
+            self.stdout.write(
+                f"Linked {len(linked)}/{len(chunk)} recipes ({result['batches']} API requests, "
+                f"{result['tokens']} tokens, {result['seconds']:.1f}s)"
+            )
+
+        # The new vectors join each affected profile on a full recompute
+        for user_id in user_ids:
+            request_user_embedding_refresh(user_id, recompute=True)
+
+        rate = (totals['embedded'] + totals['reused']) / totals['seconds'] if totals['seconds'] else 0
+        self.stdout.write(
+            f"Embedded {totals['embedded']}, reused {totals['reused']}, failed {totals['failed']} "
+            f"in {totals['batches']} API requests ({totals['tokens']} tokens, "
+            f"{limiter.waited_seconds:.1f}s rate limited, {rate:.0f} recipes/s)"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Queued profile refreshes for {len(user_ids)} users"))
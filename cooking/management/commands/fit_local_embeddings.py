@@ -0,0 +1,30 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from cooking.models import SavedRecipe
+from cooking.embeddings import recipe_text
+from cooking.embedding_backends import LocalEmbeddings, LOCAL_IDF_PATH
+from cooking.tasks import saved_recipe_embedding_data
+
+
+class Command(BaseCommand):
+    help = "Fit the local embedding backend's IDF weights on the saved recipes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=LOCAL_IDF_PATH,
+                            help='Where to write the IDF weights')
+
+    def handle(self, *args, **options):
+        texts = [
+            recipe_text(saved_recipe_embedding_data(recipe))
+            for recipe in SavedRecipe.objects.only('title', 'content', 'cuisine_type', 'difficulty').iterator()
+        ]
+        if not texts:
+            raise CommandError("No saved recipes to fit IDF weights on")
+
+        backend = LocalEmbeddings()
+        idf = backend.fit_idf(texts)
+        np.save(options['output'], idf)
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved IDF weights over {len(texts)} recipes to {options['output']}; restart workers to load them. "
+            f"Vectors embedded under other weights are stored under a different content hash and not reused"
+        ))
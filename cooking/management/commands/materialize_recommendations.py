@@ -0,0 +1,72 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from cooking.batch_recommendations import (
+    materialize_recommendations, top_k_blocked, peak_memory_mb, USER_BLOCK, RECIPE_BLOCK,
+)
+from cooking.tasks import RECOMMENDATION_COUNT
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every user's recommendations in one blocked pass over the recipe vectors, "
+        "or time that pass on synthetic data with --synthetic-users"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=RECOMMENDATION_COUNT,
+                            help='Recommendations per user')
+        parser.add_argument('--user-block', type=int, default=USER_BLOCK,
+                            help='Users scored per matrix multiply')
+        parser.add_argument('--recipe-block', type=int, default=RECIPE_BLOCK,
+                            help='Recipes scored per matrix multiply')
+        parser.add_argument('--synthetic-users', type=int, default=0,
+                            help='Time random profiles instead of the stored ones, without writing anything')
+        parser.add_argument('--synthetic-recipes', type=int, default=100_000,
+                            help='Random recipe vectors to score synthetic profiles against')
+        parser.add_argument('--dimensions', type=int, default=1536,
+                            help='Synthetic vector dimensions')
+        parser.add_argument('--saved-per-user', type=int, default=20,
+                            help='Synthetic saved recipes excluded per user')
+
+    def handle(self, *args, **options):
+        if options['synthetic_users']:
+            self._benchmark(options)
+            return
+
+        stats = materialize_recommendations(options['k'], options['user_block'], options['recipe_block'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Materialized recommendations for {stats['users']} users ({stats['skipped']} skipped) over "
+            f"{stats['recipes']} recipes in {stats['seconds']:.1f}s: {stats['users_per_second']:.0f} users/s, "
+            f"peak memory {stats['peak_memory_mb']:.0f} MB"
+        ))
+
+    def _benchmark(self, options):
+        rng = np.random.default_rng(0)
+        users, recipes, dimensions = options['synthetic_users'], options['synthetic_recipes'], options['dimensions']
+        recipe_ids = np.arange(1, recipes + 1, dtype=np.int64)
+        recipe_vectors = rng.standard_normal((recipes, dimensions), dtype=np.float32)
+        recipe_vectors /= np.linalg.norm(recipe_vectors, axis=1, keepdims=True)
+        live = np.ones(recipes, dtype=bool)
+        self.stdout.write(f"{users} users x {recipes} recipes x {dimensions} dimensions, k={options['k']}")
+
+        def blocks():
+            for start in range(0, recipes, options['recipe_block']):
+                end = start + options['recipe_block']
+                yield recipe_ids[start:end], recipe_vectors[start:end], live[start:end]
+
+        start_time = time.perf_counter()
+        for start in range(0, users, options['user_block']):
+            count = min(options['user_block'], users - start)
+            # Profiles generated per block, as they are read from the database per block
+            profiles = rng.standard_normal((count, dimensions), dtype=np.float32)
+            saved = [rng.choice(recipe_ids, options['saved_per_user'], replace=False) for _ in range(count)]
+            ids, _ = top_k_blocked(profiles, saved, blocks(), options['k'])
+            if any(np.isin(row, excluded).any() for row, excluded in zip(ids, saved)):
+                self.stderr.write("A saved recipe was recommended")
+        seconds = time.perf_counter() - start_time
+
+        self.stdout.write(
+            f"{seconds:.1f}s: {users / seconds:.0f} users/s, "
+            f"{users * recipes * dimensions * 2 / seconds / 1e9:.1f} GFLOP/s, peak memory {peak_memory_mb():.0f} MB"
+        )
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from psycopg2.extras import execute_values
+from cooking import embeddings as embeddings_module
+from cooking import vector_index
+from cooking.bulk_embeddings import (
+    batch_by_tokens, RateLimiter, EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_INPUTS,
+)
+from cooking.db_connection import get_db_connection
+from cooking.embedding_backends import embedding_namespace
+from cooking.embeddings import recipe_text, recipe_content_hash
+from cooking.models import EmbeddingNamespace, UserEmbedding
+from cooking.tasks import recompute_user_embeddings
+from cooking.token_budget import count_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embed every stored recipe with the configured embedding backend, so it can replace "
+        "the one the stored vectors came from. Stop the workers still running the old backend "
+        "first; the response cache is emptied and every profile recomputed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Stored recipes read, embedded and written back per round')
+        parser.add_argument('--batch-tokens', type=int, default=EMBEDDING_BATCH_MAX_TOKENS,
+                            help='Token budget per embeddings API request')
+        parser.add_argument('--batch-inputs', type=int, default=EMBEDDING_BATCH_MAX_INPUTS,
+                            help='Recipes per embeddings API request')
+
+    def handle(self, *args, **options):
+        backend = embeddings_module.embeddings
+        namespace = embedding_namespace(backend)
+        stored = EmbeddingNamespace.objects.filter(id=1).values_list('namespace', flat=True).first()
+        if stored == namespace:
+            self.stdout.write(f"The stored vectors already come from {namespace}")
+            return
+        self.stdout.write(f"Re-embedding the stored recipes from {stored or 'an unrecorded backend'} to {namespace}")
+
+        limiter = RateLimiter()
+        total = 0
+        last_id = 0
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                while True:
+                    cur.execute("""
+                        SELECT id, title, cuisine, difficulty, ingredients, instructions, tips
+                        FROM public.recipe_embeddings
+                        WHERE id > %s
+                        ORDER BY id
+                        LIMIT %s
+                    """, (last_id, options['chunk_size']))
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+
+                    texts = [recipe_text({
+                        'title': title, 'cuisine': cuisine, 'difficulty': difficulty,
+                        'ingredients': ingredients or [], 'instructions': instructions or [], 'tips': tips or [],
+                    }) for _, title, cuisine, difficulty, ingredients, instructions, tips in rows]
+                    token_counts = [count_tokens(text, backend.model) for text in texts]
+                    vectors = []
+                    for batch, tokens in batch_by_tokens(texts, token_counts, options['batch_tokens'],
+                                                         options['batch_inputs']):
+                        limiter.acquire(tokens)
+                        vectors.extend(backend.embed_documents(batch))
+
+                    # Rows stored before content addressing keep no hash, as another row may share their text
+                    execute_values(cur, """
+                        UPDATE public.recipe_embeddings AS re
+                        SET embedding = v.embedding::vector,
+                            content_hash = CASE WHEN re.content_hash IS NULL THEN NULL ELSE v.content_hash END
+                        FROM (VALUES %s) AS v(id, embedding, content_hash)
+                        WHERE re.id = v.id
+                    """, [
+                        (row[0], vector, recipe_content_hash(text))
+                        for row, text, vector in zip(rows, texts, vectors)
+                    ], page_size=len(rows))
+                    conn.commit()
+                    total += len(rows)
+                    self.stdout.write(f"Re-embedded {total} recipes")
+
+                # Cached prompts were embedded by the old backend and would never match again
+                cur.execute("TRUNCATE public.response_cache")
+                conn.commit()
+
+        # Profiles are averages of the old vectors; clear them until recomputed
+        UserEmbedding.objects.update(embedding=[], embedding_sum=[], recipe_count=0)
+        EmbeddingNamespace.objects.update_or_create(id=1, defaults={'namespace': namespace})
+        users = recompute_user_embeddings()
+        if vector_index.ENABLED:
+            vector_index.index.write_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-embedded {total} recipes with {namespace}; queued profile recomputes for {users} users"
+        ))
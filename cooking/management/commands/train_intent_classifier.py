@@ -0,0 +1,57 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from cooking.models import Message
+from cooking import intent_classifier
+from cooking.context_manager import classify_by_keywords
+
+
+class Command(BaseCommand):
+    help = "Train the intent classifier from the message types stored on user messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=intent_classifier.MODEL_PATH,
+                            help='Where to write the trained model')
+        parser.add_argument('--epochs', type=int, default=10,
+                            help='Passes over the training messages')
+        parser.add_argument('--holdout', type=float, default=0.2,
+                            help='Fraction of messages held out to report accuracy')
+
+    def handle(self, *args, **options):
+        rows = list(Message.objects.filter(
+            role='user',
+            message_type__in=intent_classifier.LABELS
+        ).values_list('content', 'message_type'))
+        if len(rows) < 10:
+            raise CommandError(f"Only {len(rows)} labelled user messages; need at least 10 to train")
+
+        texts = [content for content, _ in rows]
+        labels = [message_type for _, message_type in rows]
+        self.stdout.write(f"Training on {len(rows)} labelled messages")
+
+        # Hold out a slice to compare against the keyword rules before training on everything
+        order = np.random.default_rng(0).permutation(len(rows))
+        split = int(len(rows) * (1 - options['holdout']))
+        train_ids, test_ids = order[:split], order[split:]
+        if len(test_ids):
+            model = intent_classifier.train(
+                [texts[i] for i in train_ids], [labels[i] for i in train_ids], epochs=options['epochs']
+            )
+            predictions = model.predict([texts[i] for i in test_ids])
+            model_accuracy = np.mean([predictions[j][0] == labels[i] for j, i in enumerate(test_ids)])
+            rules_accuracy = np.mean([classify_by_keywords(texts[i]) == labels[i] for i in test_ids])
+            self.stdout.write(f"Holdout accuracy on {len(test_ids)} messages: {model_accuracy:.1%}")
+            self.stdout.write(f"Keyword rules on the same messages: {rules_accuracy:.1%}")
+
+        model = intent_classifier.train(texts, labels, epochs=options['epochs'])
+
+        start_time = time.perf_counter()
+        for text in texts[:100]:
+            model.predict([text])
+        latency = (time.perf_counter() - start_time) / min(len(texts), 100)
+        self.stdout.write(f"Single-message prediction: {latency * 1000:.3f}ms")
+
+        model.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved intent model to {options['output']}; restart workers to load it"
+        ))
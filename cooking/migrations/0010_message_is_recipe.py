@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+def flag_recipe_messages(apps, schema_editor):
+    Message = apps.get_model("cooking", "Message")
+    Message.objects.filter(
+        role="assistant",
+        content__contains='<h2 data-recipe="title">',
+    ).update(is_recipe=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cooking", "0009_message_token_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="is_recipe",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(flag_recipe_messages, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["chat", "is_recipe", "created_at"],
+                name="cooking_msg_chat_recipe_idx",
+            ),
+        ),
+    ]
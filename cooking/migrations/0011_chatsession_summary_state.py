@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cooking", "0010_message_is_recipe"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsession",
+            name="summary_state",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cooking", "0011_chatsession_summary_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userembedding",
+            name="embedding_sum",
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name="userembedding",
+            name="recipe_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:05
+
+from django.db import migrations
+
+# recipe_embeddings is created by cooking/sql/vector_setup.sql rather than by a
+# model, so its index is managed with raw SQL and skipped where it does not exist
+# (e.g. a test database that vector_setup.sql was never run against, or SQLite).
+HNSW_INDEX = "recipe_embeddings_embedding_hnsw_idx"
+
+
+def _has_recipe_embeddings(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('public.recipe_embeddings') IS NOT NULL")
+        return cursor.fetchone()[0]
+
+
+def create_hnsw_index(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # CONCURRENTLY so saving recipes is not blocked while the graph is built
+        cursor.execute(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {HNSW_INDEX}
+            ON public.recipe_embeddings USING hnsw (embedding vector_cosine_ops)
+            WITH (m = 16, ef_construction = 64)
+        """)
+        # The IVFFlat index from vector_setup.sql was built with lists = 100 on an
+        # early, small table and is superseded by the HNSW index
+        cursor.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE schemaname = 'public' AND tablename = 'recipe_embeddings'
+              AND indexdef ILIKE '%USING ivfflat%'
+        """)
+        for (index_name,) in cursor.fetchall():
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS public."{index_name}"')
+
+
+def drop_hnsw_index(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS recipe_embeddings_embedding_idx
+            ON public.recipe_embeddings USING ivfflat (embedding vector_cosine_ops)
+            WITH (lists = 100)
+        """)
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{HNSW_INDEX}")
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("cooking", "0012_userembedding_embedding_sum_recipe_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_hnsw_index, drop_hnsw_index),
+    ]
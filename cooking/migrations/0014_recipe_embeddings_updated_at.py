@@ -0,0 +1,62 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:10
+
+from django.db import migrations
+
+# The in-process vector index refreshes from recipe_embeddings.updated_at, which
+# only had an insert-time default; keep it current on every update, and index it
+# for the incremental reads. Skipped where the table does not exist, as in 0013.
+
+
+def _has_recipe_embeddings(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('public.recipe_embeddings') IS NOT NULL")
+        return cursor.fetchone()[0]
+
+
+def add_updated_at_trigger(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION public.recipe_embeddings_touch_updated_at()
+            RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.updated_at = timezone('utc'::text, now());
+                RETURN NEW;
+            END;
+            $$
+        """)
+        cursor.execute("DROP TRIGGER IF EXISTS recipe_embeddings_updated_at ON public.recipe_embeddings")
+        cursor.execute("""
+            CREATE TRIGGER recipe_embeddings_updated_at
+            BEFORE UPDATE ON public.recipe_embeddings
+            FOR EACH ROW EXECUTE FUNCTION public.recipe_embeddings_touch_updated_at()
+        """)
+        cursor.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS recipe_embeddings_updated_at_idx
+            ON public.recipe_embeddings (updated_at)
+        """)
+
+
+def remove_updated_at_trigger(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS public.recipe_embeddings_updated_at_idx")
+        cursor.execute("DROP TRIGGER IF EXISTS recipe_embeddings_updated_at ON public.recipe_embeddings")
+        cursor.execute("DROP FUNCTION IF EXISTS public.recipe_embeddings_touch_updated_at()")
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("cooking", "0013_recipe_embeddings_hnsw_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_updated_at_trigger, remove_updated_at_trigger),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:00
+
+from django.db import migrations
+
+# Embeddings are content-addressed: save_recipe looks a recipe up by the hash of
+# its embedding text before calling the API or inserting another row. Skipped
+# where recipe_embeddings does not exist, as in 0013.
+
+
+def _has_recipe_embeddings(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('public.recipe_embeddings') IS NOT NULL")
+        return cursor.fetchone()[0]
+
+
+def add_content_hash(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE public.recipe_embeddings ADD COLUMN IF NOT EXISTS content_hash text")
+        # Existing rows keep a NULL hash and are simply never matched
+        cursor.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS recipe_embeddings_content_hash_idx
+            ON public.recipe_embeddings (content_hash)
+            WHERE content_hash IS NOT NULL
+        """)
+
+
+def remove_content_hash(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS public.recipe_embeddings_content_hash_idx")
+        cursor.execute("ALTER TABLE public.recipe_embeddings DROP COLUMN IF EXISTS content_hash")
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("cooking", "0014_recipe_embeddings_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_content_hash, remove_content_hash),
+    ]
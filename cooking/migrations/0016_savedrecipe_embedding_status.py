@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+def set_existing_statuses(apps, schema_editor):
+    # Recipes saved before embeddings moved to a task were embedded inline
+    SavedRecipe = apps.get_model("cooking", "SavedRecipe")
+    SavedRecipe.objects.filter(embedding_id__isnull=False).update(embedding_status="ready")
+    SavedRecipe.objects.filter(embedding_id__isnull=True).update(embedding_status="failed")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cooking", "0015_recipe_embeddings_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="savedrecipe",
+            name="embedding_status",
+            field=models.CharField(
+                choices=[("pending", "Pending"), ("ready", "Ready"), ("failed", "Failed")],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(set_existing_statuses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cooking', '0016_savedrecipe_embedding_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='savedrecipe',
+            name='embedding_id',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
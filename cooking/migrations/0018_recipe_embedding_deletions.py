@@ -0,0 +1,67 @@
+# Generated by Django 5.0.2 on 2026-10-18 23:40
+
+from django.db import migrations
+
+# The in-process vector index found deleted rows by reading every id on each
+# refresh. Record deletions in a tombstone table instead, so a refresh reads
+# only those since its last one. Skipped where the table does not exist, as in 0013.
+
+
+def _has_recipe_embeddings(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('public.recipe_embeddings') IS NOT NULL")
+        return cursor.fetchone()[0]
+
+
+def add_deletions_table(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.recipe_embedding_deletions (
+                id bigint PRIMARY KEY,
+                deleted_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS recipe_embedding_deletions_deleted_at_idx
+            ON public.recipe_embedding_deletions (deleted_at)
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION public.recipe_embeddings_record_deletion()
+            RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                INSERT INTO public.recipe_embedding_deletions (id) VALUES (OLD.id)
+                ON CONFLICT (id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+                RETURN OLD;
+            END;
+            $$
+        """)
+        cursor.execute("DROP TRIGGER IF EXISTS recipe_embeddings_deleted ON public.recipe_embeddings")
+        cursor.execute("""
+            CREATE TRIGGER recipe_embeddings_deleted
+            AFTER DELETE ON public.recipe_embeddings
+            FOR EACH ROW EXECUTE FUNCTION public.recipe_embeddings_record_deletion()
+        """)
+
+
+def remove_deletions_table(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TRIGGER IF EXISTS recipe_embeddings_deleted ON public.recipe_embeddings")
+        cursor.execute("DROP FUNCTION IF EXISTS public.recipe_embeddings_record_deletion()")
+        cursor.execute("DROP TABLE IF EXISTS public.recipe_embedding_deletions")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cooking", "0017_savedrecipe_embedding_id_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_deletions_table, remove_deletions_table),
+    ]
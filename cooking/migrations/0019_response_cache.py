@@ -0,0 +1,62 @@
+# Generated by Django 5.0.2 on 2026-10-18 23:55
+
+from django.db import migrations
+
+# The semantic response cache (cooking/response_cache.py) was only created by
+# sql/vector_setup.sql. It is a table of its own rather than rows in
+# recipe_embeddings: its vectors embed the user's prompt, not a recipe's text,
+# and its rows expire and are evicted by last hit. Every recipe_embeddings row is
+# a recommendable recipe that the vector index loads and saved recipes link to.
+# Skipped where recipe_embeddings (and so pgvector) does not exist, as in 0013.
+
+
+def _has_recipe_embeddings(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('public.recipe_embeddings') IS NOT NULL")
+        return cursor.fetchone()[0]
+
+
+def add_response_cache(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS public.response_cache (
+                id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                message_type text NOT NULL,
+                prompt text NOT NULL,
+                response text NOT NULL,
+                embedding vector(1536) NOT NULL,
+                hit_count integer DEFAULT 0 NOT NULL,
+                created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+                last_hit_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS response_cache_embedding_idx
+            ON public.response_cache USING hnsw (embedding vector_cosine_ops)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS response_cache_last_hit_at_idx
+            ON public.response_cache (last_hit_at)
+        """)
+
+
+def remove_response_cache(apps, schema_editor):
+    if not _has_recipe_embeddings(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS public.response_cache")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cooking", "0018_recipe_embedding_deletions"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_response_cache, remove_response_cache),
+    ]
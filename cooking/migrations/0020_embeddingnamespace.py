@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+# Vectors stored before the namespace was recorded came from OpenAI's default
+# embedding model, so a database that already has some is claimed for it;
+# otherwise the first backend to embed claims it. Only checked where
+# recipe_embeddings exists, as in 0013.
+LEGACY_NAMESPACE = "openai:text-embedding-ada-002"
+
+
+def _has_stored_vectors(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('public.recipe_embeddings') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM public.recipe_embeddings)")
+        return cursor.fetchone()[0]
+
+
+def claim_legacy_vectors(apps, schema_editor):
+    if _has_stored_vectors(schema_editor):
+        EmbeddingNamespace = apps.get_model("cooking", "EmbeddingNamespace")
+        EmbeddingNamespace.objects.get_or_create(id=1, defaults={"namespace": LEGACY_NAMESPACE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cooking', '0019_response_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingNamespace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=200)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(claim_legacy_vectors, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
+from . import token_budget
 
 # Create your models here.
 
+# Every recipe the assistant writes starts with this heading
+RECIPE_TITLE_MARKER = '<h2 data-recipe="title">'
+
 class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255, default="New Chat")
@@ -10,6 +14,7 @@ class ChatSession(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     recipe_summary = models.TextField(null=True, blank=True)  # Stores current recipe state
     last_summary_at = models.IntegerField(default=0)  # Message count when last summarized
+    summary_state = models.JSONField(default=dict, blank=True)  # Structured state recipe_summary is rendered from
     message_count = models.IntegerField(default=0)  # Total message count for quick reference
 
     def __str__(self):
@@ -34,11 +39,19 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPES, default='general_question')
     is_summarized = models.BooleanField(default=False)  # Track if this message is included in a summary
+    token_count = models.IntegerField(null=True, blank=True)  # Content tokens for the default model, set on save
+    is_recipe = models.BooleanField(default=False)  # Assistant message containing a full recipe, set on save
 
     def __str__(self):
         return ""  # Return empty string to prevent background text
 
     def save(self, *args, **kwargs):
+        self.is_recipe = self.role == 'assistant' and RECIPE_TITLE_MARKER in self.content
+
+        # Count tokens once at write time; left empty (for the backfill) if tiktoken is unavailable
+        if self.token_count is None and token_budget.get_encoding() is not None:
+            self.token_count = token_budget.count_tokens(self.content)
+
         # If this is a new message, increment the chat's message count
         if not self.pk:  # Only for new messages
             self.chat.message_count += 1
@@ -47,8 +60,20 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['chat', 'is_recipe', 'created_at'], name='cooking_msg_chat_recipe_idx'),
+        ]
 
 class SavedRecipe(models.Model):
+    EMBEDDING_PENDING = 'pending'
+    EMBEDDING_READY = 'ready'
+    EMBEDDING_FAILED = 'failed'
+    EMBEDDING_STATUSES = [
+        (EMBEDDING_PENDING, 'Pending'),
+        (EMBEDDING_READY, 'Ready'),
+        (EMBEDDING_FAILED, 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_recipes')
     title = models.CharField(max_length=200)
     content = models.TextField()
@@ -61,8 +86,10 @@ class SavedRecipe(models.Model):
     prep_time = models.CharField(max_length=50, null=True, blank=True)
     servings = models.CharField(max_length=50, null=True, blank=True)
     
-    # Link to recipe embedding
-    embedding_id = models.BigIntegerField(null=True, blank=True)
+    # Link to recipe embedding; indexed for the recommendations and shared-embedding lookups
+    embedding_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+    # Set to pending on save; the embed_saved_recipe task fills in embedding_id
+    embedding_status = models.CharField(max_length=10, choices=EMBEDDING_STATUSES, default=EMBEDDING_PENDING)
 
     class Meta:
         ordering = ['-created_at']
@@ -96,6 +123,8 @@ class SavedRecipe(models.Model):
 class UserEmbedding(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='embedding')
     embedding = models.JSONField()  # Store the embedding vector
+    embedding_sum = models.JSONField(default=list)  # Sum of the saved recipes' vectors, for incremental updates
+    recipe_count = models.IntegerField(default=0)  # Number of vectors in embedding_sum
     recommendations = models.JSONField(default=list)  # Store list of recommended recipe IDs
     last_updated = models.DateTimeField(auto_now=True)
 
@@ -106,3 +135,16 @@ class UserEmbedding(models.Model):
         indexes = [
             models.Index(fields=['user']),
         ]
+
+class EmbeddingNamespace(models.Model):
+    """
+    The embedding backend whose vectors are stored, in a single row.
+
+    recipe_embeddings, response_cache and the profiles only ever hold vectors
+    from this backend; see embeddings.check_embedding_namespace.
+    """
+    namespace = models.CharField(max_length=200)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.namespace
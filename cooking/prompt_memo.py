@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.core.cache import cache
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = int(os.getenv('PROMPT_MEMO_MAX_ENTRIES', 512))
+TTL_SECONDS = int(os.getenv('PROMPT_MEMO_TTL_SECONDS', 60 * 60))
+CACHE_KEY_PREFIX = 'prompt_memo:'
+
+_lock = threading.Lock()
+_local = OrderedDict()  # key -> (expires_at, response), oldest first
+_in_flight = {}  # key -> Future shared by every caller waiting on the same prompt
+
+_stats = {
+    'local_hits': 0,
+    'shared_hits': 0,
+    'misses': 0,
+    'coalesced': 0,
+    'evictions': 0,
+}
+
+def _increment_stat(name):
+    with _lock:
+        _stats[name] += 1
+
+def get_memo_stats():
+    """Return hit, miss and coalescing counters for this process."""
+    with _lock:
+        stats = dict(_stats)
+        stats['local_entries'] = len(_local)
+        stats['in_flight'] = len(_in_flight)
+    return stats
+
+def prompt_key(model, temperature, messages):
+    """
+    Hash the fully assembled prompt sent to the model.
+
+    Args:
+        model (str): Model name
+        temperature (float): Sampling temperature
+        messages (list): The final message list, system prompt included
+
+    Returns:
+        str: Hex digest identifying the prompt
+    """
+    payload = json.dumps({
+        'model': model,
+        'temperature': temperature,
+        'messages': [[message.type, message.content] for message in messages],
+    }, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def lookup(key):
+    """Return the memoized response for a prompt key, checking this process before Redis."""
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _local.move_to_end(key)
+                _stats['local_hits'] += 1
+                return entry[1]
+            del _local[key]
+
+    try:
+        response = cache.get(CACHE_KEY_PREFIX + key)
+    except Exception as e:
+        # Redis being down only costs us the shared layer
+        logger.warning(f"Shared prompt memo unavailable: {str(e)}")
+        response = None
+
+    if response is not None:
+        _store_local(key, response)
+        _increment_stat('shared_hits')
+        return response
+
+    _increment_stat('misses')
+    return None
+
+def _store_local(key, response):
+    with _lock:
+        _local[key] = (time.monotonic() + TTL_SECONDS, response)
+        _local.move_to_end(key)
+        while len(_local) > MAX_ENTRIES:
+            _local.popitem(last=False)
+            _stats['evictions'] += 1
+
+def store(key, response):
+    """Memoize a response locally and in the shared cache."""
+    if not response:
+        return
+    _store_local(key, response)
+    try:
+        cache.set(CACHE_KEY_PREFIX + key, response, TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Shared prompt memo unavailable: {str(e)}")
+
+def join_flight(key):
+    """
+    Join the in-flight request for a prompt key.
+
+    Returns:
+        tuple: (Future resolving to the response, True if the caller is the
+        leader and must compute the response and call finish_flight)
+    """
+    with _lock:
+        flight = _in_flight.get(key)
+        if flight is not None:
+            _stats['coalesced'] += 1
+            return flight, False
+        flight = Future()
+        _in_flight[key] = flight
+        return flight, True
+
+def finish_flight(key, flight, response=None, error=None):
+    """Publish the leader's result (or error) to every coalesced caller."""
+    with _lock:
+        if _in_flight.get(key) is flight:
+            del _in_flight[key]
+    if error is not None:
+        flight.set_exception(error)
+    else:
+        flight.set_result(response)
+
+def memoize(key, compute):
+    """Return the memoized response for key, or compute it once however many callers ask at the same time."""
+    response = lookup(key)
+    if response is not None:
+        return response
+
+    flight, is_leader = join_flight(key)
+    if not is_leader:
+        return flight.result()
+
+    try:
+        response = compute()
+    except BaseException as e:
+        finish_flight(key, flight, error=e)
+        raise
+    store(key, response)
+    finish_flight(key, flight, response)
+    return response
+
+async def amemoize(key, compute):
+    """Async version of memoize; compute is a coroutine function."""
+    response = await sync_to_async(lookup)(key)
+    if response is not None:
+        return response
+
+    flight, is_leader = join_flight(key)
+    if not is_leader:
+        return await asyncio.wrap_future(flight)
+
+    try:
+        response = await compute()
+    except BaseException as e:
+        finish_flight(key, flight, error=e)
+        raise
+    await sync_to_async(store)(key, response)
+    finish_flight(key, flight, response)
+    return response
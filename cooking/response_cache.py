@@ -0,0 +1,145 @@
+import os
+import threading
+import logging
+from .context_manager import classify_message_type, has_recipe_context
+from .db_connection import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+CACHEABLE_MESSAGE_TYPES = {'recipe_creation'}
+SIMILARITY_THRESHOLD = float(os.getenv('RESPONSE_CACHE_SIMILARITY_THRESHOLD', 0.95))
+TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+
+_stats_lock = threading.Lock()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'skipped': 0,
+    'stores': 0,
+    'evictions': 0,
+    'errors': 0,
+}
+
+def _increment_stat(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def get_cache_stats():
+    """Return hit/miss counters for this process, plus the hit rate over cacheable lookups."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+def _embed_prompt(user_message):
+    # Imported here so the chat path does not build the embeddings client until it is needed
+    from .embeddings import embeddings, check_embedding_namespace
+    # Compared with the cached prompts' vectors, so it must come from the same backend
+    check_embedding_namespace()
+    return embeddings.embed_query(user_message.strip().lower())
+
+def get_cached_response(chat_session, user_message):
+    """
+    Look up a cached response for a user message.
+
+    Near-identical first requests ("recipe for carbonara", "how to make
+    carbonara") are matched by cosine similarity of their embeddings. Only
+    recipe-creation messages in chats without a recipe yet are cacheable,
+    since anything else depends on the conversation so far.
+
+    Args:
+        chat_session (ChatSession): The chat the message belongs to
+        user_message (str): The user's message
+
+    Returns:
+        tuple: (cached response or None, prompt embedding to pass to
+        cache_response on a miss, or None when the message is not cacheable)
+    """
+    message_type = classify_message_type(user_message)
+    if message_type not in CACHEABLE_MESSAGE_TYPES or has_recipe_context(chat_session):
+        _increment_stat('skipped')
+        return None, None
+
+    try:
+        embedding = _embed_prompt(user_message)
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, response, 1 - (embedding <=> %s::vector) AS similarity
+                    FROM public.response_cache
+                    WHERE message_type = %s
+                    AND created_at > now() - make_interval(secs => %s)
+                    ORDER BY embedding <=> %s::vector
+                    LIMIT 1
+                """, (embedding, message_type, TTL_SECONDS, embedding))
+                result = cur.fetchone()
+
+                if result and result[2] >= SIMILARITY_THRESHOLD:
+                    cur.execute("""
+                        UPDATE public.response_cache
+                        SET hit_count = hit_count + 1, last_hit_at = now()
+                        WHERE id = %s
+                    """, (result[0],))
+                    conn.commit()
+                    _increment_stat('hits')
+                    logger.info(f"Response cache hit for chat {chat_session.id} (similarity {result[2]:.3f})")
+                    return result[1], embedding
+
+        _increment_stat('misses')
+        return None, embedding
+
+    except Exception as e:
+        # The cache must never take the chat down; treat failures as a miss
+        _increment_stat('errors')
+        logger.error(f"Response cache lookup failed: {str(e)}")
+        return None, None
+
+def cache_response(embedding, user_message, response):
+    """
+    Store a generated response under its prompt embedding and evict stale entries.
+
+    Args:
+        embedding (list): Prompt embedding returned by get_cached_response
+        user_message (str): The user's message
+        response (str): The generated response
+    """
+    if embedding is None or '<h2 data-recipe="title">' not in response:
+        return
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO public.response_cache
+                    (message_type, prompt, response, embedding)
+                    VALUES (%s, %s, %s, %s)
+                """, (classify_message_type(user_message), user_message, response, embedding))
+
+                # Expire entries past their TTL
+                cur.execute("""
+                    DELETE FROM public.response_cache
+                    WHERE created_at < now() - make_interval(secs => %s)
+                """, (TTL_SECONDS,))
+                evicted = cur.rowcount
+
+                # Then drop the least recently used entries beyond the size bound
+                cur.execute("""
+                    DELETE FROM public.response_cache
+                    WHERE id IN (
+                        SELECT id FROM public.response_cache
+                        ORDER BY last_hit_at DESC
+                        OFFSET %s
+                    )
+                """, (MAX_ENTRIES,))
+                evicted += cur.rowcount
+                conn.commit()
+
+        _increment_stat('stores')
+        if evicted:
+            _increment_stat('evictions', evicted)
+
+    except Exception as e:
+        _increment_stat('errors')
+        logger.error(f"Response cache store failed: {str(e)}")
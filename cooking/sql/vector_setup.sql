@@ -11,13 +11,77 @@ create table if not exists recipe_embeddings (
     instructions text[],
     tips text[],
     embedding vector(1536),
+    -- sha256 of the text the recipe was embedded from; identical recipes share a row
+    content_hash text,
     created_at timestamp with time zone default timezone('utc'::text, now()) not null,
     updated_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
 
--- Create an index for faster similarity search
-create index on recipe_embeddings using ivfflat (embedding vector_cosine_ops)
-with (lists = 100);
+-- Create an index for faster similarity search; queries must ORDER BY the
+-- <=> distance itself for it to be used (tune recall with hnsw.ef_search).
+-- Migration 0013 replaces the IVFFlat index on existing databases.
+create index if not exists recipe_embeddings_embedding_hnsw_idx on recipe_embeddings
+using hnsw (embedding vector_cosine_ops) with (m = 16, ef_construction = 64);
+
+-- Keep updated_at current; the in-process vector index refreshes from it
+create or replace function recipe_embeddings_touch_updated_at()
+returns trigger language plpgsql as $$
+begin
+    new.updated_at = timezone('utc'::text, now());
+    return new;
+end;
+$$;
+
+drop trigger if exists recipe_embeddings_updated_at on recipe_embeddings;
+create trigger recipe_embeddings_updated_at
+before update on recipe_embeddings
+for each row execute function recipe_embeddings_touch_updated_at();
+
+create index if not exists recipe_embeddings_updated_at_idx on recipe_embeddings (updated_at);
+
+-- Tombstones for deleted rows, so the vector index reads deletions since its
+-- last refresh instead of every id; pruned when a snapshot is written
+create table if not exists recipe_embedding_deletions (
+    id bigint primary key,
+    deleted_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+create index if not exists recipe_embedding_deletions_deleted_at_idx on recipe_embedding_deletions (deleted_at);
+
+create or replace function recipe_embeddings_record_deletion()
+returns trigger language plpgsql as $$
+begin
+    insert into recipe_embedding_deletions (id) values (old.id)
+    on conflict (id) do update set deleted_at = excluded.deleted_at;
+    return old;
+end;
+$$;
+
+drop trigger if exists recipe_embeddings_deleted on recipe_embeddings;
+create trigger recipe_embeddings_deleted
+after delete on recipe_embeddings
+for each row execute function recipe_embeddings_record_deletion();
+
+create unique index if not exists recipe_embeddings_content_hash_idx on recipe_embeddings (content_hash)
+where content_hash is not null;
+
+-- Semantic cache of generated recipes, keyed by the embedding of the user's prompt.
+-- Kept apart from recipe_embeddings, whose rows are recommendable recipes embedded
+-- from their own text; these expire and are evicted. Migration 0019 creates it
+-- on existing databases.
+create table if not exists response_cache (
+    id bigint generated by default as identity primary key,
+    message_type text not null,
+    prompt text not null,
+    response text not null,
+    embedding vector(1536) not null,
+    hit_count integer default 0 not null,
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    last_hit_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+create index if not exists response_cache_embedding_idx on response_cache using hnsw (embedding vector_cosine_ops);
+create index if not exists response_cache_last_hit_at_idx on response_cache (last_hit_at);
 
 -- Create a function to find similar recipes
 create or replace function match_recipes(
@@ -1,12 +1,95 @@
 from celery import shared_task
+from celery.signals import worker_process_init
+import os
+import random
+import threading
 import logging
-from .models import UserEmbedding, SavedRecipe
-from .db_connection import get_db_connection
 import numpy as np
-import json
+import openai
+import psycopg2
+import psycopg2.pool
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import UserEmbedding, SavedRecipe, ChatSession
+from .db_connection import get_db_connection
+from .context_manager import create_conversation_summary
+from .embeddings import (
+    fetch_recipe_embeddings, set_vector_search_params,
+    generate_recipe_embedding, store_recipe_embedding, recipe_embedding_exists,
+    delete_unreferenced_recipe_embedding,
+)
+from .utils import extract_ingredients, extract_instructions, extract_tips
+from . import vector_index
+from .batch_recommendations import materialize_recommendations
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long a queued or running summary blocks the next one for the same chat
+SUMMARY_LOCK_SECONDS = int(os.getenv('SUMMARY_LOCK_SECONDS', 300))
+
+# Profile refreshes requested within this window run once, at its end
+USER_EMBEDDING_DEBOUNCE_SECONDS = int(os.getenv('USER_EMBEDDING_DEBOUNCE_SECONDS', 10))
+# Upper bound on how long a queued refresh absorbs new requests, should its task be lost
+USER_EMBEDDING_LOCK_SECONDS = int(os.getenv('USER_EMBEDDING_LOCK_SECONDS', 300))
+USER_EMBEDDING_METRICS_PREFIX = 'user_embedding:metrics:'
+
+# Recommendations stored per user
+RECOMMENDATION_COUNT = 5
+
+# Retries of a saved recipe's embedding after a transient failure, with the
+# delay doubling from EMBEDDING_RETRY_BACKOFF up to EMBEDDING_RETRY_BACKOFF_MAX
+EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', 5))
+EMBEDDING_RETRY_BACKOFF = float(os.getenv('EMBEDDING_RETRY_BACKOFF', 5))
+EMBEDDING_RETRY_BACKOFF_MAX = float(os.getenv('EMBEDDING_RETRY_BACKOFF_MAX', 300))
+# Rate limits, timeouts, 5xx responses and lost or exhausted database connections
+RETRYABLE_EMBEDDING_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    psycopg2.OperationalError,
+    psycopg2.pool.PoolError,
+)
+
+def _summary_lock_key(chat_id):
+    return f"summarize_conversation:{chat_id}"
+
+def schedule_conversation_summary(chat_id):
+    """
+    Queue a background summary of a chat unless one is already queued or running.
+
+    The per-chat lock is taken here, when the task is queued, so bursts of
+    messages produce a single task; the task releases it when it finishes.
+
+    Returns:
+        bool: True if a task was queued
+    """
+    lock_key = _summary_lock_key(chat_id)
+    if not cache.add(lock_key, 'queued', SUMMARY_LOCK_SECONDS):
+        logger.info(f"Summary already pending for chat {chat_id}, skipping")
+        return False
+
+    try:
+        summarize_conversation.delay(chat_id)
+    except Exception as e:
+        cache.delete(lock_key)
+        logger.error(f"Could not queue summary for chat {chat_id}: {str(e)}")
+        return False
+    return True
+
+@shared_task
+def summarize_conversation(chat_id):
+    """
+    Fold a chat's new messages into its summary, off the request path.
+    """
+    try:
+        chat_session = ChatSession.objects.get(id=chat_id)
+        create_conversation_summary(chat_session)
+    except ChatSession.DoesNotExist:
+        logger.info(f"Chat {chat_id} was deleted before it could be summarized")
+    finally:
+        cache.delete(_summary_lock_key(chat_id))
+
 @shared_task
 def test_celery_task():
     """
@@ -15,109 +98,415 @@ def test_celery_task():
     logger.info("Test Celery task is running!")
     return "Celery is working!"
 
+def apply_recipe_delta(user_id, added=(), removed=()):
+    """
+    Update a user's profile embedding for saved or deleted recipes in O(d).
+
+    The profile keeps the sum of its recipe vectors and their count, so adding
+    or removing a recipe is a vector add/subtract rather than a re-average of
+    every saved recipe. Recommendations are refreshed separately.
+
+    Args:
+        user_id (int): The user's ID
+        added (list): Vectors of newly saved recipes
+        removed (list): Vectors of deleted (or replaced) recipes
+
+    Returns:
+        bool: False if the profile has no stored sum to update (none yet, or
+        saved before sums were stored) and a full recompute is needed instead
+    """
+    if not added and not removed:
+        return True
+
+    with transaction.atomic():
+        profile = UserEmbedding.objects.select_for_update().filter(user_id=user_id).first()
+        if profile is None or (profile.recipe_count == 0 and profile.embedding):
+            return False
+
+        count = profile.recipe_count + len(added) - len(removed)
+        if count < 0:
+            logger.warning(f"Profile embedding for user {user_id} is out of sync, recomputing")
+            return False
+
+        if count == 0:
+            profile.embedding_sum = []
+            profile.embedding = []
+            profile.recommendations = []
+        else:
+            total = np.array(profile.embedding_sum or np.zeros(len((added or removed)[0])), dtype=np.float64)
+            for vector in added:
+                total += vector
+            for vector in removed:
+                total -= vector
+            profile.embedding_sum = total.tolist()
+            profile.embedding = (total / count).tolist()
+        profile.recipe_count = count
+        profile.save(update_fields=['embedding_sum', 'embedding', 'recipe_count', 'recommendations', 'last_updated'])
+
+    return True
+
+def _user_embedding_pending_key(user_id):
+    return f"user_embedding:pending:{user_id}"
+
+def _user_embedding_recompute_key(user_id):
+    return f"user_embedding:recompute:{user_id}"
+
+def _increment_metric(name):
+    # Shared through the cache because requests are counted in web processes and runs in workers
+    key = USER_EMBEDDING_METRICS_PREFIX + name
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        cache.add(key, 1, None)
+
+def get_user_embedding_stats():
+    """
+    Return profile update counters shared by every process.
+
+    queue_depth is the number of debounced refreshes queued but not yet
+    started; coalesce_rate is the share of requests absorbed by one already
+    pending.
+    """
+    names = ['requested', 'queued', 'coalesced', 'started']
+    values = cache.get_many([USER_EMBEDDING_METRICS_PREFIX + name for name in names])
+    stats = {name: values.get(USER_EMBEDDING_METRICS_PREFIX + name, 0) for name in names}
+    stats['queue_depth'] = max(stats['queued'] - stats['started'], 0)
+    stats['coalesce_rate'] = stats['coalesced'] / stats['requested'] if stats['requested'] else 0.0
+    return stats
+
+def request_user_embedding_refresh(user_id, recompute=False):
+    """
+    Queue a debounced refresh of a user's profile and recommendations.
+
+    The first request in a burst queues one task to run after
+    USER_EMBEDDING_DEBOUNCE_SECONDS; requests arriving before it starts are
+    folded into it. A recompute request upgrades the pending refresh.
+
+    Returns:
+        bool: True if a task was queued, False if the request was coalesced
+    """
+    _increment_metric('requested')
+    if recompute:
+        # Set before the pending key so a task starting in between still sees it
+        cache.set(_user_embedding_recompute_key(user_id), True, USER_EMBEDDING_LOCK_SECONDS)
+
+    pending_key = _user_embedding_pending_key(user_id)
+    if not cache.add(pending_key, 'queued', USER_EMBEDDING_LOCK_SECONDS):
+        _increment_metric('coalesced')
+        return False
+
+    try:
+        refresh_user_embedding.apply_async((user_id,), countdown=USER_EMBEDDING_DEBOUNCE_SECONDS)
+    except Exception as e:
+        cache.delete(pending_key)
+        logger.error(f"Could not queue profile update for user {user_id}: {str(e)}")
+        return False
+    _increment_metric('queued')
+    return True
+
+def schedule_user_embedding_update(user_id, added=(), removed=()):
+    """
+    Apply saved or deleted recipes to a user's profile and queue a recommendations refresh.
+
+    Args:
+        user_id (int): The user's ID
+        added (list): Vectors of newly saved recipes
+        removed (list): Vectors of deleted or replaced recipes, or None if a
+            recipe was removed but its vector is unknown
+    """
+    recompute = removed is None or not apply_recipe_delta(user_id, added, removed)
+    return request_user_embedding_refresh(user_id, recompute=recompute)
+
 @shared_task
-def update_user_embedding(user_id):
+def refresh_user_embedding(user_id):
     """
-    Calculate user embedding by averaging their saved recipe embeddings,
-    find similar recipes, and store both the embedding and recommendations.
+    Run the profile update a burst of requests was coalesced into.
+    """
+    # Released first, so requests from here on queue a fresh task rather than
+    # being folded into a run that has already read the profile
+    cache.delete(_user_embedding_pending_key(user_id))
+    recompute_key = _user_embedding_recompute_key(user_id)
+    recompute = bool(cache.get(recompute_key))
+    if recompute:
+        cache.delete(recompute_key)
+    _increment_metric('started')
+    return update_user_embedding(user_id, recompute=recompute)
+
+def _search_vector_index(embedding, saved_recipe_ids):
+    """Recommendations from the in-process index, or None to query pgvector instead."""
+    if not vector_index.ENABLED:
+        return None
+    try:
+        results = vector_index.search(embedding, RECOMMENDATION_COUNT, exclude=saved_recipe_ids)
+    except Exception as e:
+        logger.error(f"In-process vector index unavailable, querying pgvector: {str(e)}")
+        return None
+    for recipe_id, score in results:
+        logger.info(f"Recommended recipe ID: {recipe_id}, Score: {score:.3f}")
+    return [{'recipe_id': recipe_id, 'similarity_score': score} for recipe_id, score in results]
+
+@shared_task
+def update_user_embedding(user_id, recompute=True):
+    """
+    Find recipes similar to the user's profile embedding and store them as recommendations.
+
+    With recompute, the profile is first rebuilt from every saved recipe, which
+    also corrects any drift in the incrementally maintained sum; without it the
+    stored profile (kept current by apply_recipe_delta) is used as is.
     """
     try:
         # Get all saved recipes for the user
-        saved_recipes = SavedRecipe.objects.filter(user_id=user_id)
-        
-        if not saved_recipes.exists():
+        saved_recipe_ids = list(SavedRecipe.objects.filter(
+            user_id=user_id,
+            embedding_id__isnull=False
+        ).values_list('embedding_id', flat=True))
+
+        if not saved_recipe_ids:
             logger.info(f"No saved recipes found for user {user_id}")
+            UserEmbedding.objects.filter(user_id=user_id).update(
+                embedding=[], embedding_sum=[], recipe_count=0, recommendations=[], last_updated=timezone.now()
+            )
             return None
-            
-        # Get embeddings from Supabase
-        embeddings = []
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                for recipe in saved_recipes:
-                    if recipe.embedding_id:
-                        cur.execute("""
-                            SELECT embedding 
-                            FROM public.recipe_embeddings 
-                            WHERE id = %s
-                        """, (recipe.embedding_id,))
-                        result = cur.fetchone()
-                        if result and result[0]:
-                            # Convert the embedding to a numpy array
-                            try:
-                                # If the embedding is already a list, use it directly
-                                if isinstance(result[0], list):
-                                    embedding = result[0]
-                                # If it's a string, try to parse it as JSON
-                                elif isinstance(result[0], str):
-                                    embedding = json.loads(result[0])
-                                else:
-                                    embedding = result[0]
-                                
-                                # Convert to numpy array and ensure it's float
-                                embedding_array = np.array(embedding, dtype=np.float32)
-                                embeddings.append(embedding_array)
-                            except Exception as e:
-                                logger.error(f"Error processing embedding for recipe {recipe.id}: {str(e)}")
-                                continue
-        
-        if not embeddings:
-            logger.info(f"No valid embeddings found for user {user_id}'s recipes")
-            return None
-            
-        # Calculate average embedding
-        avg_embedding = np.mean(embeddings, axis=0).tolist()
-        
-        # Get saved recipe IDs to exclude
-        saved_recipe_ids = [recipe.embedding_id for recipe in saved_recipes if recipe.embedding_id]
-        logger.info(f"Excluding user's saved recipe IDs: {saved_recipe_ids}")
-        
-        # Find similar recipes
+
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                # First, verify we have recipes to recommend
-                cur.execute("""
-                    SELECT COUNT(*) 
-                    FROM public.recipe_embeddings 
-                    WHERE id != ALL(%s)
-                """, (saved_recipe_ids,))
-                available_recipes = cur.fetchone()[0]
-                logger.info(f"Found {available_recipes} recipes available for recommendations")
-                
-                # Get recommendations
-                cur.execute("""
-                    WITH user_embedding AS (
-                        SELECT %s::vector AS embedding
-                    )
-                    SELECT 
-                        re.id,
-                        1 - (re.embedding <=> (SELECT embedding FROM user_embedding)) as similarity,
-                        re.title  -- Moved title to the end
-                    FROM public.recipe_embeddings re
-                    WHERE re.id != ALL(%s)
-                    ORDER BY similarity DESC
-                    LIMIT 5
-                """, (avg_embedding, saved_recipe_ids))
-                
-                recommendations = []
-                for row in cur.fetchall():
-                    recommendations.append({
-                        'recipe_id': row[0],
-                        'similarity_score': float(row[1])
-                    })
-                    logger.info(f"Recommended recipe ID: {row[0]}, Title: {row[2]}, Score: {float(row[1]):.3f}")
-        
-        # Update or create user embedding with recommendations
-        user_embedding, created = UserEmbedding.objects.update_or_create(
-            user_id=user_id,
-            defaults={
-                'embedding': avg_embedding,
-                'recommendations': recommendations
-            }
-        )
+                if recompute:
+                    # Get all embeddings from Supabase in one round trip
+                    found_ids, embeddings = fetch_recipe_embeddings(cur, saved_recipe_ids)
+
+                    if not found_ids:
+                        logger.info(f"No valid embeddings found for user {user_id}'s recipes")
+                        return None
+
+                    # Calculate average embedding
+                    embedding_sum = embeddings.sum(axis=0, dtype=np.float64)
+                    avg_embedding = (embedding_sum / len(found_ids)).tolist()
+                else:
+                    profile = UserEmbedding.objects.filter(user_id=user_id).only('id', 'embedding').first()
+                    if profile is None or not profile.embedding:
+                        return None
+                    avg_embedding = profile.embedding
+
+                # Exclude the user's saved recipes from the recommendations
+                logger.info(f"Excluding user's saved recipe IDs: {saved_recipe_ids}")
+
+                recommendations = _search_vector_index(avg_embedding, saved_recipe_ids)
+                if recommendations is None:
+                    # Get recommendations, ordered by the distance operator so the HNSW index is used
+                    set_vector_search_params(cur, RECOMMENDATION_COUNT, len(saved_recipe_ids))
+                    cur.execute("""
+                        SELECT 
+                            re.id,
+                            1 - (re.embedding <=> %(embedding)s::vector) as similarity,
+                            re.title  -- Moved title to the end
+                        FROM public.recipe_embeddings re
+                        WHERE re.id != ALL(%(excluded)s)
+                        ORDER BY re.embedding <=> %(embedding)s::vector
+                        LIMIT %(limit)s
+                    """, {'embedding': avg_embedding, 'excluded': saved_recipe_ids, 'limit': RECOMMENDATION_COUNT})
+                    
+                    recommendations = []
+                    for row in cur.fetchall():
+                        recommendations.append({
+                            'recipe_id': row[0],
+                            'similarity_score': float(row[1])
+                        })
+                        logger.info(f"Recommended recipe ID: {row[0]}, Title: {row[2]}, Score: {float(row[1]):.3f}")
         
+        if recompute:
+            # Update or create user embedding with recommendations
+            user_embedding, created = UserEmbedding.objects.update_or_create(
+                user_id=user_id,
+                defaults={
+                    'embedding': avg_embedding,
+                    'embedding_sum': embedding_sum.tolist(),
+                    'recipe_count': len(found_ids),
+                    'recommendations': recommendations
+                }
+            )
+        else:
+            # Only the recommendations; the profile may have moved on since it was read
+            user_embedding = profile
+            UserEmbedding.objects.filter(user_id=user_id).update(
+                recommendations=recommendations, last_updated=timezone.now()
+            )
+
         logger.info(f"Successfully updated embedding and recommendations for user {user_id}")
         return user_embedding.id
         
     except Exception as e:
         logger.error(f"Error updating user embedding for user {user_id}: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+@shared_task
+def recompute_user_embeddings():
+    """
+    Queue a full profile recompute for every user with saved recipes.
+
+    Run periodically (see CELERY_BEAT_SCHEDULE) to correct drift in the
+    incrementally updated sums, e.g. from a failed update.
+    """
+    user_ids = SavedRecipe.objects.filter(
+        embedding_id__isnull=False
+    ).values_list('user_id', flat=True).distinct()
+    count = 0
+    for user_id in user_ids:
+        request_user_embedding_refresh(user_id, recompute=True)
+        count += 1
+    logger.info(f"Queued profile embedding recompute for {count} users")
+    return count
+
+def saved_recipe_embedding_data(saved_recipe):
+    """Build the recipe dict generate_recipe_embedding expects from a SavedRecipe."""
+    return {
+        'title': saved_recipe.title,
+        'cuisine': saved_recipe.cuisine_type,
+        'difficulty': saved_recipe.difficulty,
+        'ingredients': extract_ingredients(saved_recipe.content),
+        'instructions': extract_instructions(saved_recipe.content),
+        'tips': extract_tips(saved_recipe.content)
+    }
+
+def schedule_recipe_embedding(saved_recipe_id):
+    """
+    Queue a saved recipe's embedding once the current transaction commits.
+
+    Queued on commit so the task never reads the recipe before it exists, or
+    an older version of it.
+    """
+    transaction.on_commit(lambda: embed_saved_recipe.delay(saved_recipe_id))
+
+def _embedding_retry_delay(retries):
+    # Exponential backoff with jitter, so a rate limit does not retry every recipe at once
+    delay = min(EMBEDDING_RETRY_BACKOFF * 2 ** retries, EMBEDDING_RETRY_BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def _mark_embedding_failed(saved_recipe_id):
+    SavedRecipe.objects.filter(
+        id=saved_recipe_id, embedding_status=SavedRecipe.EMBEDDING_PENDING
+    ).update(embedding_status=SavedRecipe.EMBEDDING_FAILED)
+
+def _discard_unlinked_embedding(embedding_id):
+    # The row stored for a recipe that will not link it, unless another saved recipe uses it
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            deleted, _ = delete_unreferenced_recipe_embedding(cur, embedding_id)
+            conn.commit()
+    if deleted:
+        logger.info(f"Deleted unlinked recipe embedding {embedding_id}")
+
+@shared_task(bind=True, max_retries=EMBEDDING_MAX_RETRIES)
+def embed_saved_recipe(self, saved_recipe_id):
+    """
+    Embed a saved recipe, link it to its recipe_embeddings row and update the user's profile.
+
+    Transient API and database errors are retried with backoff; once retries
+    run out, or on any other error, the recipe is marked failed.
+
+    Returns:
+        int: The recipe's embedding ID, or None if there was nothing to do
+    """
+    saved_recipe = SavedRecipe.objects.filter(id=saved_recipe_id).first()
+    if saved_recipe is None:
+        logger.info(f"Saved recipe {saved_recipe_id} was deleted before it could be embedded")
+        return None
+
+    recipe_data = saved_recipe_embedding_data(saved_recipe)
+    try:
+        recipe_with_embedding = generate_recipe_embedding(recipe_data)
+        stored_embedding = store_recipe_embedding(recipe_with_embedding)
+    except RETRYABLE_EMBEDDING_ERRORS as e:
+        if self.request.retries < self.max_retries:
+            countdown = _embedding_retry_delay(self.request.retries)
+            logger.warning(
+                f"Embedding saved recipe {saved_recipe_id} failed, retrying in {countdown:.0f}s: {str(e)}"
+            )
+            raise self.retry(exc=e, countdown=countdown)
+        logger.error(f"Giving up on embedding saved recipe {saved_recipe_id}: {str(e)}")
+        _mark_embedding_failed(saved_recipe_id)
+        raise
+    except Exception as e:
+        logger.error(f"Error embedding saved recipe {saved_recipe_id}: {str(e)}")
+        _mark_embedding_failed(saved_recipe_id)
+        raise
+
+    with transaction.atomic():
+        saved_recipe = SavedRecipe.objects.select_for_update().filter(id=saved_recipe_id).first()
+        if saved_recipe is None:
+            logger.info(f"Saved recipe {saved_recipe_id} was deleted while it was being embedded")
+            _discard_unlinked_embedding(stored_embedding['id'])
+            return None
+        if saved_recipe_embedding_data(saved_recipe) != recipe_data:
+            # Edited meanwhile; the task queued by that save embeds the new version
+            logger.info(f"Saved recipe {saved_recipe_id} changed while it was being embedded, skipping")
+            _discard_unlinked_embedding(stored_embedding['id'])
+            return None
+        # Deleting the last recipe that shared the row may have removed it since it was stored
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                found = recipe_embedding_exists(cur, stored_embedding['id'])
+        if not found:
+            stored_embedding = store_recipe_embedding(recipe_with_embedding)
+        previous_id = saved_recipe.embedding_id
+        saved_recipe.embedding_id = stored_embedding['id']
+        saved_recipe.embedding_status = SavedRecipe.EMBEDDING_READY
+        saved_recipe.save(update_fields=['embedding_id', 'embedding_status'])
+
+    if previous_id == stored_embedding['id']:
+        return previous_id
+
+    # The replaced recipe's vector comes out of the user's profile
+    removed = []
+    if previous_id:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                found_ids, vectors = fetch_recipe_embeddings(cur, [previous_id])
+        removed = list(vectors) if found_ids else None
+
+    schedule_user_embedding_update(
+        saved_recipe.user_id,
+        added=[recipe_with_embedding['embedding']],
+        removed=removed
+    )
+    return stored_embedding['id']
+
+@shared_task
+def materialize_all_recommendations():
+    """
+    Recompute every user's recommendations in one batch over the recipe vectors.
+
+    Run nightly (see CELERY_BEAT_SCHEDULE); saves and deletes still refresh
+    their user's recommendations as they happen.
+    """
+    return materialize_recommendations(RECOMMENDATION_COUNT)
+
+@worker_process_init.connect
+def warm_vector_index(**kwargs):
+    """
+    Load the in-process vector index when a worker process starts.
+
+    Loaded in the background, since Celery limits how long process init may
+    take; each prefork child maps the same snapshot file, so they share its pages.
+    """
+    if vector_index.ENABLED:
+        threading.Thread(target=_load_vector_index, daemon=True).start()
+
+def _load_vector_index():
+    try:
+        vector_index.index.get_state()
+    except Exception as e:
+        logger.error(f"Could not load the vector index at worker start: {str(e)}")
+
+@shared_task
+def snapshot_vector_index():
+    """
+    Fold the vector index's incremental changes into a new memory-mapped snapshot.
+
+    Processes switch to it on their next refresh, dropping their private copies
+    of the rows changed since the previous snapshot.
+    """
+    if not vector_index.ENABLED:
+        return None
+    return vector_index.index.write_snapshot()
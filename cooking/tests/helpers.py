@@ -0,0 +1,31 @@
+from unittest.mock import MagicMock, DEFAULT
+import struct
+
+def vector_bytes(values):
+    """Encode a vector the way pgvector's vector_send does"""
+    return struct.pack('>hh', len(values), 0) + struct.pack(f'>{len(values)}f', *values)
+
+def mock_connection(fetchone=(), fetchall=(), cursor=None):
+    """
+    Build a get_db_connection replacement and the cursor its connections hand out.
+
+    Args:
+        fetchone (list): Rows for successive fetchone calls, then the mock's return_value (None)
+        fetchall (list): Row lists for successive fetchall calls, then the mock's return_value ([])
+        cursor (MagicMock): A cursor that serves its own results instead
+
+    Returns:
+        tuple: (get_db_connection replacement, cursor)
+    """
+    if cursor is None:
+        fetchone_results, fetchall_results = iter(fetchone), iter(list(rows) for rows in fetchall)
+        cursor = MagicMock()
+        cursor.fetchone.return_value = None
+        cursor.fetchone.side_effect = lambda: next(fetchone_results, DEFAULT)
+        cursor.fetchall.return_value = []
+        cursor.fetchall.side_effect = lambda: next(fetchall_results, DEFAULT)
+        cursor.rowcount = 0
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    conn.cursor.return_value.__enter__.return_value = cursor
+    return MagicMock(return_value=conn), cursor
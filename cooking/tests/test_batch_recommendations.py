@@ -0,0 +1,97 @@
+from django.test import TestCase, SimpleTestCase
+from django.contrib.auth.models import User
+from django.utils import timezone
+from unittest.mock import patch
+from cooking.models import SavedRecipe, UserEmbedding
+from cooking import vector_index
+from cooking.batch_recommendations import top_k_blocked, recipe_blocks, materialize_recommendations
+from datetime import timedelta
+import numpy as np
+
+def normalized(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def index_state(ids, vectors, live=None, delta_ids=(), delta_vectors=None):
+    ids = np.asarray(ids, dtype=np.int64)
+    return vector_index._State(
+        None, ids, normalized(np.asarray(vectors, dtype=np.float32)),
+        np.ones(len(ids), dtype=bool) if live is None else np.asarray(live),
+        np.asarray(delta_ids, dtype=np.int64),
+        np.empty((0, np.shape(vectors)[1]), dtype=np.float32) if delta_vectors is None
+        else normalized(np.asarray(delta_vectors, dtype=np.float32)),
+        None
+    )
+
+class TopKBlockedTest(SimpleTestCase):
+    def test_matches_exact_search(self):
+        """Test that blocked top k equals a full sort of the scores, whatever the block size"""
+        rng = np.random.default_rng(0)
+        recipes = rng.standard_normal((500, 16), dtype=np.float32)
+        users = rng.standard_normal((40, 16), dtype=np.float32)
+        state = index_state(np.arange(1000, 1500), recipes)
+
+        ids, scores = top_k_blocked(users, [[]] * len(users), recipe_blocks(state, 64), 5)
+
+        exact = normalized(users) @ normalized(recipes).T
+        np.testing.assert_array_equal(ids, 1000 + np.argsort(-exact, axis=1)[:, :5])
+        np.testing.assert_allclose(scores, -np.sort(-exact, axis=1)[:, :5], rtol=1e-5)
+
+    def test_excluded_and_deleted_recipes_are_masked(self):
+        """Test that saved recipes are excluded per user and deleted recipes for everyone"""
+        recipes = np.eye(4, dtype=np.float32) + 0.1
+        state = index_state([10, 11, 12, 13], recipes, live=[True, True, False, True],
+                            delta_ids=[20], delta_vectors=[[1, 0, 0, 0.2]])
+        users = np.array([[1, 0, 0, 0], [0, 0, 1, 0.5]], dtype=np.float32)
+
+        ids, _ = top_k_blocked(users, [[10, 20], []], recipe_blocks(state, 2), 3)
+
+        self.assertNotIn(10, ids[0])
+        self.assertNotIn(20, ids[0])
+        # The second user's closest recipe (12) is deleted, so 13 comes first
+        self.assertEqual(ids[1][0], 13)
+        self.assertNotIn(12, ids.ravel())
+
+    def test_fewer_recipes_than_k(self):
+        """Test that missing results are padded with id -1"""
+        state = index_state([1, 2], np.eye(2, dtype=np.float32))
+        ids, scores = top_k_blocked(np.ones((1, 2), dtype=np.float32), [[2]], recipe_blocks(state), 3)
+        self.assertEqual(ids[0].tolist(), [1, -1, -1])
+        self.assertFalse(np.isfinite(scores[0][1:]).any())
+
+class MaterializeRecommendationsTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"user{i}", password='testpass123') for i in range(3)]
+        self.state = index_state([1, 2, 3], np.eye(3, dtype=np.float32))
+
+    def test_recommendations_are_written_for_every_user(self):
+        """Test that every profile gets its top k, without its saved recipes"""
+        UserEmbedding.objects.create(user=self.users[0], embedding=[1.0, 0.1, 0.0])
+        UserEmbedding.objects.create(user=self.users[1], embedding=[0.0, 1.0, 0.5])
+        UserEmbedding.objects.create(user=self.users[2], embedding=[])
+        SavedRecipe.objects.create(user=self.users[0], title='Saved', content='...', embedding_id=1)
+
+        with patch.object(vector_index.index, 'refresh', return_value=self.state):
+            stats = materialize_recommendations(2, user_block=2)
+
+        self.assertEqual((stats['users'], stats['skipped']), (2, 1))
+        first = UserEmbedding.objects.get(user=self.users[0]).recommendations
+        self.assertEqual([rec['recipe_id'] for rec in first], [2, 3])
+        second = UserEmbedding.objects.get(user=self.users[1]).recommendations
+        self.assertEqual([rec['recipe_id'] for rec in second], [2, 3])
+        self.assertEqual(UserEmbedding.objects.get(user=self.users[2]).recommendations, [])
+        self.assertGreater(stats['peak_memory_mb'], 0)
+
+    def test_profiles_refreshed_meanwhile_are_left_alone(self):
+        """Test that recommendations written by the per-user task during the job are kept"""
+        profile = UserEmbedding.objects.create(user=self.users[0], embedding=[1.0, 0.0, 0.0],
+                                               recommendations=[{'recipe_id': 9, 'similarity_score': 1.0}])
+
+        def refresh_during_job():
+            UserEmbedding.objects.filter(id=profile.id).update(last_updated=timezone.now() + timedelta(seconds=1))
+            return self.state
+
+        with patch.object(vector_index.index, 'refresh', side_effect=refresh_during_job):
+            stats = materialize_recommendations(2)
+
+        self.assertEqual(stats['users'], 0)
+        self.assertEqual(UserEmbedding.objects.get(id=profile.id).recommendations[0]['recipe_id'], 9)
@@ -0,0 +1,169 @@
+from django.test import TestCase, SimpleTestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from unittest.mock import patch
+from cooking.models import SavedRecipe
+from cooking import bulk_embeddings, embeddings
+from cooking.bulk_embeddings import RateLimiter, batch_by_tokens, bulk_embed_recipes
+import io
+
+def recipe(title):
+    return {
+        'title': title,
+        'cuisine': 'Italian',
+        'difficulty': 'Easy',
+        'ingredients': ['pasta', 'tomatoes'],
+        'instructions': ['Boil', 'Toss'],
+        'tips': [],
+    }
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class BatchingTest(SimpleTestCase):
+    def test_batches_respect_token_budget(self):
+        """Test that batches are cut before they go over the token budget"""
+        batches = batch_by_tokens(list('abcde'), [40, 40, 40, 10, 200], max_tokens=100, max_inputs=10)
+        self.assertEqual(batches, [(['a', 'b'], 80), (['c', 'd'], 50), (['e'], 200)])
+
+    def test_batches_respect_input_limit(self):
+        """Test that batches are cut at the input limit"""
+        batches = batch_by_tokens(list('abcde'), [1] * 5, max_tokens=100, max_inputs=2)
+        self.assertEqual([items for items, _ in batches], [['a', 'b'], ['c', 'd'], ['e']])
+
+    def test_rate_limiter_paces_tokens(self):
+        """Test that requests past the per-minute token allowance wait for the bucket to refill"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=600, clock=clock, sleep=clock.sleep)
+        limiter.acquire(600)
+        self.assertEqual(clock.sleeps, [])
+        limiter.acquire(300)
+        self.assertEqual(clock.sleeps, [30.0])
+        self.assertEqual(limiter.waited_seconds, 30.0)
+
+    def test_rate_limiter_paces_requests(self):
+        """Test that the request rate is limited independently of tokens"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=10_000, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            limiter.acquire(1)
+        self.assertEqual(clock.sleeps, [30.0])
+
+class BulkEmbedTest(SimpleTestCase):
+    def setUp(self):
+        embeddings._embedding_cache.clear()
+
+    def run_bulk(self, recipes, cached=None, **kwargs):
+        stored_batches = []
+        ids = {}
+        def store(batch):
+            stored_batches.append([item['title'] for item in batch])
+            return {item['content_hash']: ids.setdefault(item['content_hash'], len(ids) + 1) for item in batch}
+
+        with patch.object(bulk_embeddings, 'cached_embeddings', return_value=cached or {}), \
+                patch.object(bulk_embeddings, 'store_recipe_embeddings', side_effect=store), \
+                patch.object(embeddings, 'embeddings') as mock_client:
+            mock_client.model = 'text-embedding-ada-002'
+            mock_client.embed_documents.side_effect = lambda texts: [[float(len(text)), 1.0] for text in texts]
+            result = bulk_embed_recipes(recipes, **kwargs)
+        return result, mock_client, stored_batches
+
+    def test_recipes_are_embedded_in_batches(self):
+        """Test that many recipes take a few embed_documents calls and one insert per batch"""
+        recipes = [recipe(f"Pasta {i}") for i in range(10)]
+        result, mock_client, stored_batches = self.run_bulk(recipes, max_inputs=4, concurrency=2)
+
+        self.assertEqual(mock_client.embed_documents.call_count, 3)
+        mock_client.embed_query.assert_not_called()
+        # One (empty) write for reused vectors, then one per batch
+        self.assertEqual(sorted(len(batch) for batch in stored_batches), [0, 2, 4, 4])
+        self.assertEqual(result['embedded'], 10)
+        self.assertEqual(result['batches'], 3)
+        self.assertEqual(len(set(result['ids'])), 10)
+
+    def test_duplicates_and_cached_recipes_are_not_embedded(self):
+        """Test that identical recipes are embedded once and known ones not at all"""
+        known = recipe('Known Pasta')
+        known_hash = embeddings.recipe_content_hash(embeddings.recipe_text(known))
+        recipes = [recipe('Pasta'), recipe('Pasta'), known]
+        result, mock_client, _ = self.run_bulk(recipes, cached={known_hash: [0.5, 0.5]})
+
+        texts = mock_client.embed_documents.call_args.args[0]
+        self.assertEqual(len(texts), 1)
+        self.assertEqual(result['ids'][0], result['ids'][1])
+        self.assertIsNotNone(result['ids'][2])
+        self.assertEqual((result['embedded'], result['reused']), (1, 1))
+
+    def test_failed_batch_leaves_others_stored(self):
+        """Test that one failing batch does not lose the others' embeddings"""
+        calls = []
+        def flaky(texts):
+            calls.append(texts)
+            if len(calls) == 1:
+                raise RuntimeError('API down')
+            return [[1.0, 1.0] for _ in texts]
+
+        with patch.object(bulk_embeddings, 'cached_embeddings', return_value={}), \
+                patch.object(bulk_embeddings, 'store_recipe_embeddings',
+                             side_effect=lambda batch: {item['content_hash']: 7 for item in batch}), \
+                patch.object(embeddings, 'embeddings') as mock_client:
+            mock_client.model = 'text-embedding-ada-002'
+            mock_client.embed_documents.side_effect = flaky
+            result = bulk_embed_recipes([recipe(f"Pasta {i}") for i in range(4)], max_inputs=2, concurrency=1)
+
+        self.assertEqual((result['embedded'], result['failed']), (2, 2))
+        self.assertEqual(result['ids'].count(None), 2)
+
+class EmbedSavedRecipesCommandTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+
+    @patch('cooking.management.commands.embed_saved_recipes.request_user_embedding_refresh')
+    @patch('cooking.management.commands.embed_saved_recipes.bulk_embed_recipes')
+    def test_missing_embeddings_are_linked(self, mock_bulk, mock_refresh):
+        """Test that the command links every recipe without an embedding and refreshes its owner"""
+        SavedRecipe.objects.create(user=self.user, title='Done', content='...', embedding_id=1,
+                                   embedding_status=SavedRecipe.EMBEDDING_READY)
+        pending = [SavedRecipe.objects.create(user=self.user, title=f"Pasta {i}", content='...') for i in range(3)]
+        mock_bulk.side_effect = lambda recipes, **kwargs: {
+            'ids': [10, None, 12][:len(recipes)], 'embedded': 2, 'reused': 0, 'failed': 1,
+            'batches': 1, 'tokens': 30, 'seconds': 0.1,
+        }
+
+        call_command('embed_saved_recipes', stdout=io.StringIO())
+
+        self.assertEqual([recipe['title'] for recipe in mock_bulk.call_args.args[0]], ['Pasta 0', 'Pasta 1', 'Pasta 2'])
+        statuses = {recipe.title: (recipe.embedding_id, recipe.embedding_status)
+                    for recipe in SavedRecipe.objects.filter(id__in=[recipe.id for recipe in pending])}
+        self.assertEqual(statuses['Pasta 0'], (10, SavedRecipe.EMBEDDING_READY))
+        self.assertEqual(statuses['Pasta 1'], (None, SavedRecipe.EMBEDDING_PENDING))
+        self.assertEqual(statuses['Pasta 2'], (12, SavedRecipe.EMBEDDING_READY))
+        mock_refresh.assert_called_once_with(self.user.id, recompute=True)
+
+    @patch('cooking.management.commands.embed_saved_recipes.request_user_embedding_refresh')
+    @patch('cooking.management.commands.embed_saved_recipes.bulk_embed_recipes')
+    def test_recipes_linked_meanwhile_are_left_alone(self, mock_bulk, mock_refresh):
+        """Test that the command does not overwrite a link an embedding task made while it ran"""
+        recipe = SavedRecipe.objects.create(user=self.user, title='Pasta', content='...')
+        def link_meanwhile(recipes, **kwargs):
+            SavedRecipe.objects.filter(id=recipe.id).update(
+                embedding_id=20, embedding_status=SavedRecipe.EMBEDDING_READY
+            )
+            return {'ids': [10], 'embedded': 1, 'reused': 0, 'failed': 0,
+                    'batches': 1, 'tokens': 10, 'seconds': 0.1}
+        mock_bulk.side_effect = link_meanwhile
+
+        call_command('embed_saved_recipes', stdout=io.StringIO())
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.embedding_id, 20)
+        mock_refresh.assert_not_called()
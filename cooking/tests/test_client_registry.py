@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase
+from concurrent.futures import ThreadPoolExecutor
+from cooking.langchain_setup import get_chat_model, get_client_stats, RECIPE_PROMPT
+from langchain.schema import HumanMessage
+
+class ChatModelRegistryTest(SimpleTestCase):
+    def test_same_client_is_reused(self):
+        """Test that repeated lookups return the one shared client"""
+        before = get_client_stats()
+        first = get_chat_model()
+        second = get_chat_model()
+        self.assertIs(first, second)
+
+        after = get_client_stats()
+        self.assertGreaterEqual(after['clients_reused'] - before['clients_reused'], 1)
+
+    def test_clients_are_keyed_by_model_and_temperature(self):
+        """Test that different settings get their own client but share the HTTP pool"""
+        creative = get_chat_model(temperature=0.7)
+        precise = get_chat_model(temperature=0.0)
+        self.assertIsNot(creative, precise)
+        self.assertEqual(precise.temperature, 0.0)
+        self.assertIs(creative.client._client, precise.client._client)
+
+    def test_concurrent_lookups_create_one_client(self):
+        """Test that threads racing on first use all get the same client"""
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            models = list(pool.map(lambda _: get_chat_model(model="gpt-3.5-turbo", temperature=0.3), range(32)))
+        self.assertTrue(all(model is models[0] for model in models))
+
+    def test_prompt_does_not_format_message_content(self):
+        """Test that braces in recipe content are passed through untouched"""
+        prompt = RECIPE_PROMPT.invoke({"messages": [HumanMessage(content="Use {butter} here")]})
+        self.assertEqual(prompt.messages[-1].content, "Use {butter} here")
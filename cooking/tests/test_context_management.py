@@ -135,4 +135,45 @@ class ContextManagementTest(TestCase):
         self.assertIn('Test Recipe', summary)
         self.assertIn('spicier', summary)
         self.assertIn('How long to cook?', summary)
-        logger.info("Summary creation test successful") 
\ No newline at end of file
+        logger.info("Summary creation test successful") 
+
+    def test_summary_is_incremental(self):
+        """Test that later summaries fold in only new messages and keep earlier state"""
+        Message.objects.create(
+            chat=self.chat_session,
+            role='assistant',
+            content='<h2 data-recipe="title">🍳 Test Recipe</h2>',
+            message_type='recipe_creation'
+        )
+        Message.objects.create(
+            chat=self.chat_session,
+            role='user',
+            content='How long to cook?',
+            message_type='cooking_question'
+        )
+        create_conversation_summary(self.chat_session)
+
+        # The answer arrives after the first summary
+        Message.objects.create(
+            chat=self.chat_session,
+            role='assistant',
+            content='Cook for 10 minutes',
+            message_type='cooking_question'
+        )
+        for i in range(5):
+            Message.objects.create(
+                chat=self.chat_session,
+                role='assistant',
+                content=f'Modification {i}',
+                message_type='recipe_modification'
+            )
+
+        # Select, mark summarized, save, plus the savepoint around them: no per-message queries
+        with self.assertNumQueries(5):
+            summary = create_conversation_summary(self.chat_session)
+
+        self.assertIn('Test Recipe', summary)
+        self.assertIn('Q: How long to cook?\nA: Cook for 10 minutes', summary)
+        self.assertNotIn('Modification 1', summary)
+        self.assertIn('Modification 4', summary)
+        self.assertEqual(len(self.chat_session.summary_state['modifications']), 3)
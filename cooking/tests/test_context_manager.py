@@ -1,7 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from cooking.models import ChatSession, Message
-from cooking.context_manager import get_relevant_context, classify_message_type
+from cooking.context_manager import get_relevant_context, aget_relevant_context, classify_message_type
 import logging
 
 logger = logging.getLogger(__name__)
@@ -130,4 +130,10 @@ Italian
         self.assertEqual(message_type, "recipe_modification")
         
         # Test that we're not including too many messages
-        self.assertLessEqual(len([m for m in context if m['role'] != 'system']), 6) 
\ No newline at end of file
+        self.assertLessEqual(len([m for m in context if m['role'] != 'system']), 6) 
+    async def test_async_context_matches_sync(self):
+        # The async ORM path should assemble exactly the same context
+        from asgiref.sync import sync_to_async
+        expected = await sync_to_async(get_relevant_context)(self.chat_session, "Can you make it less spicy?")
+        context = await aget_relevant_context(self.chat_session, "Can you make it less spicy?")
+        self.assertEqual(context, expected)
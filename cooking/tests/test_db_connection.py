@@ -0,0 +1,97 @@
+from django.test import SimpleTestCase
+from unittest.mock import MagicMock, patch
+from cooking import db_connection
+from cooking.db_connection import ConnectionPool
+import psycopg2.pool
+import logging
+
+logger = logging.getLogger(__name__)
+
+def fake_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    return conn
+
+@patch.object(db_connection, '_connect', side_effect=lambda: fake_connection())
+class ConnectionPoolTest(SimpleTestCase):
+    def test_connections_are_reused(self, mock_connect):
+        """Test that sequential checkouts share one connection and commit each block"""
+        pool = ConnectionPool(max_size=2)
+        for _ in range(3):
+            with pool.connection() as conn:
+                pass
+
+        self.assertEqual(mock_connect.call_count, 1)
+        self.assertEqual(conn.commit.call_count, 3)
+        stats = pool.get_stats()
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_error_rolls_back_and_keeps_connection(self, mock_connect):
+        """Test that a failing block is rolled back and the connection is still pooled"""
+        pool = ConnectionPool()
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                raise ValueError("bad query")
+
+        conn.rollback.assert_called_once()
+        conn.commit.assert_not_called()
+        self.assertEqual(pool.get_stats()['idle'], 1)
+
+    def test_broken_connection_is_discarded(self, mock_connect):
+        """Test that a connection whose rollback fails is closed instead of pooled"""
+        pool = ConnectionPool()
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                conn.rollback.side_effect = psycopg2.InterfaceError("connection already closed")
+                raise ValueError("lost connection")
+
+        conn.close.assert_called_once()
+        self.assertEqual(pool.get_stats()['idle'], 0)
+
+    def test_old_connections_are_recycled(self, mock_connect):
+        """Test that connections past their max lifetime are replaced"""
+        pool = ConnectionPool(max_lifetime=0)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIsNot(first, second)
+        first.close.assert_called_once()
+        self.assertEqual(pool.get_stats()['recycled'], 1)
+
+    def test_idle_connections_are_health_checked(self, mock_connect):
+        """Test that an idle connection that fails its ping is replaced"""
+        pool = ConnectionPool(check_after=0)
+        with pool.connection() as first:
+            pass
+        first.cursor.side_effect = psycopg2.OperationalError("server closed the connection")
+        with pool.connection() as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.get_stats()['health_check_failures'], 1)
+
+    def test_pool_size_is_bounded(self, mock_connect):
+        """Test that checkouts beyond max_size wait and then fail"""
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        with pool.connection():
+            with self.assertRaises(psycopg2.pool.PoolError):
+                pool.acquire()
+        self.assertEqual(pool.get_stats()['waits'], 1)
+
+    def test_forked_child_does_not_reuse_parent_connections(self, mock_connect):
+        """Test that a process forked from a worker opens its own connections and never closes the parent's"""
+        pool = ConnectionPool()
+        with pool.connection() as parent_conn:
+            pass
+
+        with patch.object(db_connection.os, 'getpid', return_value=pool._pid + 1):
+            with pool.connection() as child_conn:
+                pass
+
+        self.assertIsNot(parent_conn, child_conn)
+        parent_conn.close.assert_not_called()
+        self.assertIn(parent_conn, pool._inherited)
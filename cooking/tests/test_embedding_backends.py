@@ -0,0 +1,119 @@
+from django.test import TestCase, SimpleTestCase
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from unittest.mock import patch
+from cooking import embeddings, embedding_backends, vector_index
+from cooking.embedding_backends import LocalEmbeddings, EMBEDDING_DIMENSIONS, get_embedding_backend
+from cooking.management.commands import reembed_recipes
+from cooking.models import EmbeddingNamespace, UserEmbedding
+from cooking.tests.helpers import mock_connection
+import numpy as np
+import io
+
+CARBONARA = "Title: Spaghetti Carbonara Cuisine: Italian Ingredients: spaghetti, eggs, pecorino, guanciale, black pepper"
+AMATRICIANA = "Title: Bucatini Amatriciana Cuisine: Italian Ingredients: bucatini, guanciale, tomatoes, pecorino, chili"
+PAD_THAI = "Title: Pad Thai Cuisine: Thai Ingredients: rice noodles, tamarind, fish sauce, peanuts, bean sprouts"
+
+class LocalEmbeddingsTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.backend = LocalEmbeddings()
+
+    def test_vectors_fit_recipe_embeddings(self):
+        """Test that local vectors are unit length and the size of the recipe_embeddings column"""
+        vector = np.array(self.backend.embed_query(CARBONARA))
+        self.assertEqual(vector.shape, (EMBEDDING_DIMENSIONS,))
+        self.assertAlmostEqual(np.linalg.norm(vector), 1.0, places=5)
+
+    def test_vectors_are_the_same_in_every_process(self):
+        """Test that a fresh backend maps a text to the same vector"""
+        np.testing.assert_array_equal(LocalEmbeddings().embed_vector(CARBONARA), self.backend.embed_vector(CARBONARA))
+
+    def test_batch_matches_single(self):
+        """Test that embed_documents returns what embed_query does for each text"""
+        documents = self.backend.embed_documents([CARBONARA, PAD_THAI, ""])
+        np.testing.assert_allclose(documents[0], self.backend.embed_query(CARBONARA), rtol=1e-6)
+        np.testing.assert_allclose(documents[1], self.backend.embed_query(PAD_THAI), rtol=1e-6)
+        self.assertFalse(np.any(documents[2]))
+
+    def test_similar_recipes_are_closer(self):
+        """Test that recipes sharing ingredients score higher than unrelated ones"""
+        carbonara, amatriciana, pad_thai = self.backend.embed_vectors([CARBONARA, AMATRICIANA, PAD_THAI])
+        self.assertGreater(carbonara @ amatriciana, carbonara @ pad_thai + 0.1)
+
+    def test_idf_weights_change_the_namespace(self):
+        """Test that fitted IDF weights address their vectors separately in the cache"""
+        backend = LocalEmbeddings()
+        before = backend.cache_namespace
+        backend.fit_idf([CARBONARA, AMATRICIANA, PAD_THAI])
+        self.assertNotEqual(backend.cache_namespace, before)
+        # 'cuisine' is in every recipe, 'tamarind' in one
+        common = backend.idf[embedding_backends._features('cuisine')[0]]
+        rare = backend.idf[embedding_backends._features('tamarind')[0]]
+        self.assertLess(common[0], rare[0])
+
+    def test_namespace_is_hashed_once(self):
+        """Test that the IDF digest is computed when the weights are set, not per content hash"""
+        backend = LocalEmbeddings(idf=np.ones(embedding_backends.N_FEATURES, dtype=np.float32))
+        namespace = backend.cache_namespace
+        with patch.object(embedding_backends.hashlib, 'sha256') as mock_sha256:
+            for _ in range(3):
+                self.assertEqual(backend.cache_namespace, namespace)
+        mock_sha256.assert_not_called()
+
+    def test_content_hash_is_namespaced(self):
+        """Test that the same recipe text has a different content hash under the local backend"""
+        openai_hash = embeddings.recipe_content_hash(CARBONARA)
+        with patch.object(embeddings, 'embeddings', self.backend):
+            local_hash = embeddings.recipe_content_hash(CARBONARA)
+        self.assertNotEqual(local_hash, openai_hash)
+
+    def test_backends_are_built_once(self):
+        """Test that a backend is built once per process and unknown names are rejected"""
+        with patch.object(embedding_backends, '_backends', {}):
+            self.assertIs(get_embedding_backend('local'), get_embedding_backend('local'))
+            with self.assertRaises(ValueError):
+                get_embedding_backend('word2vec')
+
+@patch.object(embeddings, '_checked_namespace', None)
+class EmbeddingNamespaceTest(TestCase):
+    def test_first_backend_claims_the_vectors(self):
+        """Test that the first backend to embed claims the database and another is refused"""
+        self.assertEqual(embeddings.check_embedding_namespace(), 'openai:text-embedding-ada-002')
+        self.assertEqual(EmbeddingNamespace.objects.get().namespace, 'openai:text-embedding-ada-002')
+
+        with patch.object(embeddings, 'embeddings', LocalEmbeddings()):
+            with self.assertRaises(ImproperlyConfigured):
+                embeddings.check_embedding_namespace()
+
+    @patch.object(vector_index, 'ENABLED', False)
+    def test_reembed_switches_backends(self):
+        """Test that reembed_recipes rewrites the stored vectors and then lets the new backend embed"""
+        EmbeddingNamespace.objects.create(id=1, namespace='openai:text-embedding-ada-002')
+        user = User.objects.create_user(username='cook', password='pw')
+        UserEmbedding.objects.create(user=user, embedding=[0.1] * 3, embedding_sum=[0.2] * 3, recipe_count=2)
+        row = (7, 'Carbonara', 'Italian', 'Easy', ['spaghetti', 'eggs'], ['Boil', 'Toss'], [])
+        get_connection, cursor = mock_connection(fetchall=[[row]])
+        backend = LocalEmbeddings()
+
+        with patch.object(reembed_recipes, 'get_db_connection', get_connection), \
+             patch.object(reembed_recipes, 'execute_values') as mock_execute_values, \
+             patch.object(reembed_recipes, 'count_tokens', return_value=10), \
+             patch.object(embeddings, 'embeddings', backend), \
+             patch.object(reembed_recipes.embeddings_module, 'embeddings', backend):
+            call_command('reembed_recipes', stdout=io.StringIO())
+            self.assertEqual(embeddings.check_embedding_namespace(), backend.cache_namespace)
+
+        (embedding_id, vector, content_hash), = mock_execute_values.call_args[0][2]
+        self.assertEqual(embedding_id, 7)
+        self.assertEqual(vector, backend.embed_query(embeddings.recipe_text({
+            'title': 'Carbonara', 'cuisine': 'Italian', 'difficulty': 'Easy',
+            'ingredients': ['spaghetti', 'eggs'], 'instructions': ['Boil', 'Toss'], 'tips': [],
+        })))
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertIn('TRUNCATE public.response_cache', executed)
+        self.assertEqual(EmbeddingNamespace.objects.get().namespace, backend.cache_namespace)
+        profile = UserEmbedding.objects.get(user=user)
+        self.assertEqual((profile.embedding, profile.embedding_sum, profile.recipe_count), ([], [], 0))
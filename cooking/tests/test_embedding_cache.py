@@ -0,0 +1,91 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from unittest.mock import patch
+from cooking.models import SavedRecipe
+from cooking import embeddings
+from cooking.tests.helpers import vector_bytes, mock_connection
+
+RECIPE = {
+    'title': 'Greek Salad',
+    'cuisine': 'Greek',
+    'difficulty': 'Easy',
+    'ingredients': ['2 tomatoes', '1 cucumber', '200g feta'],
+    'instructions': ['Chop', 'Combine', 'Dress'],
+    'tips': ['Use ripe tomatoes'],
+}
+
+class EmbeddingCacheTest(TestCase):
+    def setUp(self):
+        embeddings._embedding_cache.clear()
+
+    def test_identical_recipes_are_embedded_once(self):
+        """Test that a re-saved recipe reuses its embedding instead of calling the API"""
+        get_connection, cursor = mock_connection(fetchone=[None])
+        with patch.object(embeddings, 'get_db_connection', get_connection), \
+                patch.object(embeddings, 'embeddings') as mock_client:
+            mock_client.embed_query.return_value = [0.5, 0.25]
+            first = embeddings.generate_recipe_embedding(dict(RECIPE))
+            second = embeddings.generate_recipe_embedding(dict(RECIPE))
+
+        mock_client.embed_query.assert_called_once()
+        self.assertEqual(second['embedding'], first['embedding'])
+        self.assertEqual(second['content_hash'], first['content_hash'])
+        # Only the first call looked in Postgres; the second was answered locally
+        self.assertEqual(cursor.execute.call_count, 1)
+
+    def test_embedding_is_reused_from_postgres(self):
+        """Test that a recipe embedded by another process is found by its content hash"""
+        get_connection, cursor = mock_connection(fetchone=[(vector_bytes([0.5, 0.25]),)])
+        with patch.object(embeddings, 'get_db_connection', get_connection), \
+                patch.object(embeddings, 'embeddings') as mock_client:
+            recipe = embeddings.generate_recipe_embedding(dict(RECIPE))
+
+        mock_client.embed_query.assert_not_called()
+        self.assertEqual(recipe['embedding'], [0.5, 0.25])
+        self.assertEqual(cursor.execute.call_args.args[1], (recipe['content_hash'],))
+
+    def test_hash_ignores_whitespace(self):
+        """Test that the content hash does not depend on indentation or spacing"""
+        self.assertEqual(
+            embeddings.recipe_content_hash("Title: Soup\n    Cuisine: French"),
+            embeddings.recipe_content_hash("Title:  Soup Cuisine: French  ")
+        )
+        self.assertNotEqual(
+            embeddings.recipe_content_hash("Title: Soup"),
+            embeddings.recipe_content_hash("Title: Stew")
+        )
+
+    def test_store_returns_the_existing_row(self):
+        """Test that storing an already stored recipe returns its row rather than inserting a duplicate"""
+        row = (42, 'Greek Salad', 'Greek', 'Easy', [], [], [], None, None)
+        # The first attempt raced a concurrent insert and saw neither row
+        get_connection, cursor = mock_connection(fetchone=[None, row])
+        recipe = dict(RECIPE, embedding=[0.5, 0.25], content_hash='abc')
+
+        with patch.object(embeddings, 'get_db_connection', get_connection):
+            stored = embeddings.store_recipe_embedding(recipe)
+
+        self.assertEqual(stored['id'], 42)
+        self.assertEqual(cursor.execute.call_count, 2)
+        self.assertIn('ON CONFLICT (content_hash)', cursor.execute.call_args.args[0])
+
+    @patch('cooking.views.schedule_user_embedding_update')
+    def test_shared_embedding_row_is_kept_on_delete(self, mock_schedule):
+        """Test that deleting one of two recipes sharing an embedding row keeps the row"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        recipe = SavedRecipe.objects.create(user=user, title="Salad", content="...", embedding_id=7)
+        SavedRecipe.objects.create(user=other, title="Salad", content="...", embedding_id=7)
+        get_connection, cursor = mock_connection(fetchone=[(False, vector_bytes([1.0, 3.0]))])
+
+        self.client.force_login(user)
+        with patch('cooking.views.get_db_connection', get_connection):
+            response = self.client.post(reverse('delete_recipe', args=[recipe.id]))
+
+        self.assertTrue(response.json()['success'])
+        # The reference check is part of the DELETE, ignoring only the recipe being deleted
+        sql, params = cursor.execute.call_args.args
+        self.assertIn('NOT EXISTS', sql)
+        self.assertEqual(params, {'id': 7, 'saved_recipe_id': recipe.id})
+        self.assertEqual(mock_schedule.call_args.kwargs['removed'][0].tolist(), [1.0, 3.0])
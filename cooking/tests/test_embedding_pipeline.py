@@ -0,0 +1,199 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from unittest.mock import patch
+from cooking.models import ChatSession, SavedRecipe
+from cooking import tasks
+from cooking.tests.helpers import vector_bytes, mock_connection
+import httpx
+import json
+import openai
+
+CONTENT = """<h2 data-recipe="title">🍳 Tomato Soup</h2>
+<h3 data-recipe="ingredients">🥗 Ingredients</h3>
+<ul><li>4 tomatoes</li><li>1 onion</li></ul>
+<h3 data-recipe="instructions">📝 Instructions</h3>
+<ol><li>Simmer everything</li></ol>"""
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com/v1/embeddings'))
+
+class SaveRecipeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.chat = ChatSession.objects.create(user=self.user, title='Soup')
+        self.client.force_login(self.user)
+
+    def save(self):
+        return self.client.post(
+            reverse('save_recipe', args=[self.chat.id]),
+            data=json.dumps({'title': 'Tomato Soup', 'content': CONTENT}),
+            content_type='application/json'
+        )
+
+    @patch.object(tasks.embed_saved_recipe, 'delay')
+    @patch.object(tasks, 'generate_recipe_embedding')
+    def test_save_returns_before_embedding(self, mock_generate, mock_delay):
+        """Test that saving commits the recipe as pending and embeds it after commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.save()
+
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['embedding_status'], SavedRecipe.EMBEDDING_PENDING)
+        recipe = SavedRecipe.objects.get(id=data['recipe_id'])
+        self.assertIsNone(recipe.embedding_id)
+        mock_generate.assert_not_called()
+        mock_delay.assert_called_once_with(recipe.id)
+
+    @patch.object(tasks.embed_saved_recipe, 'delay')
+    def test_resave_keeps_current_embedding(self, mock_delay):
+        """Test that re-saving keeps the old embedding linked until the new one is ready"""
+        SavedRecipe.objects.create(
+            user=self.user, chat_session=self.chat, title='Soup', content='...',
+            embedding_id=3, embedding_status=SavedRecipe.EMBEDDING_READY
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.save()
+
+        recipe = SavedRecipe.objects.get(chat_session=self.chat)
+        self.assertEqual(recipe.embedding_id, 3)
+        self.assertEqual(recipe.embedding_status, SavedRecipe.EMBEDDING_PENDING)
+        mock_delay.assert_called_once_with(recipe.id)
+
+    @patch.object(tasks.refresh_user_embedding, 'apply_async')
+    def test_recommendations_wait_for_pending_recipes(self, mock_apply_async):
+        """Test that the recommendations page leaves the refresh to pending embedding tasks"""
+        cache.clear()
+        SavedRecipe.objects.create(user=self.user, chat_session=self.chat, title='Soup', content='...')
+        response = self.client.get(reverse('recommendations'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        mock_apply_async.assert_not_called()
+
+@patch.object(tasks, 'schedule_user_embedding_update')
+@patch.object(tasks, 'store_recipe_embedding', side_effect=lambda recipe: {'id': 42})
+class EmbedSavedRecipeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.recipe = SavedRecipe.objects.create(user=self.user, title='Tomato Soup', content=CONTENT)
+        get_connection, self.cursor = mock_connection()
+        self.cursor.fetchone.return_value = (1,)  # The stored row is still there
+        patcher = patch.object(tasks, 'get_db_connection', get_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def embedded(self, recipe):
+        return dict(recipe, embedding=[1.0, 0.0])
+
+    def assert_unlinked_row_deleted(self):
+        """Assert the row stored for the recipe was deleted, with the shared-row reference check"""
+        sql, params = self.cursor.execute.call_args.args
+        self.assertIn('DELETE FROM public.recipe_embeddings', sql)
+        self.assertIn('NOT EXISTS', sql)
+        self.assertEqual(params, {'id': 42, 'saved_recipe_id': None})
+
+    def test_links_embedding_and_updates_profile(self, mock_store, mock_update):
+        """Test that the task links the embedding and adds it to the user's profile"""
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=self.embedded) as mock_generate:
+            self.assertEqual(tasks.embed_saved_recipe(self.recipe.id), 42)
+
+        self.assertEqual(mock_generate.call_args.args[0]['ingredients'], ['4 tomatoes', '1 onion'])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.embedding_id, 42)
+        self.assertEqual(self.recipe.embedding_status, SavedRecipe.EMBEDDING_READY)
+        mock_update.assert_called_once_with(self.user.id, added=[[1.0, 0.0]], removed=[])
+
+    def test_unchanged_embedding_leaves_profile_alone(self, mock_store, mock_update):
+        """Test that re-embedding to the same row does not touch the profile"""
+        SavedRecipe.objects.filter(id=self.recipe.id).update(embedding_id=42)
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=self.embedded):
+            tasks.embed_saved_recipe(self.recipe.id)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.embedding_status, SavedRecipe.EMBEDDING_READY)
+        mock_update.assert_not_called()
+
+    def test_embedding_deleted_before_linking_is_stored_again(self, mock_store, mock_update):
+        """Test that a row deleted between storing and linking is stored again instead of linked dangling"""
+        mock_store.side_effect = [{'id': 42}, {'id': 43}]
+        self.cursor.fetchone.return_value = None
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=self.embedded):
+            self.assertEqual(tasks.embed_saved_recipe(self.recipe.id), 43)
+
+        self.assertEqual(mock_store.call_count, 2)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.embedding_id, 43)
+
+    def test_transient_errors_are_retried(self, mock_store, mock_update):
+        """Test that a connection error is retried and the recipe still embedded"""
+        errors = [connection_error()]
+        def flaky(recipe):
+            if errors:
+                raise errors.pop()
+            return self.embedded(recipe)
+
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=flaky) as mock_generate:
+            tasks.embed_saved_recipe.apply(args=(self.recipe.id,))
+
+        self.assertEqual(mock_generate.call_count, 2)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.embedding_status, SavedRecipe.EMBEDDING_READY)
+
+    def test_exhausted_retries_mark_failed(self, mock_store, mock_update):
+        """Test that a recipe is marked failed once its retries run out"""
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=connection_error()) as mock_generate:
+            result = tasks.embed_saved_recipe.apply(args=(self.recipe.id,))
+
+        self.assertTrue(result.failed())
+        self.assertEqual(mock_generate.call_count, tasks.EMBEDDING_MAX_RETRIES + 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.embedding_status, SavedRecipe.EMBEDDING_FAILED)
+        mock_update.assert_not_called()
+
+    def test_other_errors_fail_without_retry(self, mock_store, mock_update):
+        """Test that an unexpected error marks the recipe failed straight away"""
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=ValueError('bad recipe')) as mock_generate:
+            result = tasks.embed_saved_recipe.apply(args=(self.recipe.id,))
+
+        self.assertTrue(result.failed())
+        mock_generate.assert_called_once()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.embedding_status, SavedRecipe.EMBEDDING_FAILED)
+
+    def test_edited_recipe_is_left_to_the_next_task(self, mock_store, mock_update):
+        """Test that an embedding of a since-edited recipe is not linked"""
+        def edit_while_embedding(recipe):
+            SavedRecipe.objects.filter(id=self.recipe.id).update(title='Roast Tomato Soup')
+            return self.embedded(recipe)
+
+        self.cursor.fetchone.return_value = (True, vector_bytes([1.0, 0.0]))
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=edit_while_embedding):
+            self.assertIsNone(tasks.embed_saved_recipe(self.recipe.id))
+
+        self.recipe.refresh_from_db()
+        self.assertIsNone(self.recipe.embedding_id)
+        self.assertEqual(self.recipe.embedding_status, SavedRecipe.EMBEDDING_PENDING)
+        mock_update.assert_not_called()
+        self.assert_unlinked_row_deleted()
+
+    def test_recipe_deleted_while_embedding_leaves_no_row(self, mock_store, mock_update):
+        """Test that the row stored for a recipe deleted mid-embedding is deleted again"""
+        def delete_while_embedding(recipe):
+            SavedRecipe.objects.filter(id=self.recipe.id).delete()
+            return self.embedded(recipe)
+
+        self.cursor.fetchone.return_value = (True, vector_bytes([1.0, 0.0]))
+        with patch.object(tasks, 'generate_recipe_embedding', side_effect=delete_while_embedding):
+            self.assertIsNone(tasks.embed_saved_recipe(self.recipe.id))
+
+        mock_update.assert_not_called()
+        self.assert_unlinked_row_deleted()
+
+    def test_deleted_recipe_is_skipped(self, mock_store, mock_update):
+        """Test that a recipe deleted before its task runs is not embedded"""
+        recipe_id = self.recipe.id
+        self.recipe.delete()
+        with patch.object(tasks, 'generate_recipe_embedding') as mock_generate:
+            self.assertIsNone(tasks.embed_saved_recipe(recipe_id))
+        mock_generate.assert_not_called()
@@ -0,0 +1,84 @@
+from django.test import SimpleTestCase
+from unittest.mock import patch
+from cooking import intent_classifier
+from cooking.context_manager import classify_message_type, classify_by_keywords
+import os
+import tempfile
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRAINING_MESSAGES = [
+    ("Give me a recipe for lasagna", 'recipe_creation'),
+    ("How do I make sourdough bread?", 'recipe_creation'),
+    ("Can you write a recipe for pad thai", 'recipe_creation'),
+    ("I want to make ramen tonight", 'recipe_creation'),
+    ("Make it spicier please", 'recipe_modification'),
+    ("Can we use tofu instead of chicken?", 'recipe_modification'),
+    ("Swap the butter for olive oil", 'recipe_modification'),
+    ("Make it vegan", 'recipe_modification'),
+    ("What temperature should the oven be?", 'cooking_question'),
+    ("How long do I boil the eggs?", 'cooking_question'),
+    ("How can I tell when the steak is done?", 'cooking_question'),
+    ("When should I add the salt?", 'cooking_question'),
+    ("Thanks, that looks great", 'general_question'),
+    ("Hello there", 'general_question'),
+    ("Who invented pizza?", 'general_question'),
+    ("You are very helpful", 'general_question'),
+]
+
+class IntentClassifierTest(SimpleTestCase):
+    def setUp(self):
+        texts, labels = zip(*TRAINING_MESSAGES)
+        self.model = intent_classifier.train(list(texts) * 5, list(labels) * 5)
+        classify_message_type.cache_clear()
+        self.addCleanup(classify_message_type.cache_clear)
+
+    def test_fits_training_messages(self):
+        """Test that the model learns the labelled messages"""
+        texts, labels = zip(*TRAINING_MESSAGES)
+        predictions = [label for label, _ in self.model.predict(list(texts))]
+        self.assertEqual(predictions, list(labels))
+
+    def test_batch_matches_single_predictions(self):
+        """Test that batch prediction scores each message as it would alone"""
+        texts = [text for text, _ in TRAINING_MESSAGES] + ["", "!!!"]
+        batch = self.model.predict_proba(texts)
+        for row, text in enumerate(texts):
+            self.assertTrue((abs(batch[row] - self.model.predict_proba([text])[0]) < 1e-6).all())
+
+    def test_single_message_latency(self):
+        """Test that one message is classified in well under a millisecond"""
+        start_time = time.perf_counter()
+        for _ in range(200):
+            self.model.predict(["Can I use honey instead of sugar?"])
+        latency = (time.perf_counter() - start_time) / 200
+        logger.info(f"Single-message intent prediction: {latency * 1000:.3f}ms")
+        self.assertLess(latency, 0.001)
+
+    def test_save_and_load(self):
+        """Test that a saved model predicts the same after loading"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'intent_model.npz')
+            self.model.save(path)
+            loaded = intent_classifier.IntentModel.load(path)
+        texts = [text for text, _ in TRAINING_MESSAGES]
+        self.assertEqual(loaded.predict(texts), self.model.predict(texts))
+
+    def test_confident_model_overrides_keywords(self):
+        """Test that the model's answer is used when confident and the keyword rules otherwise"""
+        message = "Add more detail to the history of pizza"
+        self.assertEqual(classify_by_keywords(message), 'recipe_modification')
+
+        with patch.object(intent_classifier, 'get_model', return_value=self.model):
+            with patch.object(intent_classifier, 'MIN_CONFIDENCE', 0.0):
+                self.assertEqual(classify_message_type(message), self.model.predict([message])[0][0])
+            classify_message_type.cache_clear()
+            with patch.object(intent_classifier, 'MIN_CONFIDENCE', 1.01):
+                self.assertEqual(classify_message_type(message), 'recipe_modification')
+
+    def test_keyword_rules_without_model(self):
+        """Test that classification falls back to the keyword rules when no model is trained"""
+        with patch.object(intent_classifier, 'get_model', return_value=None):
+            self.assertEqual(classify_message_type("Recipe for soup"), 'recipe_creation')
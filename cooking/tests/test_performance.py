@@ -1,7 +1,11 @@
-from django.test import TestCase, Client
+from django.test import TestCase, SimpleTestCase, Client
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from cooking.models import ChatSession, Message
-from cooking.context_manager import get_relevant_context
+from cooking.context_manager import get_relevant_context, classify_message_type, MESSAGE_TYPE_PHRASES
+import re
 import time
 import json
 from django.urls import reverse
@@ -217,4 +221,81 @@ class PerformanceTest(TestCase):
         # Verify we maintain recipe context while reducing message count
         recipe_in_context = any('Pasta Carbonara' in msg['content'] for msg in context)
         self.assertTrue(recipe_in_context, "Recipe should be maintained in context")
-        self.assertLess(len(context), len(messages) + 1)  # +1 for system prompt 
\ No newline at end of file
+        self.assertLess(len(context), len(messages) + 1)  # +1 for system prompt
+
+    def test_long_chat_context_benchmark(self):
+        """Benchmark context assembly on a 500-message chat: one query, flat latency"""
+        self.create_conversation_history(500)
+
+        runs = 20
+        with CaptureQueriesContext(connection) as queries:
+            start_time = time.time()
+            for _ in range(runs):
+                context = get_relevant_context(self.chat_session, "Can I use bacon instead?")
+            average_time = (time.time() - start_time) / runs
+
+        logger.info("\nContext assembly with 500 messages:")
+        logger.info(f"Queries per call: {len(queries) / runs:.0f}")
+        logger.info(f"Average time per call: {average_time * 1000:.2f}ms")
+
+        self.assertEqual(len(queries), runs)
+        self.assertIn('Pasta Carbonara', context[0]['content'])
+
+def classify_by_any_scans(content):
+    """The previous classifier: an any() over the phrases of each type"""
+    content_lower = content.lower()
+    for message_type, phrases in MESSAGE_TYPE_PHRASES:
+        if any(phrase in content_lower for phrase in phrases):
+            return message_type
+    return "general_question"
+
+COMPILED_PHRASES = [
+    (message_type, re.compile("|".join(re.escape(phrase) for phrase in phrases)))
+    for message_type, phrases in MESSAGE_TYPE_PHRASES
+]
+
+def classify_by_compiled_patterns(content):
+    """One compiled alternation per type, for comparison"""
+    content_lower = content.lower()
+    for message_type, pattern in COMPILED_PHRASES:
+        if pattern.search(content_lower):
+            return message_type
+    return "general_question"
+
+class ClassifierBenchmarkTest(SimpleTestCase):
+    def setUp(self):
+        # Only user messages are classified
+        with open(settings.BASE_DIR / 'data_dump.json') as f:
+            self.corpus = [
+                row['fields']['content'] for row in json.load(f)
+                if row['model'] == 'cooking.message' and row['fields']['role'] == 'user'
+            ]
+        # Keep per-message logging out of the timings
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def time_classifier(self, classify, rounds=50):
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            for content in self.corpus:
+                classify(content)
+        return (time.perf_counter() - start_time) / (rounds * len(self.corpus))
+
+    def test_classifier_benchmark(self):
+        """Benchmark the classifier against the previous one and a compiled-pattern version"""
+        uncached = classify_message_type.__wrapped__
+        for content in self.corpus:
+            self.assertEqual(uncached(content), classify_by_any_scans(content))
+            self.assertEqual(uncached(content), classify_by_compiled_patterns(content))
+
+        old_time = self.time_classifier(classify_by_any_scans)
+        compiled_time = self.time_classifier(classify_by_compiled_patterns)
+        new_time = self.time_classifier(uncached)
+        classify_message_type.cache_clear()
+        memo_time = self.time_classifier(classify_message_type)
+
+        logger.info(f"\nClassifier over {len(self.corpus)} user messages:")
+        logger.info(f"Previous (any() scans): {old_time * 1e6:.2f}us per message")
+        logger.info(f"Compiled patterns: {compiled_time * 1e6:.2f}us per message")
+        logger.info(f"Substring loop: {new_time * 1e6:.2f}us per message")
+        logger.info(f"Substring loop, memoized: {memo_time * 1e6:.2f}us per message")
@@ -0,0 +1,86 @@
+from django.test import SimpleTestCase
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from langchain.schema import HumanMessage, SystemMessage
+from cooking import prompt_memo
+import threading
+import asyncio
+import uuid
+
+class PromptMemoTest(SimpleTestCase):
+    def setUp(self):
+        prompt_memo._local.clear()
+
+    def messages(self, text):
+        return [SystemMessage(content="You are ChefGPT"), HumanMessage(content=text)]
+
+    def test_prompt_key_covers_the_whole_prompt(self):
+        """Test that any change to the assembled prompt changes the key"""
+        key = prompt_memo.prompt_key("gpt-3.5-turbo", 0.7, self.messages("Recipe for carbonara"))
+        self.assertEqual(key, prompt_memo.prompt_key("gpt-3.5-turbo", 0.7, self.messages("Recipe for carbonara")))
+        self.assertNotEqual(key, prompt_memo.prompt_key("gpt-3.5-turbo", 0.7, self.messages("Recipe for lasagna")))
+        self.assertNotEqual(key, prompt_memo.prompt_key("gpt-3.5-turbo", 0.0, self.messages("Recipe for carbonara")))
+
+    def test_repeat_prompt_is_served_from_memo(self):
+        """Test that a retry does not call the model again"""
+        key = uuid.uuid4().hex
+        calls = []
+        compute = lambda: calls.append(1) or "Carbonara recipe"
+        self.assertEqual(prompt_memo.memoize(key, compute), "Carbonara recipe")
+        self.assertEqual(prompt_memo.memoize(key, compute), "Carbonara recipe")
+        self.assertEqual(len(calls), 1)
+
+    def test_local_memo_is_size_bounded(self):
+        """Test that the local layer evicts the least recently used entries"""
+        with patch.object(prompt_memo, 'MAX_ENTRIES', 3):
+            for i in range(5):
+                prompt_memo._store_local(f"key-{i}", f"response-{i}")
+            self.assertEqual(list(prompt_memo._local), ["key-2", "key-3", "key-4"])
+
+    def test_concurrent_identical_prompts_are_coalesced(self):
+        """Test that a double click issues a single upstream call"""
+        key = uuid.uuid4().hex
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(timeout=5)
+            return "Carbonara recipe"
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(prompt_memo.memoize, key, compute) for _ in range(4)]
+            while prompt_memo.get_memo_stats()['in_flight'] == 0:
+                pass
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(results, ["Carbonara recipe"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_failures_are_not_memoized(self):
+        """Test that an upstream error reaches the caller and the next retry calls again"""
+        key = uuid.uuid4().hex
+
+        def failing():
+            raise RuntimeError("rate limited")
+
+        with self.assertRaises(RuntimeError):
+            prompt_memo.memoize(key, failing)
+        self.assertEqual(prompt_memo.memoize(key, lambda: "Carbonara recipe"), "Carbonara recipe")
+
+    def test_async_callers_are_coalesced(self):
+        """Test that concurrent async requests share one upstream call"""
+        key = uuid.uuid4().hex
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "Carbonara recipe"
+
+        async def run():
+            return await asyncio.gather(*[prompt_memo.amemoize(key, compute) for _ in range(3)])
+
+        self.assertEqual(asyncio.run(run()), ["Carbonara recipe"] * 3)
+        self.assertEqual(len(calls), 1)
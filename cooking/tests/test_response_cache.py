@@ -0,0 +1,60 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from unittest.mock import patch
+from cooking.models import ChatSession, Message
+from cooking import response_cache
+from cooking.response_cache import get_cached_response, cache_response, get_cache_stats
+from cooking.tests.helpers import mock_connection
+
+RECIPE = '<h2 data-recipe="title">🍳 Spaghetti Carbonara</h2>'
+
+@patch.object(response_cache, '_embed_prompt', return_value=[0.1] * 1536)
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.chat_session = ChatSession.objects.create(user=self.user)
+
+    def test_non_creation_messages_are_skipped(self, mock_embed):
+        """Test that follow-up questions never touch the cache"""
+        response, key = get_cached_response(self.chat_session, "How long should I cook it?")
+        self.assertIsNone(response)
+        self.assertIsNone(key)
+        mock_embed.assert_not_called()
+
+    def test_chats_with_a_recipe_are_skipped(self, mock_embed):
+        """Test that a recipe request in a chat that already has a recipe is not cached"""
+        Message.objects.create(chat=self.chat_session, role='assistant', content=RECIPE)
+        response, key = get_cached_response(self.chat_session, "Give me a recipe for carbonara")
+        self.assertIsNone(key)
+        mock_embed.assert_not_called()
+
+    def test_similar_prompt_is_a_hit(self, mock_embed):
+        """Test that a match above the threshold returns the cached recipe"""
+        get_connection, cursor = mock_connection(fetchone=[(7, RECIPE, 0.98)])
+        before = get_cache_stats()['hits']
+        with patch.object(response_cache, 'get_db_connection', get_connection):
+            response, key = get_cached_response(self.chat_session, "How to make carbonara")
+        self.assertEqual(response, RECIPE)
+        self.assertEqual(get_cache_stats()['hits'], before + 1)
+
+    def test_dissimilar_prompt_is_a_miss(self, mock_embed):
+        """Test that a match below the threshold is a miss that still returns the embedding"""
+        get_connection, cursor = mock_connection(fetchone=[(7, RECIPE, 0.80)])
+        with patch.object(response_cache, 'get_db_connection', get_connection):
+            response, key = get_cached_response(self.chat_session, "Recipe for lasagna")
+        self.assertIsNone(response)
+        self.assertEqual(key, [0.1] * 1536)
+
+    def test_only_recipes_are_stored(self, mock_embed):
+        """Test that non-recipe replies are not written to the cache"""
+        get_connection, cursor = mock_connection()
+        with patch.object(response_cache, 'get_db_connection', get_connection):
+            cache_response([0.1] * 1536, "Recipe for carbonara", "Sorry, I can't help with that.")
+        get_connection.assert_not_called()
+
+    def test_lookup_failure_is_a_miss(self, mock_embed):
+        """Test that a database error degrades to a miss instead of failing the chat"""
+        with patch.object(response_cache, 'get_db_connection', side_effect=Exception('connection refused')):
+            response, key = get_cached_response(self.chat_session, "Recipe for carbonara")
+        self.assertIsNone(response)
+        self.assertIsNone(key)
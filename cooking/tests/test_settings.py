@@ -18,4 +18,11 @@ DATABASES = {
 # Disable password hashers for faster tests
 PASSWORD_HASHERS = [
     'django.contrib.auth.hashers.MD5PasswordHasher',
-] 
\ No newline at end of file
+] 
+
+# Keep caching in-process so tests do not need Redis
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from unittest.mock import patch
+from cooking.models import ChatSession, Message
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StreamMessageTest(TestCase):
+    def setUp(self):
+        # Create test user
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.async_client.force_login(self.user)
+
+        # Create a chat session
+        self.chat_session = ChatSession.objects.create(user=self.user)
+
+    async def read_events(self, response):
+        """Parse a server-sent event response into (event, data) pairs"""
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for raw_event in body.strip().split('\n\n'):
+            event_type = 'message'
+            data = ''
+            for line in raw_event.split('\n'):
+                if line.startswith('event: '):
+                    event_type = line[len('event: '):]
+                elif line.startswith('data: '):
+                    data += line[len('data: '):]
+            events.append((event_type, json.loads(data)))
+        return events
+
+    @patch('cooking.views.astream_recipe_response')
+    async def test_tokens_are_streamed_and_message_persisted(self, mock_stream):
+        """Test that tokens are forwarded as they arrive and the reply is saved at the end"""
+        async def fake_stream(chat_session, user_message):
+            for token in ['<h2 data-recipe="title">', '🍳 Carbonara', '</h2>']:
+                yield token
+        mock_stream.side_effect = fake_stream
+
+        response = await self.async_client.post(
+            reverse('stream_message', args=[self.chat_session.id]),
+            {'message': 'Give me a recipe for pasta carbonara'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = await self.read_events(response)
+        tokens = [data['token'] for event_type, data in events if event_type == 'message']
+        self.assertEqual(tokens, ['<h2 data-recipe="title">', '🍳 Carbonara', '</h2>'])
+
+        event_type, data = events[-1]
+        self.assertEqual(event_type, 'done')
+        self.assertEqual(data['message'], '<h2 data-recipe="title">🍳 Carbonara</h2>')
+        self.assertIsNotNone(data['time_to_first_token'])
+
+        assistant_message = await Message.objects.aget(chat=self.chat_session, role='assistant')
+        self.assertEqual(assistant_message.content, data['message'])
+        self.assertEqual(assistant_message.message_type, 'system')
+
+    @patch('cooking.views.astream_recipe_response')
+    async def test_stream_error_is_reported(self, mock_stream):
+        """Test that an upstream failure ends the stream with an error event"""
+        mock_stream.side_effect = Exception('upstream timeout')
+
+        response = await self.async_client.post(
+            reverse('stream_message', args=[self.chat_session.id]),
+            {'message': 'How long should I cook it?'}
+        )
+
+        events = await self.read_events(response)
+        self.assertEqual(events[-1][0], 'error')
+        self.assertFalse(await Message.objects.filter(chat=self.chat_session, role='assistant').aexists())
+
+    @patch('cooking.views.aget_recipe_response')
+    async def test_send_message_awaits_response(self, mock_response):
+        """Test that the async send_message view saves both sides of the exchange"""
+        mock_response.return_value = 'Cook it for 10 minutes.'
+
+        response = await self.async_client.post(
+            reverse('send_message', args=[self.chat_session.id]),
+            {'message': 'How long should I cook it?'}
+        )
+        data = json.loads(response.content)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['message'], 'Cook it for 10 minutes.')
+        self.assertEqual(await Message.objects.filter(chat=self.chat_session).acount(), 2)
+
+    async def test_send_message_requires_login(self):
+        """Test that anonymous users are redirected to the login page"""
+        await self.async_client.alogout()
+        response = await self.async_client.post(
+            reverse('send_message', args=[self.chat_session.id]),
+            {'message': 'Hello'}
+        )
+        self.assertEqual(response.status_code, 302)
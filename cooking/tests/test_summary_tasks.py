@@ -0,0 +1,67 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from unittest.mock import patch
+from cooking.models import ChatSession, Message
+from cooking.tasks import schedule_conversation_summary, summarize_conversation
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SummaryTaskTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.chat_session = ChatSession.objects.create(user=self.user)
+
+    @patch('cooking.tasks.summarize_conversation.delay')
+    def test_duplicate_summaries_are_not_queued(self, mock_delay):
+        """Test that only one summary per chat is queued until it has run"""
+        self.assertTrue(schedule_conversation_summary(self.chat_session.id))
+        self.assertFalse(schedule_conversation_summary(self.chat_session.id))
+        mock_delay.assert_called_once_with(self.chat_session.id)
+
+        # Running the task releases the lock
+        summarize_conversation(self.chat_session.id)
+        self.assertTrue(schedule_conversation_summary(self.chat_session.id))
+
+    @patch('cooking.tasks.summarize_conversation.delay', side_effect=ConnectionError("broker down"))
+    def test_lock_is_released_when_queueing_fails(self, mock_delay):
+        """Test that a failed enqueue does not block later summaries"""
+        self.assertFalse(schedule_conversation_summary(self.chat_session.id))
+        self.assertTrue(cache.add(f"summarize_conversation:{self.chat_session.id}", 'queued'))
+
+    def test_task_updates_summary(self):
+        """Test that the task folds new messages into the chat's summary"""
+        Message.objects.create(
+            chat=self.chat_session,
+            role='assistant',
+            content='<h2 data-recipe="title">🍳 Test Recipe</h2>',
+            message_type='recipe_creation'
+        )
+        summarize_conversation(self.chat_session.id)
+
+        self.chat_session.refresh_from_db()
+        self.assertIn('Test Recipe', self.chat_session.recipe_summary)
+
+    @patch('cooking.views.aget_recipe_response', return_value='Cook for 10 minutes')
+    @patch('cooking.views.schedule_conversation_summary')
+    @patch('cooking.context_manager.create_conversation_summary')
+    async def test_reply_does_not_wait_for_summary(self, mock_summary, mock_schedule, mock_response):
+        """Test that send_message queues the summary instead of building it inline"""
+        self.chat_session.last_summary_at = -20
+        await self.chat_session.asave()
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.post(
+            reverse('send_message', args=[self.chat_session.id]),
+            {'message': 'How long to cook?'}
+        )
+
+        self.assertTrue(response.json()['success'])
+        mock_schedule.assert_called_once_with(self.chat_session.id)
+        mock_summary.assert_not_called()
@@ -0,0 +1,89 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from unittest.mock import patch
+from cooking.models import ChatSession, Message
+from cooking.context_manager import get_relevant_context
+from cooking import token_budget
+from cooking.token_budget import count_tokens, count_message_tokens, history_budget
+import logging
+
+logger = logging.getLogger(__name__)
+
+RECIPE_HTML = '''<h2 data-recipe="title">🍳 Spaghetti Carbonara</h2>
+<h3 data-recipe="ingredients">📝 Ingredients</h3>
+<ul>
+<li>400g spaghetti</li>
+<li>200g guanciale, diced</li>
+<li>4 large eggs</li>
+</ul>'''
+
+class TokenBudgetTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.chat_session = ChatSession.objects.create(user=self.user, title="Token Budget Test")
+
+    def test_html_is_not_undercounted(self):
+        """Test that HTML-heavy recipes count well above their whitespace word count"""
+        self.assertGreater(count_tokens(RECIPE_HTML), len(RECIPE_HTML.split()) * 2)
+
+    def test_counts_are_memoized(self):
+        """Test that repeated counts of the same text are cached"""
+        text = RECIPE_HTML + " memo check"
+        count_tokens(text)
+        if token_budget.get_encoding() is not None:
+            hits = token_budget._encoded_length.cache_info().hits
+            count_tokens(text)
+            self.assertEqual(token_budget._encoded_length.cache_info().hits, hits + 1)
+
+    def test_message_overhead_is_included(self):
+        """Test that each chat message pays its formatting tokens"""
+        self.assertEqual(count_message_tokens("Hello"), count_tokens("Hello") + token_budget.TOKENS_PER_MESSAGE)
+
+    def test_budget_depends_on_model_window(self):
+        """Test that small-window models get less history and the budget never goes negative"""
+        with patch.object(token_budget, 'MAX_HISTORY_TOKENS', 100000):
+            self.assertLess(history_budget('gpt-4'), history_budget('gpt-4o'))
+            self.assertEqual(history_budget('gpt-4', reserved_tokens=10000), 0)
+
+    def test_context_fills_exact_budget(self):
+        """Test that selected history never exceeds the token budget"""
+        for i in range(6):
+            Message.objects.create(chat=self.chat_session, role='assistant', content=RECIPE_HTML * 3)
+
+        with patch.object(token_budget, 'MAX_HISTORY_TOKENS', count_message_tokens(RECIPE_HTML * 3) * 2 + 1):
+            context = get_relevant_context(self.chat_session, "What wine goes with this?")
+
+        history = [msg for msg in context if msg['role'] != 'system']
+        self.assertEqual(len(history), 2)
+
+    def test_token_count_is_stored_on_save(self):
+        """Test that messages count their tokens once, at write time"""
+        message = Message.objects.create(chat=self.chat_session, role='assistant', content=RECIPE_HTML)
+        if token_budget.get_encoding() is None:
+            self.assertIsNone(message.token_count)
+        else:
+            self.assertEqual(message.token_count, count_tokens(RECIPE_HTML))
+
+    def test_history_is_selected_in_one_query(self):
+        """Test that the context window is assembled without per-message queries"""
+        Message.objects.create(chat=self.chat_session, role='assistant', content=RECIPE_HTML)
+        for i in range(20):
+            Message.objects.create(chat=self.chat_session, role='user', content=f"Question {i}")
+
+        # The latest recipe and the history window come back together
+        with self.assertNumQueries(1):
+            context = get_relevant_context(self.chat_session, "What wine goes with this?")
+        self.assertEqual(context[-1]['content'], "Question 19")
+        self.assertIn(RECIPE_HTML, context[0]['content'])
+
+    def test_recipe_flag_is_set_on_save(self):
+        """Test that only assistant messages containing a recipe are flagged as recipes"""
+        recipe = Message.objects.create(chat=self.chat_session, role='assistant', content=RECIPE_HTML)
+        question = Message.objects.create(chat=self.chat_session, role='user', content=RECIPE_HTML)
+        answer = Message.objects.create(chat=self.chat_session, role='assistant', content="Use less salt.")
+        self.assertTrue(recipe.is_recipe)
+        self.assertFalse(question.is_recipe)
+        self.assertFalse(answer.is_recipe)
@@ -0,0 +1,206 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
+from cooking.models import SavedRecipe, UserEmbedding
+from cooking.embeddings import decode_vector
+from cooking import tasks, vector_index
+from cooking.tests.helpers import vector_bytes, mock_connection
+import numpy as np
+
+DIMENSIONS = 8
+
+@patch.object(vector_index, 'ENABLED', False)
+class UserEmbeddingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+
+    def save_recipes(self, count):
+        SavedRecipe.objects.bulk_create([
+            SavedRecipe(user=self.user, title=f"Recipe {i}", content="...", embedding_id=i + 1)
+            for i in range(count)
+        ])
+
+    def test_decode_vector(self):
+        """Test that binary and text vectors decode to the same float32 array"""
+        values = [0.5, -1.25, 3.0]
+        np.testing.assert_array_equal(decode_vector(vector_bytes(values)), np.array(values, dtype=np.float32))
+        np.testing.assert_array_equal(decode_vector('[0.5,-1.25,3]'), np.array(values, dtype=np.float32))
+
+    def test_embeddings_are_fetched_in_one_query(self):
+        """Test that 100 saved recipes are fetched in one round trip and averaged"""
+        self.save_recipes(100)
+        vectors = np.random.default_rng(0).random((100, DIMENSIONS), dtype=np.float32)
+        rows = [(i + 1, vector_bytes(vector)) for i, vector in enumerate(vectors)]
+        get_connection, cursor = mock_connection(fetchall=[rows, [(500, 0.9, "Recommended")]])
+
+        with patch.object(tasks, 'get_db_connection', get_connection):
+            tasks.update_user_embedding(self.user.id)
+
+        fetches = [call for call in cursor.execute.call_args_list if 'vector_send' in call.args[0]]
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(sorted(fetches[0].args[1][0]), list(range(1, 101)))
+        # The embeddings, the index search parameters and the recommendations
+        self.assertEqual(cursor.execute.call_count, 3)
+
+        user_embedding = UserEmbedding.objects.get(user=self.user)
+        np.testing.assert_allclose(user_embedding.embedding, vectors.mean(axis=0), rtol=1e-6)
+        self.assertEqual(user_embedding.recommendations, [{'recipe_id': 500, 'similarity_score': 0.9}])
+
+    def test_recommendations_use_the_vector_index(self):
+        """Test that recommendations order by the distance operator and widen ef_search for exclusions"""
+        self.save_recipes(150)
+        rows = [(i + 1, vector_bytes(np.ones(DIMENSIONS))) for i in range(150)]
+        get_connection, cursor = mock_connection(fetchall=[rows])
+
+        with patch.object(tasks, 'get_db_connection', get_connection):
+            tasks.update_user_embedding(self.user.id)
+
+        settings_call, search_call = cursor.execute.call_args_list[1:]
+        self.assertEqual(settings_call.args[1][0], str(150 + tasks.RECOMMENDATION_COUNT))
+        self.assertIn('ORDER BY re.embedding <=> %(embedding)s::vector', search_call.args[0])
+        self.assertNotIn('ORDER BY similarity', search_call.args[0])
+
+    def test_no_embeddings(self):
+        """Test that users without embedded recipes get no profile"""
+        self.save_recipes(2)
+        get_connection, cursor = mock_connection(fetchall=[[]])
+
+        with patch.object(tasks, 'get_db_connection', get_connection):
+            self.assertIsNone(tasks.update_user_embedding(self.user.id))
+        self.assertFalse(UserEmbedding.objects.filter(user=self.user).exists())
+
+    def test_delta_updates_sum_and_mean(self):
+        """Test that saving and deleting recipes adjusts the stored sum, count and mean"""
+        UserEmbedding.objects.create(
+            user=self.user, embedding=[1.0, 1.0], embedding_sum=[2.0, 2.0], recipe_count=2
+        )
+
+        self.assertTrue(tasks.apply_recipe_delta(self.user.id, added=[[4.0, 1.0]]))
+        profile = UserEmbedding.objects.get(user=self.user)
+        self.assertEqual(profile.embedding_sum, [6.0, 3.0])
+        self.assertEqual(profile.embedding, [2.0, 1.0])
+
+        self.assertTrue(tasks.apply_recipe_delta(self.user.id, removed=[[4.0, 1.0], [1.0, 1.0], [1.0, 1.0]]))
+        profile.refresh_from_db()
+        self.assertEqual(profile.recipe_count, 0)
+        self.assertEqual(profile.embedding, [])
+
+    def test_delta_needs_a_stored_sum(self):
+        """Test that profiles without a stored sum ask for a full recompute"""
+        self.assertFalse(tasks.apply_recipe_delta(self.user.id, added=[[1.0, 1.0]]))
+        UserEmbedding.objects.create(user=self.user, embedding=[1.0, 1.0])
+        self.assertFalse(tasks.apply_recipe_delta(self.user.id, added=[[1.0, 1.0]]))
+
+    @patch.object(tasks.refresh_user_embedding, 'apply_async')
+    def test_unknown_removed_vector_recomputes(self, mock_apply_async):
+        """Test that a deletion whose vector could not be read queues a full recompute"""
+        UserEmbedding.objects.create(
+            user=self.user, embedding=[1.0, 1.0], embedding_sum=[1.0, 1.0], recipe_count=1
+        )
+        tasks.schedule_user_embedding_update(self.user.id, removed=None)
+        mock_apply_async.assert_called_once()
+        self.assertTrue(cache.get(f"user_embedding:recompute:{self.user.id}"))
+
+        cache.clear()
+        mock_apply_async.reset_mock()
+        tasks.schedule_user_embedding_update(self.user.id, added=[[3.0, 3.0]])
+        mock_apply_async.assert_called_once()
+        self.assertIsNone(cache.get(f"user_embedding:recompute:{self.user.id}"))
+        self.assertEqual(UserEmbedding.objects.get(user=self.user).embedding, [2.0, 2.0])
+
+    @patch.object(tasks, 'update_user_embedding')
+    @patch.object(tasks.refresh_user_embedding, 'apply_async')
+    def test_burst_is_coalesced(self, mock_apply_async, mock_update):
+        """Test that requests made while a refresh is pending run as one debounced task"""
+        for _ in range(5):
+            tasks.request_user_embedding_refresh(self.user.id)
+        mock_apply_async.assert_called_once_with(
+            (self.user.id,), countdown=tasks.USER_EMBEDDING_DEBOUNCE_SECONDS
+        )
+        stats = tasks.get_user_embedding_stats()
+        self.assertEqual(stats['coalesced'], 4)
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertAlmostEqual(stats['coalesce_rate'], 0.8)
+
+        # A recompute request upgrades the pending refresh
+        self.assertFalse(tasks.request_user_embedding_refresh(self.user.id, recompute=True))
+        tasks.refresh_user_embedding(self.user.id)
+        mock_update.assert_called_once_with(self.user.id, recompute=True)
+        self.assertEqual(tasks.get_user_embedding_stats()['queue_depth'], 0)
+
+        # Once the task has started, the next request queues a new one
+        mock_update.reset_mock()
+        self.assertTrue(tasks.request_user_embedding_refresh(self.user.id))
+        tasks.refresh_user_embedding(self.user.id)
+        mock_update.assert_called_once_with(self.user.id, recompute=False)
+
+    @patch.object(tasks.refresh_user_embedding, 'apply_async')
+    def test_recommendations_page_queues_once(self, mock_apply_async):
+        """Test that reloading the recommendations page does not queue a task per hit"""
+        self.client.force_login(self.user)
+        for _ in range(3):
+            self.client.get(reverse('recommendations'))
+        mock_apply_async.assert_called_once()
+
+    def test_recompute_stores_sum_and_count(self):
+        """Test that a full recompute resets the incremental state"""
+        self.save_recipes(3)
+        vectors = np.arange(3 * DIMENSIONS, dtype=np.float32).reshape(3, DIMENSIONS)
+        rows = [(i + 1, vector_bytes(vector)) for i, vector in enumerate(vectors)]
+        get_connection, cursor = mock_connection(fetchall=[rows])
+
+        with patch.object(tasks, 'get_db_connection', get_connection):
+            tasks.update_user_embedding(self.user.id)
+
+        profile = UserEmbedding.objects.get(user=self.user)
+        self.assertEqual(profile.recipe_count, 3)
+        np.testing.assert_allclose(profile.embedding_sum, vectors.sum(axis=0))
+
+    @patch.object(tasks.refresh_user_embedding, 'apply_async')
+    def test_delete_recipe_decrements_profile(self, mock_apply_async):
+        """Test that deleting a saved recipe takes its vector out of the profile"""
+        recipe = SavedRecipe.objects.create(user=self.user, title="Soup", content="...", embedding_id=7)
+        UserEmbedding.objects.create(
+            user=self.user, embedding=[2.0, 2.0], embedding_sum=[4.0, 4.0], recipe_count=2
+        )
+        get_connection, cursor = mock_connection(fetchone=[(True, vector_bytes([1.0, 3.0]))])
+
+        self.client.force_login(self.user)
+        with patch('cooking.views.get_db_connection', get_connection):
+            response = self.client.post(reverse('delete_recipe', args=[recipe.id]))
+
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(UserEmbedding.objects.get(user=self.user).embedding, [3.0, 1.0])
+        mock_apply_async.assert_called_once()
+        self.assertIsNone(cache.get(f"user_embedding:recompute:{self.user.id}"))
+
+    def test_recommendations_page_fetches_recipes_in_two_queries(self):
+        """Test that the recommendations page reads saved and Supabase recipes in one query each, ordered by score"""
+        other = User.objects.create_user(username='otheruser', password='testpass123')
+        for embedding_id in (1, 2, 3):
+            SavedRecipe.objects.create(user=other, title=f"Saved {embedding_id}", content="...",
+                                       embedding_id=embedding_id, embedding_status=SavedRecipe.EMBEDDING_READY)
+        scores = {1: 0.5, 2: 0.9, 3: 0.7, 4: 0.8, 5: 0.6}
+        UserEmbedding.objects.create(user=self.user, embedding=[1.0], recommendations=[
+            {'recipe_id': recipe_id, 'similarity_score': score} for recipe_id, score in scores.items()
+        ])
+        get_connection, cursor = mock_connection(fetchall=[[
+            (recipe_id, f"Supabase {recipe_id}", 'Italian', 'Easy', ['pasta'], ['Boil'], []) for recipe_id in (4, 5)
+        ]])
+
+        self.client.force_login(self.user)
+        with patch('cooking.views.get_db_connection', get_connection), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('recommendations'))
+
+        cursor.execute.assert_called_once()
+        self.assertEqual(sorted(cursor.execute.call_args.args[1][0]), [4, 5])
+        saved_lookups = [query for query in queries.captured_queries if '"embedding_id" IN' in query['sql']]
+        self.assertEqual(len(saved_lookups), 1)
+        titles = [rec['recipe']['title'] for rec in response.context['recommended_recipes']]
+        self.assertEqual(titles, ['Saved 2', 'Supabase 4', 'Saved 3', 'Supabase 5', 'Saved 1'])
@@ -0,0 +1,214 @@
+from django.test import SimpleTestCase
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+from cooking import vector_index
+from cooking.vector_index import VectorIndex
+from cooking.tests.helpers import vector_bytes, mock_connection
+import numpy as np
+import tempfile
+import shutil
+import time
+import os
+
+DIMENSIONS = 16
+# Recent enough that the deletion tombstones are still within their retention
+UPDATED = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=1)
+
+class FakeTable:
+    """Serves recipe_embeddings rows and deletion tombstones to the index's refresh queries"""
+
+    def __init__(self, vectors):
+        self.rows = {i + 1: (vector, UPDATED + timedelta(minutes=i)) for i, vector in enumerate(vectors)}
+        self.deletions = {}
+        self.queries = 0
+        self.id_scans = 0
+
+    def delete(self, row_id, deleted_at):
+        """Delete a row as the tombstone trigger records it"""
+        del self.rows[row_id]
+        self.deletions[row_id] = deleted_at
+
+    def connection(self):
+        cursor = MagicMock()
+        results = []
+
+        def execute(sql, params=None):
+            self.queries += 1
+            if 'recipe_embedding_deletions' in sql:
+                if sql.strip().startswith('SELECT'):
+                    since, overlap = params
+                    results.append([
+                        (row_id, deleted_at) for row_id, deleted_at in self.deletions.items()
+                        if deleted_at > since - timedelta(seconds=overlap)
+                    ])
+                return
+            if 'vector_send' not in sql:
+                self.id_scans += 1
+                results.append([(row_id,) for row_id in self.rows])
+                return
+            since, overlap, missing = params
+            cutoff = None if since == '-infinity' else since - timedelta(seconds=overlap)
+            results.append([
+                (row_id, vector_bytes(vector), updated_at)
+                for row_id, (vector, updated_at) in self.rows.items()
+                if row_id in missing or (cutoff is None or updated_at > cutoff)
+            ])
+
+        cursor.execute.side_effect = execute
+        cursor.fetchall.side_effect = lambda: results.pop(0)
+        get_connection, _ = mock_connection(cursor=cursor)
+        return get_connection()
+
+class VectorIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        self.vectors = np.random.default_rng(0).standard_normal((200, DIMENSIONS)).astype(np.float32)
+        self.table = FakeTable(self.vectors)
+        patcher = patch.object(vector_index, 'get_db_connection', self.table.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exact_top_k(self, query, k, exclude=()):
+        ids = np.array(list(self.table.rows))
+        vectors = np.stack([vector for vector, _ in self.table.rows.values()])
+        scores = vectors @ query / np.linalg.norm(vectors, axis=1) / np.linalg.norm(query)
+        scores[np.isin(ids, list(exclude))] = -np.inf
+        return [int(ids[i]) for i in np.argsort(-scores)[:k]]
+
+    def test_search_matches_exact_ranking(self):
+        """Test that results match a brute-force cosine ranking, exclusions removed"""
+        index = VectorIndex(self.snapshot_dir)
+        query = self.vectors[3] + 0.1
+        exclude = self.exact_top_k(query, 3)
+
+        results = index.search(query, k=5, exclude=exclude)
+
+        self.assertEqual([recipe_id for recipe_id, _ in results], self.exact_top_k(query, 5, exclude))
+        self.assertTrue(all(recipe_id not in exclude for recipe_id, _ in results))
+        scores = [score for _, score in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_refresh_applies_inserts_updates_and_deletes(self):
+        """Test that a refresh picks up changed rows without reloading everything"""
+        index = VectorIndex(self.snapshot_dir, refresh_seconds=0)
+        index.search(self.vectors[0])
+
+        target = np.ones(DIMENSIONS, dtype=np.float32)
+        self.table.rows[5] = (target, UPDATED + timedelta(days=1))
+        self.table.rows[500] = (-target, UPDATED + timedelta(days=1))
+        self.table.delete(7, UPDATED + timedelta(days=1))
+
+        state = index.refresh()
+        self.assertEqual(len(state), 200)
+        # The full load was all delta; the update replaced its row rather than adding one
+        self.assertEqual(len(state.delta_ids), 200)
+        self.assertEqual(index.search(target, k=1)[0][0], 5)
+        self.assertEqual(index.search(-target, k=1)[0][0], 500)
+        self.assertNotIn(7, [recipe_id for recipe_id, _ in index.search(self.vectors[6], k=200)])
+        # Deletions came from the tombstones, not from reading every id
+        self.assertEqual(self.table.id_scans, 0)
+
+    def test_deletes_drop_snapshot_rows(self):
+        """Test that a tombstone masks its row out of a mapped snapshot"""
+        VectorIndex(self.snapshot_dir).write_snapshot()
+        index = VectorIndex(self.snapshot_dir, refresh_seconds=0)
+        index.get_state()
+        self.table.delete(43, UPDATED + timedelta(days=1))
+
+        state = index.refresh()
+        self.assertFalse(state.snapshot_live[state.snapshot_ids == 43].any())
+        self.assertEqual(len(state), 199)
+        self.assertNotEqual(index.search(self.vectors[42], k=1)[0][0], 43)
+
+    def test_snapshot_reconciles_rows_timestamps_missed(self):
+        """Test that writing a snapshot compares every id, catching what refreshes cannot"""
+        index = VectorIndex(self.snapshot_dir, refresh_seconds=0)
+        index.search(self.vectors[0])
+        target = np.ones(DIMENSIONS, dtype=np.float32)
+        self.table.rows[500] = (target, UPDATED)  # Committed after the overlap window
+        del self.table.rows[7]  # Deleted without a tombstone
+
+        state = index.refresh()
+        self.assertNotIn(500, state.indexed_ids())
+        self.assertIn(7, state.indexed_ids())
+
+        index.write_snapshot()
+        state = index.get_state()
+        self.assertIn(500, state.indexed_ids())
+        self.assertNotIn(7, state.indexed_ids())
+        self.assertEqual(self.table.id_scans, 1)
+
+    def test_snapshot_is_memory_mapped(self):
+        """Test that a new index maps the written snapshot and only holds later changes privately"""
+        VectorIndex(self.snapshot_dir).write_snapshot()
+        self.table.rows[9] = (np.ones(DIMENSIONS, dtype=np.float32), UPDATED + timedelta(days=1))
+
+        index = VectorIndex(self.snapshot_dir)
+        state = index.get_state()
+
+        self.assertIsInstance(state.snapshot_vectors, np.memmap)
+        # Row 200 is the newest in the snapshot, so the overlap window reads it again
+        self.assertEqual(sorted(state.delta_ids), [9, 200])
+        self.assertFalse(state.snapshot_live[state.snapshot_ids == 9].any())
+        self.assertEqual(index.search(np.ones(DIMENSIONS), k=1)[0][0], 9)
+        self.assertEqual(index.search(self.vectors[42], k=1)[0][0], 43)
+
+    def test_replaced_snapshots_outlive_a_grace_period(self):
+        """Test that a replaced snapshot is kept for two refresh intervals before it is removed"""
+        index = VectorIndex(self.snapshot_dir, refresh_seconds=60)
+        first = index.write_snapshot()
+        second = index.write_snapshot()
+        self.assertTrue(os.path.isdir(os.path.join(self.snapshot_dir, first)))
+
+        later = time.time_ns() + int(121e9)
+        with patch.object(vector_index.time, 'time_ns', return_value=later):
+            third = index.write_snapshot()
+        self.assertFalse(os.path.isdir(os.path.join(self.snapshot_dir, first)))
+        # Replaced just now, by the third
+        self.assertTrue(os.path.isdir(os.path.join(self.snapshot_dir, second)))
+        self.assertEqual(index.load_snapshot().snapshot, third)
+
+    def test_stale_index_refreshes_on_search(self):
+        """Test that searches only hit the database once the refresh interval has passed"""
+        index = VectorIndex(self.snapshot_dir, refresh_seconds=3600)
+        index.search(self.vectors[0])
+        queries = self.table.queries
+        index.search(self.vectors[1])
+        self.assertEqual(self.table.queries, queries)
+
+        index.refresh_seconds = 0
+        index.search(self.vectors[2])
+        self.assertEqual(self.table.queries, queries + 2)
+
+    def test_quantized_scan_reranks_exactly(self):
+        """Test that int8 and float16 snapshots return the exact ranking with exact scores"""
+        ids = np.arange(1, 201)
+        vectors = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        query = self.vectors[10] + 0.2
+        exact = VectorIndex(tempfile.mkdtemp(dir=self.snapshot_dir), quantization='float32')
+        exact.publish_snapshot(ids, vectors)
+        exact.load_snapshot()
+        expected = exact.search(query, k=5, exclude=[11])
+
+        for quantization in ('int8', 'float16'):
+            with self.subTest(quantization=quantization):
+                index = VectorIndex(tempfile.mkdtemp(dir=self.snapshot_dir), quantization=quantization,
+                                    rerank_candidates=20)
+                index.publish_snapshot(ids, vectors)
+                state = index.load_snapshot()
+
+                self.assertEqual(state.snapshot_codes.dtype, np.dtype(quantization))
+                self.assertIsInstance(state.snapshot_codes, np.memmap)
+                results = index.search(query, k=5, exclude=[11])
+                self.assertEqual([r[0] for r in results], [r[0] for r in expected])
+                np.testing.assert_allclose([r[1] for r in results], [r[1] for r in expected], rtol=1e-6)
+
+    def test_int8_codes_use_a_scale_per_vector(self):
+        """Test that int8 dot products stay close to float32 ones"""
+        vectors = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        codes, scales = vector_index.quantize(vectors, 'int8')
+        self.assertEqual(np.abs(codes).max(axis=1).tolist(), [127] * len(vectors))
+
+        query = vectors[0]
+        np.testing.assert_allclose(vector_index.quantized_scores(codes, scales, query), vectors @ query, atol=0.02)
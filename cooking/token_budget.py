@@ -0,0 +1,106 @@
+import os
+import time
+import logging
+import threading
+from functools import lru_cache
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+FALLBACK_ENCODING = "cl100k_base"
+
+# Total context window per model, prompt and completion together
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-16k': 16385,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Room left for the model's reply; a full HTML recipe runs to roughly 1000 tokens
+COMPLETION_TOKEN_RESERVE = int(os.getenv('COMPLETION_TOKEN_RESERVE', 1500))
+
+# Cost cap on conversation history, in real tokens, even when the window allows more
+MAX_HISTORY_TOKENS = int(os.getenv('CONTEXT_MAX_HISTORY_TOKENS', 3000))
+
+# Chat format overhead (OpenAI cookbook): every message is wrapped in role/separator
+# tokens and every reply is primed with a few more
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# How long to keep estimating before retrying a failed encoding load
+ENCODING_RETRY_SECONDS = 60
+
+_encodings_lock = threading.Lock()
+_encodings = {}
+_encoding_failed_at = {}
+
+def get_encoding(model=DEFAULT_MODEL):
+    """
+    Get the tiktoken encoding for a model, loading it once per process.
+
+    Returns None if the encoding cannot be loaded (tiktoken downloads BPE files
+    on first use), in which case counts fall back to an estimate.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+
+    failed_at = _encoding_failed_at.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_SECONDS:
+        return None
+
+    with _encodings_lock:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding(FALLBACK_ENCODING)
+            except Exception as e:
+                _encoding_failed_at[model] = time.monotonic()
+                logger.warning(f"Could not load tiktoken encoding for {model}, estimating tokens: {str(e)}")
+                return None
+            _encodings[model] = encoding
+    return encoding
+
+@lru_cache(maxsize=4096)
+def _encoded_length(text, model):
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """Count the tokens in a piece of text; results are cached per (text, model)."""
+    if not text:
+        return 0
+    if get_encoding(model) is None:
+        # Estimate about 3 characters per token, erring high since HTML tokenizes densely
+        return len(text) // 3 + 1
+    return _encoded_length(text, model)
+
+def count_message_tokens(content, model=DEFAULT_MODEL):
+    """Count the tokens a chat message costs in the prompt, including its formatting overhead."""
+    return count_tokens(content, model) + TOKENS_PER_MESSAGE
+
+def context_window(model=DEFAULT_MODEL):
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+def history_budget(model=DEFAULT_MODEL, reserved_tokens=0):
+    """
+    Get the number of tokens left for conversation history.
+
+    Args:
+        model (str): Model the prompt is for
+        reserved_tokens (int): Tokens already used by the fixed parts of the
+            prompt (system prompts, recipe context, the current message)
+
+    Returns:
+        int: Token budget for history messages, never negative
+    """
+    available = context_window(model) - COMPLETION_TOKEN_RESERVE - TOKENS_PER_REPLY - reserved_tokens
+    return max(min(available, MAX_HISTORY_TOKENS), 0)
@@ -11,6 +11,7 @@ urlpatterns = [
     path('chat/new/', views.new_chat, name='new_chat'),
     path('chat/<int:chat_id>/', views.chat_view, name='chat'),
     path('chat/<int:chat_id>/send/', views.send_message, name='send_message'),
+    path('chat/<int:chat_id>/stream/', views.stream_message, name='stream_message'),
     path('chat/<int:chat_id>/save-recipe/', views.save_recipe, name='save_recipe'),
     path('recipe/<int:recipe_id>/delete/', views.delete_recipe, name='delete_recipe'),
     path('recipe/<int:recipe_id>/', views.view_recipe, name='view_recipe'),
@@ -81,4 +81,125 @@ def extract_recipe_sections(content):
                 if line.strip() and not line.startswith('<')]
         sections['tips'] = tips
     
-    return sections 
\ No newline at end of file
+    return sections 
+
+def extract_ingredients(content):
+    """Extract ingredients from recipe content."""
+    try:
+        # Find the ingredients section
+        start = content.find('<h3 data-recipe="ingredients">')
+        if start == -1:
+            return []
+        
+        # Find the end of ingredients section
+        end = content.find('<h3 data-recipe="instructions">')
+        if end == -1:
+            end = content.find('<h3 data-recipe="tips">')
+        
+        if end == -1:
+            return []
+        
+        # Extract the ingredients list
+        ingredients_section = content[start:end]
+        
+        # Find all list items
+        ingredients = []
+        current_pos = 0
+        while True:
+            # Find the next list item
+            li_start = ingredients_section.find('<li>', current_pos)
+            if li_start == -1:
+                break
+                
+            li_end = ingredients_section.find('</li>', li_start)
+            if li_end == -1:
+                break
+                
+            # Extract the ingredient text
+            ingredient = ingredients_section[li_start + 4:li_end].strip()
+            if ingredient:
+                ingredients.append(ingredient)
+                
+            current_pos = li_end + 5
+            
+        return ingredients
+    except Exception as e:
+        print(f"Error extracting ingredients: {str(e)}")
+        return []
+
+def extract_instructions(content):
+    """Extract instructions from recipe content."""
+    try:
+        # Find the instructions section
+        start = content.find('<h3 data-recipe="instructions">')
+        if start == -1:
+            return []
+        
+        # Find the end of instructions section
+        end = content.find('<h3 data-recipe="tips">')
+        if end == -1:
+            return []
+        
+        # Extract the instructions list
+        instructions_section = content[start:end]
+        
+        # Find all list items
+        instructions = []
+        current_pos = 0
+        while True:
+            # Find the next list item
+            li_start = instructions_section.find('<li>', current_pos)
+            if li_start == -1:
+                break
+                
+            li_end = instructions_section.find('</li>', li_start)
+            if li_end == -1:
+                break
+                
+            # Extract the instruction text
+            instruction = instructions_section[li_start + 4:li_end].strip()
+            if instruction:
+                instructions.append(instruction)
+                
+            current_pos = li_end + 5
+            
+        return instructions
+    except Exception as e:
+        print(f"Error extracting instructions: {str(e)}")
+        return []
+
+def extract_tips(content):
+    """Extract tips from recipe content."""
+    try:
+        # Find the tips section
+        start = content.find('<h3 data-recipe="tips">')
+        if start == -1:
+            return []
+        
+        # Extract the tips list
+        tips_section = content[start:]
+        
+        # Find all list items
+        tips = []
+        current_pos = 0
+        while True:
+            # Find the next list item
+            li_start = tips_section.find('<li>', current_pos)
+            if li_start == -1:
+                break
+                
+            li_end = tips_section.find('</li>', li_start)
+            if li_end == -1:
+                break
+                
+            # Extract the tip text
+            tip = tips_section[li_start + 4:li_end].strip()
+            if tip:
+                tips.append(tip)
+                
+            current_pos = li_end + 5
+            
+        return tips
+    except Exception as e:
+        print(f"Error extracting tips: {str(e)}")
+        return []
@@ -0,0 +1,460 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from .db_connection import get_db_connection
+from .embeddings import decode_vector
+
+logger = logging.getLogger(__name__)
+
+# Answer recommendation queries from memory instead of pgvector
+ENABLED = os.getenv('VECTOR_INDEX_ENABLED', 'True') == 'True'
+
+# How stale the in-memory vectors may get before a search pulls changed rows
+REFRESH_SECONDS = float(os.getenv('VECTOR_INDEX_REFRESH_SECONDS', 60))
+
+# Rows updated this long before the newest one seen are fetched again, in case a
+# slow transaction committed with an earlier updated_at
+REFRESH_OVERLAP_SECONDS = 60
+
+# Deletion tombstones older than this are pruned when a snapshot is written; an
+# index that has not refreshed for longer compares every id instead
+DELETIONS_RETENTION_SECONDS = int(os.getenv('VECTOR_INDEX_DELETIONS_RETENTION_SECONDS', 7 * 24 * 3600))
+
+# Snapshots are memory-mapped, so every process on the host (web workers, Celery
+# prefork children) shares one copy of the vectors in the page cache
+SNAPSHOT_DIR = os.getenv('VECTOR_INDEX_DIR', os.path.join(os.path.dirname(__file__), 'vector_index'))
+CURRENT_FILE = 'CURRENT'
+
+# How snapshot vectors are scanned: 'float32' (exact), or 'int8' / 'float16'
+# codes at a quarter / half the memory, with the best candidates re-ranked
+# exactly against the float32 vectors, which are then only read for those rows
+QUANTIZATION = os.getenv('VECTOR_INDEX_QUANTIZATION', 'float32')
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+# Candidates re-ranked with float32 vectors after a quantized scan
+RERANK_CANDIDATES = int(os.getenv('VECTOR_INDEX_RERANK_CANDIDATES', 50))
+# Quantized rows widened to float32 at a time; small enough to stay in cache
+SCAN_BLOCK_ROWS = 64
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors, quantization):
+    """
+    Compress normalized vectors for scanning.
+
+    int8 uses a scale per vector (its largest component maps to 127), which
+    keeps more precision than one scale for the whole table.
+
+    Returns:
+        tuple: (codes, per-vector scales or None)
+    """
+    if quantization == 'float16':
+        return vectors.astype(np.float16), None
+    if quantization == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+
+
+def quantized_scores(codes, scales, query):
+    """Approximate dot products of quantized vectors with a float32 query."""
+    # NumPy has no int8/float16 matrix-vector kernel, and widening the whole
+    # matrix would allocate a float32 copy of it per query
+    scores = np.empty(len(codes), dtype=np.float32)
+    buffer = np.empty((SCAN_BLOCK_ROWS, codes.shape[1]), dtype=np.float32)
+    for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+        block = buffer[:min(SCAN_BLOCK_ROWS, len(codes) - start)]
+        block[...] = codes[start:start + len(block)]
+        np.dot(block, query, out=scores[start:start + len(block)])
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def _drop(ids, order, live, dropped):
+    # Clear the live flag of dropped ids, via the ids' sort order rather than a scan
+    if not len(ids) or not len(dropped):
+        return live
+    positions = np.minimum(np.searchsorted(ids, dropped, sorter=order), len(ids) - 1)
+    hit = ids[order[positions]] == dropped
+    live = live.copy()
+    live[order[positions[hit]]] = False
+    return live
+
+
+def _top(scores, k):
+    # Positions of the k highest finite scores, best first
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class _State:
+    """
+    An immutable view of the index, replaced whole on refresh.
+
+    The snapshot rows stay memory-mapped and are never copied; rows changed
+    since the snapshot are masked out of it and kept in a small private array.
+    """
+
+    def __init__(self, snapshot, snapshot_ids, snapshot_vectors, snapshot_live,
+                 delta_ids, delta_vectors, updated_through, snapshot_codes=None, snapshot_scales=None,
+                 snapshot_order=None):
+        self.snapshot = snapshot
+        self.snapshot_ids = snapshot_ids
+        # Sorts snapshot_ids, so refreshes find dropped rows without scanning them all
+        self.snapshot_order = np.argsort(snapshot_ids) if snapshot_order is None else snapshot_order
+        self.snapshot_vectors = snapshot_vectors
+        self.snapshot_codes = snapshot_codes
+        self.snapshot_scales = snapshot_scales
+        self.snapshot_live = snapshot_live
+        self.delta_ids = delta_ids
+        self.delta_vectors = delta_vectors
+        self.updated_through = updated_through
+
+    def __len__(self):
+        return int(self.snapshot_live.sum()) + len(self.delta_ids)
+
+    @property
+    def dimensions(self):
+        vectors = self.snapshot_vectors if len(self.snapshot_ids) else self.delta_vectors
+        return vectors.shape[1] if vectors.ndim == 2 else 0
+
+    def indexed_ids(self):
+        return np.concatenate([self.snapshot_ids[self.snapshot_live], self.delta_ids])
+
+
+def _empty_state(snapshot=None):
+    return _State(
+        snapshot, np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=bool),
+        np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), None
+    )
+
+
+class VectorIndex:
+    """
+    Memory-resident, normalized copy of recipe_embeddings for exact top-k cosine search.
+
+    Loaded on first use from the newest snapshot (or the database if there is
+    none) and kept current from recipe_embeddings.updated_at and the deletion
+    tombstones; every id is only compared when a snapshot is written.
+    """
+
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, refresh_seconds=REFRESH_SECONDS,
+                 quantization=QUANTIZATION, rerank_candidates=RERANK_CANDIDATES):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.snapshot_dir = snapshot_dir
+        self.refresh_seconds = refresh_seconds
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self._reset()
+
+    def _reset(self):
+        self._refresh_lock = threading.Lock()
+        self._state = None
+        self._refreshed_at = 0.0
+
+    def _current_snapshot(self):
+        try:
+            with open(os.path.join(self.snapshot_dir, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load_snapshot(self, name):
+        path = os.path.join(self.snapshot_dir, name)
+        with open(os.path.join(path, 'state.json')) as f:
+            meta = json.load(f)
+        ids = np.load(os.path.join(path, 'ids.npy'))
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        codes, scales = self._load_codes(path, vectors)
+        logger.info(f"Mapped vector index snapshot {name} ({len(ids)} recipes, {self.quantization})")
+        return _State(
+            name, ids, vectors, np.ones(len(ids), dtype=bool),
+            np.empty(0, dtype=np.int64), np.empty((0, vectors.shape[1]), dtype=np.float32),
+            datetime.fromisoformat(meta['updated_through']) if meta['updated_through'] else None,
+            codes, scales
+        )
+
+    def _load_codes(self, path, vectors):
+        if self.quantization == 'float32' or not len(vectors):
+            return None, None
+        codes_path = os.path.join(path, f"vectors_{self.quantization}.npy")
+        scales_path = os.path.join(path, 'scales_int8.npy')
+        if os.path.exists(codes_path):
+            codes = np.load(codes_path, mmap_mode='r')
+            return codes, np.load(scales_path) if self.quantization == 'int8' else None
+        # Written with another setting; quantized privately until the next snapshot
+        logger.info(f"Snapshot at {path} has no {self.quantization} codes, quantizing in memory")
+        return quantize(np.asarray(vectors), self.quantization)
+
+    def load_snapshot(self):
+        """Map the current snapshot as it is, without reading later changes from the database."""
+        with self._refresh_lock:
+            self._state = self._load_snapshot(self._current_snapshot())
+            self._refreshed_at = time.monotonic()
+            return self._state
+
+    def refresh(self, reconcile=False):
+        """
+        Bring the index up to date with recipe_embeddings.
+
+        Switches to a newer snapshot if one has been written, then applies rows
+        inserted, updated or deleted since. Searches keep using the previous
+        state until the new one is swapped in.
+
+        Args:
+            reconcile (bool): Also compare every id with the table, for rows a
+                timestamp missed (e.g. one committed after the overlap window)
+        """
+        with self._refresh_lock:
+            return self._refresh(reconcile)
+
+    def _refresh(self, reconcile=False):
+        # Called with the refresh lock held
+        state = self._state
+        snapshot = self._current_snapshot()
+        if state is None or (snapshot is not None and snapshot != state.snapshot):
+            try:
+                state = self._load_snapshot(snapshot) if snapshot else _empty_state()
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not map vector index snapshot {snapshot}, loading from the database: {str(e)}")
+                state = _empty_state()
+
+        self._state = self._apply_changes(state, reconcile)
+        self._refreshed_at = time.monotonic()
+        return self._state
+
+    def _apply_changes(self, state, reconcile=False):
+        since = state.updated_through
+        if since is not None and since < datetime.now(timezone.utc) - timedelta(seconds=DELETIONS_RETENTION_SECONDS):
+            # The tombstones since then may have been pruned
+            reconcile = True
+
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                stale_ids = missing_ids = np.empty(0, dtype=np.int64)
+                if reconcile and since is not None:
+                    cur.execute("SELECT id FROM public.recipe_embeddings WHERE embedding IS NOT NULL")
+                    current_ids = np.fromiter((row[0] for row in cur.fetchall()), dtype=np.int64)
+                    indexed_ids = state.indexed_ids()
+                    missing_ids = np.setdiff1d(current_ids, indexed_ids)
+                    stale_ids = np.setdiff1d(indexed_ids, current_ids)
+
+                # Inserted and updated rows by timestamp; a cleared embedding counts as a deletion
+                cur.execute("""
+                    SELECT id, vector_send(embedding), updated_at
+                    FROM public.recipe_embeddings
+                    WHERE updated_at > %s::timestamptz - %s * interval '1 second' OR id = ANY(%s)
+                """, (since or '-infinity', REFRESH_OVERLAP_SECONDS, missing_ids.tolist()))
+                rows = cur.fetchall()
+
+                # Nothing is indexed yet on a first load, so there is nothing to delete
+                deletions = []
+                if since is not None:
+                    cur.execute("""
+                        SELECT id, deleted_at
+                        FROM public.recipe_embedding_deletions
+                        WHERE deleted_at > %s::timestamptz - %s * interval '1 second'
+                    """, (since, REFRESH_OVERLAP_SECONDS))
+                    deletions = cur.fetchall()
+
+        # Both timestamps come from the database clock, so one watermark covers them
+        updated_through = max(
+            [row[2] for row in rows] + [row[1] for row in deletions] + ([since] if since else []), default=None
+        )
+        deleted_ids = {row[0] for row in deletions}
+        deleted_ids.update(row[0] for row in rows if row[1] is None)
+        rows = [row for row in rows if row[1] is not None and row[0] not in deleted_ids]
+        changed_ids = np.array([row[0] for row in rows], dtype=np.int64)
+
+        # Deleted and changed rows drop out of the snapshot and the delta
+        dropped_ids = np.concatenate([np.fromiter(deleted_ids, dtype=np.int64, count=len(deleted_ids)),
+                                      stale_ids, changed_ids])
+        snapshot_live = _drop(state.snapshot_ids, state.snapshot_order, state.snapshot_live, dropped_ids)
+        keep = ~np.isin(state.delta_ids, dropped_ids)
+        delta_ids = np.concatenate([state.delta_ids[keep], changed_ids])
+        if rows:
+            changed_vectors = _normalize(np.stack([decode_vector(row[1]) for row in rows]))
+            delta_vectors = changed_vectors if not keep.any() else np.concatenate([state.delta_vectors[keep], changed_vectors])
+        else:
+            delta_vectors = state.delta_vectors[keep] if keep.any() else np.empty((0, state.dimensions), dtype=np.float32)
+
+        return _State(
+            state.snapshot, state.snapshot_ids, state.snapshot_vectors, snapshot_live,
+            delta_ids, delta_vectors.astype(np.float32, copy=False), updated_through,
+            state.snapshot_codes, state.snapshot_scales, state.snapshot_order
+        )
+
+    def get_state(self):
+        """Get the current state, refreshing it first if it is stale."""
+        state = self._state
+        if state is None:
+            with self._refresh_lock:
+                # Another thread may have loaded it while this one waited
+                return self._state or self._refresh()
+        if time.monotonic() - self._refreshed_at > self.refresh_seconds and self._refresh_lock.acquire(blocking=False):
+            # One thread refreshes; the others answer from the state they already have
+            try:
+                return self._refresh()
+            except Exception as e:
+                logger.error(f"Vector index refresh failed, serving the previous state: {str(e)}")
+            finally:
+                self._refresh_lock.release()
+        return state
+
+    def search(self, query, k=5, exclude=()):
+        """
+        Find the recipes most similar to a query vector.
+
+        Args:
+            query (list): Query embedding, e.g. a user's profile embedding
+            k (int): Number of results
+            exclude (list): recipe_embeddings ids to leave out, e.g. the user's saved recipes
+
+        Returns:
+            list: (recipe id, cosine similarity) pairs, most similar first
+        """
+        state = self.get_state()
+        if not len(state):
+            return []
+
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        exclude = np.asarray(list(exclude), dtype=np.int64)
+        scores, ids = [], []
+
+        if len(state.snapshot_ids):
+            mask = state.snapshot_live
+            if len(exclude):
+                mask = mask & ~np.isin(state.snapshot_ids, exclude)
+            if state.snapshot_codes is None:
+                scores.append(np.where(mask, state.snapshot_vectors @ query, -np.inf))
+                ids.append(state.snapshot_ids)
+            else:
+                # Coarse pass over the codes, then exact scores for the best candidates
+                coarse = np.where(mask, quantized_scores(state.snapshot_codes, state.snapshot_scales, query), -np.inf)
+                rows = np.sort(_top(coarse, max(k, self.rerank_candidates)))
+                scores.append(np.asarray(state.snapshot_vectors[rows]) @ query)
+                ids.append(state.snapshot_ids[rows])
+
+        if len(state.delta_ids):
+            delta_scores = state.delta_vectors @ query
+            if len(exclude):
+                delta_scores[np.isin(state.delta_ids, exclude)] = -np.inf
+            scores.append(delta_scores)
+            ids.append(state.delta_ids)
+
+        scores = np.concatenate(scores)
+        ids = np.concatenate(ids)
+        return [(int(ids[i]), float(scores[i])) for i in _top(scores, k)]
+
+    def write_snapshot(self):
+        """
+        Refresh, then fold everything into a new snapshot for every process to map.
+
+        This refresh also compares every id with the table, and tombstones
+        past the retention period are pruned.
+
+        Snapshots are written to a fresh directory and published by replacing
+        the CURRENT file, so readers never see a partial one. Replaced
+        snapshots are removed after two refresh intervals, once every process
+        has had the chance to switch; one that still maps a removed snapshot
+        keeps its pages until it moves on.
+
+        Returns:
+            str: Name of the new snapshot
+        """
+        state = self.refresh(reconcile=True)
+        self._prune_deletions()
+        live = state.snapshot_live
+        ids = np.concatenate([state.snapshot_ids[live], state.delta_ids])
+        parts = [np.asarray(state.snapshot_vectors[live]), state.delta_vectors]
+        vectors = np.concatenate([part for part in parts if len(part)]) if len(ids) else np.empty((0, 0), dtype=np.float32)
+        return self.publish_snapshot(ids, vectors, state.updated_through)
+
+    def _prune_deletions(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM public.recipe_embedding_deletions
+                    WHERE deleted_at < now() - %s * interval '1 second'
+                """, (DELETIONS_RETENTION_SECONDS,))
+                pruned = cur.rowcount
+            conn.commit()
+        if pruned:
+            logger.info(f"Pruned {pruned} recipe embedding deletion tombstones")
+
+    def publish_snapshot(self, ids, vectors, updated_through=None):
+        """
+        Write normalized vectors as a new snapshot and make it the current one.
+
+        Args:
+            ids (numpy.ndarray): recipe_embeddings ids
+            vectors (numpy.ndarray): Their normalized float32 vectors, one row per id
+            updated_through (datetime): Newest updated_at the vectors reflect
+
+        Returns:
+            str: Name of the new snapshot
+        """
+        name = f"{time.time_ns()}-{os.getpid()}"
+        path = os.path.join(self.snapshot_dir, name)
+        os.makedirs(path)
+        np.save(os.path.join(path, 'ids.npy'), ids)
+        np.save(os.path.join(path, 'vectors.npy'), vectors.astype(np.float32, copy=False))
+        if self.quantization != 'float32' and len(ids):
+            codes, scales = quantize(vectors, self.quantization)
+            np.save(os.path.join(path, f"vectors_{self.quantization}.npy"), codes)
+            if scales is not None:
+                np.save(os.path.join(path, 'scales_int8.npy'), scales)
+        with open(os.path.join(path, 'state.json'), 'w') as f:
+            json.dump({
+                'updated_through': updated_through.isoformat() if updated_through else None,
+                'count': len(ids),
+            }, f)
+
+        current_tmp = os.path.join(self.snapshot_dir, f"{CURRENT_FILE}.{os.getpid()}")
+        with open(current_tmp, 'w') as f:
+            f.write(name)
+        os.replace(current_tmp, os.path.join(self.snapshot_dir, CURRENT_FILE))
+
+        self._remove_replaced_snapshots(name)
+
+        logger.info(f"Wrote vector index snapshot {name} ({len(ids)} recipes)")
+        return name
+
+    def _remove_replaced_snapshots(self, current):
+        # A snapshot was replaced when the next one was written, which its name records
+        snapshots = sorted(
+            (int(entry.split('-')[0]), entry) for entry in os.listdir(self.snapshot_dir)
+            if entry.split('-')[0].isdigit() and os.path.isdir(os.path.join(self.snapshot_dir, entry))
+        )
+        cutoff = time.time_ns() - int(2 * self.refresh_seconds * 1e9)
+        for (_, old), (replaced_at, _) in zip(snapshots, snapshots[1:]):
+            if old != current and replaced_at < cutoff:
+                shutil.rmtree(os.path.join(self.snapshot_dir, old), ignore_errors=True)
+
+
+index = VectorIndex()
+
+if hasattr(os, 'register_at_fork'):
+    # The refresh lock may be held by another thread at fork time; the mapped
+    # snapshot itself is inherited and stays shared
+    os.register_at_fork(after_in_child=lambda: setattr(index, '_refresh_lock', threading.Lock()))
+
+
+def search(query, k=5, exclude=()):
+    """Top-k cosine search over recipe_embeddings using the process-wide index."""
+    return index.search(query, k, exclude)
@@ -4,7 +4,7 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import View
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from .forms import CustomUserCreationForm
 from .models import ChatSession, Message, SavedRecipe, UserEmbedding
 import requests
@@ -12,17 +12,23 @@ import os
 from dotenv import load_dotenv
 import json
 from django.views.decorators.http import require_POST, require_http_methods
-from .context_manager import classify_message_type, create_conversation_summary, get_relevant_context
-from .langchain_setup import get_recipe_response
-from .embeddings import generate_recipe_embedding, store_recipe_embedding, get_recipe_recommendations
+from .context_manager import classify_message_type, get_relevant_context
+from .langchain_setup import get_recipe_response, aget_recipe_response, astream_recipe_response
+from .embeddings import get_recipe_recommendations, delete_unreferenced_recipe_embedding
 from .db_connection import get_db_connection
 from django.views.decorators.csrf import csrf_exempt
 from datetime import datetime
 from django.core.exceptions import PermissionDenied
 import traceback
+import time
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
-from .tasks import update_user_embedding
+from .tasks import (
+    schedule_conversation_summary, schedule_user_embedding_update, request_user_embedding_refresh,
+    schedule_recipe_embedding,
+)
+from .decorators import async_login_required
+from asgiref.sync import sync_to_async
 import logging
 
 # Set up logger
@@ -159,17 +165,25 @@ def chat_view(request, chat_id):
     user = request.user
     return render(request, 'cooking/chat.html', {'chat': chat, 'messages': messages, 'user': user})
 
-@login_required
-def send_message(request, chat_id):
+async def _aget_chat_or_404(chat_id, user):
+    """Async equivalent of get_object_or_404 for the user's chat session."""
+    try:
+        return await ChatSession.objects.aget(id=chat_id, user=user)
+    except ChatSession.DoesNotExist:
+        raise Http404("No ChatSession matches the given query.")
+
+@async_login_required
+async def send_message(request, chat_id):
     if request.method == 'POST':
-        chat = get_object_or_404(ChatSession, id=chat_id, user=request.user)
+        user = await request.auser()
+        chat = await _aget_chat_or_404(chat_id, user)
         user_message = request.POST.get('message')
         
         # Classify the message type
         message_type = classify_message_type(user_message)
         
         # Save user message
-        Message.objects.create(
+        await Message.objects.acreate(
             chat=chat,
             role='user',
             content=user_message,
@@ -177,15 +191,15 @@ def send_message(request, chat_id):
         )
         
         try:
-            # Check if we need to summarize the conversation
+            # Summarize in the background; this reply uses the current summary
             if chat.should_summarize():
-                create_conversation_summary(chat)
+                await sync_to_async(schedule_conversation_summary)(chat.id)
             
             # Get response using LangChain
-            ai_message = get_recipe_response(chat, user_message)
+            ai_message = await aget_recipe_response(chat, user_message)
             
             # Save AI message
-            Message.objects.create(
+            await Message.objects.acreate(
                 chat=chat,
                 role='assistant',
                 content=ai_message,
@@ -205,6 +219,66 @@ def send_message(request, chat_id):
     
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
+@async_login_required
+async def stream_message(request, chat_id):
+    """Stream the assistant's reply to the client as server-sent events while it is generated."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+    user = await request.auser()
+    chat = await _aget_chat_or_404(chat_id, user)
+    user_message = request.POST.get('message')
+
+    # Classify the message type
+    message_type = classify_message_type(user_message)
+
+    # Save user message
+    await Message.objects.acreate(
+        chat=chat,
+        role='user',
+        content=user_message,
+        message_type=message_type
+    )
+
+    async def event_stream():
+        started_at = time.perf_counter()
+        time_to_first_token = None
+        tokens = []
+
+        try:
+            # Summarize in the background; this reply uses the current summary
+            if chat.should_summarize():
+                await sync_to_async(schedule_conversation_summary)(chat.id)
+
+            async for token in astream_recipe_response(chat, user_message):
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started_at
+                    logger.info(f"Time to first token for chat {chat.id}: {time_to_first_token:.3f}s")
+                tokens.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+
+            ai_message = ''.join(tokens)
+
+            # Save AI message once the stream has completed
+            await Message.objects.acreate(
+                chat=chat,
+                role='assistant',
+                content=ai_message,
+                message_type='system' if message_type == 'recipe_creation' else message_type
+            )
+            logger.info(f"Streamed response for chat {chat.id} in {time.perf_counter() - started_at:.3f}s")
+
+            yield f"event: done\ndata: {json.dumps({'message': ai_message, 'time_to_first_token': time_to_first_token})}\n\n"
+
+        except Exception as e:
+            logger.error(f"Error streaming response for chat {chat.id}: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': f'An unexpected error occurred: {str(e)}'})}\n\n"
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
 @login_required
 def save_recipe(request, chat_id):
     if request.method == 'POST':
@@ -224,20 +298,6 @@ def save_recipe(request, chat_id):
             
             chat_session = get_object_or_404(ChatSession, id=chat_id, user=request.user)
             
-            # Prepare recipe data for embedding
-            recipe_data = {
-                'title': title,
-                'cuisine': cuisine_type,
-                'difficulty': difficulty,
-                'ingredients': extract_ingredients(content),
-                'instructions': extract_instructions(content),
-                'tips': extract_tips(content)
-            }
-            
-            # Generate and store embedding
-            recipe_with_embedding = generate_recipe_embedding(recipe_data)
-            stored_embedding = store_recipe_embedding(recipe_with_embedding)
-            
             # Check if recipe already exists for this chat
             existing_recipe = SavedRecipe.objects.filter(
                 chat_session=chat_session,
@@ -245,14 +305,14 @@ def save_recipe(request, chat_id):
             ).first()
             
             if existing_recipe:
-                # Update existing recipe
+                # Update existing recipe; its current embedding stays linked until the new one is ready
                 existing_recipe.title = title
                 existing_recipe.content = content
                 existing_recipe.difficulty = difficulty
                 existing_recipe.cuisine_type = cuisine_type
                 existing_recipe.prep_time = prep_time
                 existing_recipe.servings = servings
-                existing_recipe.embedding_id = stored_embedding['id']
+                existing_recipe.embedding_status = SavedRecipe.EMBEDDING_PENDING
                 existing_recipe.save()
                 recipe_id = existing_recipe.id
             else:
@@ -266,17 +326,18 @@ def save_recipe(request, chat_id):
                     cuisine_type=cuisine_type,
                     prep_time=prep_time,
                     servings=servings,
-                    embedding_id=stored_embedding['id']
+                    embedding_status=SavedRecipe.EMBEDDING_PENDING
                 )
                 recipe_id = recipe.id
             
-            # Trigger user embedding update
-            update_user_embedding.delay(request.user.id)
+            # Embedded in the background, which then updates the user's profile and recommendations
+            schedule_recipe_embedding(recipe_id)
             
             return JsonResponse({
                 'success': True,
                 'message': 'Recipe saved successfully',
-                'recipe_id': recipe_id
+                'recipe_id': recipe_id,
+                'embedding_status': SavedRecipe.EMBEDDING_PENDING
             })
                 
         except Exception as e:
@@ -284,127 +345,6 @@ def save_recipe(request, chat_id):
             
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
-def extract_ingredients(content):
-    """Extract ingredients from recipe content."""
-    try:
-        # Find the ingredients section
-        start = content.find('<h3 data-recipe="ingredients">')
-        if start == -1:
-            return []
-        
-        # Find the end of ingredients section
-        end = content.find('<h3 data-recipe="instructions">')
-        if end == -1:
-            end = content.find('<h3 data-recipe="tips">')
-        
-        if end == -1:
-            return []
-        
-        # Extract the ingredients list
-        ingredients_section = content[start:end]
-        
-        # Find all list items
-        ingredients = []
-        current_pos = 0
-        while True:
-            # Find the next list item
-            li_start = ingredients_section.find('<li>', current_pos)
-            if li_start == -1:
-                break
-                
-            li_end = ingredients_section.find('</li>', li_start)
-            if li_end == -1:
-                break
-                
-            # Extract the ingredient text
-            ingredient = ingredients_section[li_start + 4:li_end].strip()
-            if ingredient:
-                ingredients.append(ingredient)
-                
-            current_pos = li_end + 5
-            
-        return ingredients
-    except Exception as e:
-        print(f"Error extracting ingredients: {str(e)}")
-        return []
-
-def extract_instructions(content):
-    """Extract instructions from recipe content."""
-    try:
-        # Find the instructions section
-        start = content.find('<h3 data-recipe="instructions">')
-        if start == -1:
-            return []
-        
-        # Find the end of instructions section
-        end = content.find('<h3 data-recipe="tips">')
-        if end == -1:
-            return []
-        
-        # Extract the instructions list
-        instructions_section = content[start:end]
-        
-        # Find all list items
-        instructions = []
-        current_pos = 0
-        while True:
-            # Find the next list item
-            li_start = instructions_section.find('<li>', current_pos)
-            if li_start == -1:
-                break
-                
-            li_end = instructions_section.find('</li>', li_start)
-            if li_end == -1:
-                break
-                
-            # Extract the instruction text
-            instruction = instructions_section[li_start + 4:li_end].strip()
-            if instruction:
-                instructions.append(instruction)
-                
-            current_pos = li_end + 5
-            
-        return instructions
-    except Exception as e:
-        print(f"Error extracting instructions: {str(e)}")
-        return []
-
-def extract_tips(content):
-    """Extract tips from recipe content."""
-    try:
-        # Find the tips section
-        start = content.find('<h3 data-recipe="tips">')
-        if start == -1:
-            return []
-        
-        # Extract the tips list
-        tips_section = content[start:]
-        
-        # Find all list items
-        tips = []
-        current_pos = 0
-        while True:
-            # Find the next list item
-            li_start = tips_section.find('<li>', current_pos)
-            if li_start == -1:
-                break
-                
-            li_end = tips_section.find('</li>', li_start)
-            if li_end == -1:
-                break
-                
-            # Extract the tip text
-            tip = tips_section[li_start + 4:li_end].strip()
-            if tip:
-                tips.append(tip)
-                
-            current_pos = li_end + 5
-            
-        return tips
-    except Exception as e:
-        print(f"Error extracting tips: {str(e)}")
-        return []
-
 @login_required
 def delete_recipe(request, recipe_id):
     if request.method == 'POST':
@@ -413,22 +353,28 @@ def delete_recipe(request, recipe_id):
             recipe = get_object_or_404(SavedRecipe, id=recipe_id, user=request.user)
             
             # Delete the embedding from Supabase if it exists
+            removed_vectors = None
             if recipe.embedding_id:
                 try:
-                    # Connect to database and delete embedding
+                    # Delete the embedding unless another recipe shares it, keeping its vector for the profile update
                     with get_db_connection() as conn:
                         with conn.cursor() as cur:
-                            cur.execute("""
-                                DELETE FROM public.recipe_embeddings 
-                                WHERE id = %s
-                            """, (recipe.embedding_id,))
+                            _, removed_vector = delete_unreferenced_recipe_embedding(
+                                cur, recipe.embedding_id, recipe.id
+                            )
                             conn.commit()
+                    if removed_vector is not None:
+                        removed_vectors = [removed_vector]
                 except Exception as e:
                     print(f"Error deleting embedding: {str(e)}")
                     # Continue with recipe deletion even if embedding deletion fails
             
             # Delete the recipe from Django database
             recipe.delete()
+
+            # Take the recipe out of the user's profile embedding (recomputed if its vector is unknown)
+            if recipe.embedding_id:
+                schedule_user_embedding_update(request.user.id, removed=removed_vectors)
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
@@ -590,60 +536,9 @@ def vllm_chat_view(request):
     
     return render(request, 'cooking/vllm_chat.html')
 
-@login_required
-def recommendations(request):
-    """
-    View for displaying recipe recommendations for the logged-in user.
-    """
-    try:
-        # Get the user's embedding and recommendations
-        user_embedding = UserEmbedding.objects.filter(user=request.user).first()
-        print(f"User embedding found: {user_embedding is not None}")
-        
-        if not user_embedding or not user_embedding.recommendations:
-            print("No recommendations found, triggering task")
-            # If no recommendations exist, trigger the task to generate them
-            from .tasks import update_user_embedding
-            update_user_embedding.delay(request.user.id)
-            messages.info(request, "We're preparing your recommendations. Please check back in a moment.")
-            return redirect('home')
-        
-        print(f"Found recommendations: {user_embedding.recommendations}")
-        
-        # Get the recommended recipes from Supabase
-        recommended_recipes = []
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                for rec in user_embedding.recommendations:
-                    # First try to get the recipe from SavedRecipe model
-                    saved_recipe = SavedRecipe.objects.filter(embedding_id=rec['recipe_id']).first()
-                    
-                    if saved_recipe:
-                        # If we found a saved recipe, use its content
-                        recommended_recipes.append({
-                            'recipe': {
-                                'id': saved_recipe.id,
-                                'title': saved_recipe.title,
-                                'cuisine_type': saved_recipe.cuisine_type,
-                                'difficulty': saved_recipe.difficulty,
-                                'content': saved_recipe.content
-                            },
-                            'similarity_score': rec['similarity_score']
-                        })
-                    else:
-                        # If no saved recipe found, get from Supabase
-                        cur.execute("""
-                            SELECT 
-                                id, title, cuisine, difficulty, 
-                                ingredients, instructions, tips
-                            FROM public.recipe_embeddings 
-                            WHERE id = %s
-                        """, (rec['recipe_id'],))
-                        result = cur.fetchone()
-                        print(f"Looking for recipe with embedding_id {rec['recipe_id']}, found: {result is not None}")
-                        if result:
-                            # Format the content like SavedRecipe
-                            content = f"""<h2 data-recipe="title">🍳 {result[1]}</h2>
+def _format_recipe_embedding(result):
+    """Format a recipe_embeddings row (id, title, cuisine, difficulty, ingredients, instructions, tips) like SavedRecipe content."""
+    content = f"""<h2 data-recipe="title">🍳 {result[1]}</h2>
 
 <h3 data-recipe="difficulty">⚡ Difficulty</h3>
 {result[3] or 'Not specified'}
@@ -655,47 +550,130 @@ def recommendations(request):
 
 <ul>
 """
-                            # Add ingredients
-                            if result[4]:
-                                for ingredient in result[4]:
-                                    content += f"<li>{ingredient}</li>\n"
-                            content += "</ul>\n\n"
+    # Add ingredients
+    if result[4]:
+        for ingredient in result[4]:
+            content += f"<li>{ingredient}</li>\n"
+    content += "</ul>\n\n"
 
-                            # Add instructions
-                            content += """<h3 data-recipe="instructions">📋 Instructions</h3>
+    # Add instructions
+    content += """<h3 data-recipe="instructions">📋 Instructions</h3>
 
 <ol>
 """
-                            if result[5]:
-                                for instruction in result[5]:
-                                    content += f"<li>{instruction}</li>\n"
-                            content += "</ol>\n\n"
+    if result[5]:
+        for instruction in result[5]:
+            content += f"<li>{instruction}</li>\n"
+    content += "</ol>\n\n"
 
-                            # Add tips if they exist
-                            if result[6]:
-                                content += """<h3 data-recipe="tips">💡 Tips</h3>
+    # Add tips if they exist
+    if result[6]:
+        content += """<h3 data-recipe="tips">💡 Tips</h3>
 
 <ul>
 """
-                                for tip in result[6]:
-                                    content += f"<li>{tip}</li>\n"
-                                content += "</ul>\n"
-
-                            recommended_recipes.append({
-                                'recipe': {
-                                    'id': result[0],
-                                    'title': result[1],
-                                    'cuisine_type': result[2],
-                                    'difficulty': result[3],
-                                    'content': content
-                                },
-                                'similarity_score': rec['similarity_score']
-                            })
+        for tip in result[6]:
+            content += f"<li>{tip}</li>\n"
+        content += "</ul>\n"
+    return content
+
+@login_required
+def recommendations(request):
+    """
+    View for displaying recipe recommendations for the logged-in user.
+    """
+    try:
+        # Get the user's embedding and recommendations
+        user_embedding = UserEmbedding.objects.filter(user=request.user).first()
+        print(f"User embedding found: {user_embedding is not None}")
+        
+        # Recipes still being embedded are not yet part of the recommendations
+        pending_count = SavedRecipe.objects.filter(
+            user=request.user,
+            embedding_status=SavedRecipe.EMBEDDING_PENDING
+        ).count()
+        
+        if not user_embedding or not user_embedding.recommendations:
+            if not pending_count:
+                print("No recommendations found, triggering task")
+                # If no recommendations exist, trigger the task to generate them; repeated
+                # page loads while it is pending are folded into the same task
+                request_user_embedding_refresh(
+                    request.user.id,
+                    recompute=not (user_embedding and user_embedding.embedding)
+                )
+            # Otherwise the embedding tasks refresh the recommendations when they finish
+            messages.info(request, "We're preparing your recommendations. Please check back in a moment.")
+            return redirect('home')
+        
+        if pending_count:
+            messages.info(request, "Your recommendations will update once your latest saved recipes finish processing.")
+        
+        print(f"Found recommendations: {user_embedding.recommendations}")
+        
+        recommendations = user_embedding.recommendations
+        recipe_ids = [rec['recipe_id'] for rec in recommendations]
+        
+        # Recommended recipes someone has saved, in one query; the first by the
+        # model's ordering wins where several users saved the same recipe
+        saved_recipes = {}
+        for saved_recipe in SavedRecipe.objects.filter(embedding_id__in=recipe_ids).only(
+            'id', 'title', 'cuisine_type', 'difficulty', 'content', 'embedding_id', 'created_at'
+        ):
+            saved_recipes.setdefault(saved_recipe.embedding_id, saved_recipe)
+        
+        # The rest from Supabase, also in one query
+        embedded_recipes = {}
+        missing_ids = [recipe_id for recipe_id in recipe_ids if recipe_id not in saved_recipes]
+        if missing_ids:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT 
+                            id, title, cuisine, difficulty, 
+                            ingredients, instructions, tips
+                        FROM public.recipe_embeddings 
+                        WHERE id = ANY(%s)
+                    """, (missing_ids,))
+                    embedded_recipes = {result[0]: result for result in cur.fetchall()}
+        
+        recommended_recipes = []
+        for rec in recommendations:
+            saved_recipe = saved_recipes.get(rec['recipe_id'])
+            if saved_recipe:
+                # If we found a saved recipe, use its content
+                recommended_recipes.append({
+                    'recipe': {
+                        'id': saved_recipe.id,
+                        'title': saved_recipe.title,
+                        'cuisine_type': saved_recipe.cuisine_type,
+                        'difficulty': saved_recipe.difficulty,
+                        'content': saved_recipe.content
+                    },
+                    'similarity_score': rec['similarity_score']
+                })
+                continue
+            
+            result = embedded_recipes.get(rec['recipe_id'])
+            print(f"Looking for recipe with embedding_id {rec['recipe_id']}, found: {result is not None}")
+            if result:
+                recommended_recipes.append({
+                    'recipe': {
+                        'id': result[0],
+                        'title': result[1],
+                        'cuisine_type': result[2],
+                        'difficulty': result[3],
+                        'content': _format_recipe_embedding(result)
+                    },
+                    'similarity_score': rec['similarity_score']
+                })
+        recommended_recipes.sort(key=lambda item: item['similarity_score'], reverse=True)
         
         print(f"Final recommended_recipes list length: {len(recommended_recipes)}")
         
         context = {
             'recommended_recipes': recommended_recipes,
+            'pending_recipe_count': pending_count,
             'title': 'Recommended Recipes'
         }
         return render(request, 'cooking/recommendations.html', context)